@@ -0,0 +1,114 @@
+"""End-to-end benchmark of the crawl against the synthetic site farm.
+
+Serves the farm from `site_farm.py`, crawls all of its sites with `scrape_emails.py` in a
+temporary directory through the farm as an HTTP proxy, and reports pages/s, emails found
+compared to emails the farm sites have, requests that didn't produce a parsed page and
+peak memory of the crawl process. Sites are the same for the same seed, so runs with
+different settings are comparable. Run from the repository root:
+
+    python benchmarks/crawl_benchmark.py --sites 1000 -s MAX_PAGES_PER_DOMAIN=20 -s CONCURRENT_REQUESTS=128
+"""
+import argparse, json, os, resource, shutil, subprocess, sys, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from email_priority import is_satisfying_email, priority_email_keywords
+from email_pipelines import read_emails_journal
+from site_farm import SiteFarm, start_farm
+
+SCRAPE_EMAILS = os.path.join(os.path.dirname(__file__), '..', 'scrape_emails.py')
+
+# The browser doesn't go through the farm proxy, so JavaScript sites aren't rendered
+DEFAULT_SETTINGS = ['BROWSER_FALLBACK=false', 'LOG_LEVEL=INFO']
+
+def stat_sum(stats, prefix):
+    return sum(value for name, value in stats.items() if name.startswith(prefix) and isinstance(value, (int, float)))
+
+def crawl(farm, work_dir, settings):
+    """Crawl the farm with scrape_emails.py, returns its stats, found emails and peak memory in MB"""
+    companies_path = os.path.join(work_dir, 'companies.jsonl')
+    stats_path = os.path.join(work_dir, 'stats.json')
+    farm.write_companies(companies_path)
+
+    server = start_farm(farm)
+    proxy = f'http://127.0.0.1:{server.server_port}'
+    env = { **os.environ, 'http_proxy': proxy, 'HTTP_PROXY': proxy, 'no_proxy': '', 'NO_PROXY': '' }
+    command = [sys.executable, os.path.abspath(SCRAPE_EMAILS), companies_path, '--no-cache', '--stats-file', stats_path]
+    command += [f'--set={setting}' for setting in DEFAULT_SETTINGS + settings]
+
+    with open(os.path.join(work_dir, 'crawl.log'), 'w') as log:
+        started_at = time.perf_counter()
+        exit_code = subprocess.call(command, cwd=work_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        elapsed = time.perf_counter() - started_at
+    server.shutdown()
+    if exit_code != 0:
+        raise RuntimeError(f'Crawl failed with exit code {exit_code}, see {log.name}')
+
+    with open(stats_path) as f:
+        stats = json.load(f)
+    stats.setdefault('elapsed_time_seconds', elapsed)
+    records = read_emails_journal(os.path.join(work_dir, 'found_emails.jsonl'))
+    # In kilobytes on Linux, the crawl is the only child process
+    peak_memory = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return stats, records, peak_memory
+
+def report(farm, stats, records, peak_memory):
+    expected = { email for site in farm for email in site.static_emails() }
+    found = { record['email'] for record in records }
+    satisfying_keywords = priority_email_keywords[:priority_email_keywords.index('contact')]
+    sites_with_emails = sum(1 for site in farm if site.static_emails())
+    satisfied_sites = { email.split('@')[1] for email in found & expected if is_satisfying_email(email, satisfying_keywords) }
+
+    pages = stats.get('link_scoring/pages_parsed', 0)
+    requests = stats.get('downloader/request_count', 0)
+    elapsed = stats['elapsed_time_seconds']
+    return {
+        'sites': farm.size,
+        'sites_with_emails': sites_with_emails,
+        'elapsed_seconds': round(elapsed, 1),
+        'requests': requests,
+        'pages_parsed': pages,
+        'pages_per_second': round(pages / elapsed, 1),
+        'requests_per_second': round(requests / elapsed, 1),
+        'requests_wasted': requests - pages,
+        'redirects': stat_sum(stats, 'downloader/response_status_count/3'),
+        'not_found': stats.get('downloader/response_status_count/404', 0),
+        'download_errors': stats.get('downloader/exception_count', 0),
+        'downloads_stopped': stat_sum(stats, 'download_guard/') - stat_sum(stats, 'download_guard/bytes_saved') +
+                             stats.get('done_sites/downloads_stopped', 0),
+        'emails_expected': len(expected),
+        'emails_found': len(found & expected),
+        'emails_unexpected': len(found - expected),
+        'email_recall': round(len(found & expected) / max(len(expected), 1), 3),
+        'sites_with_satisfying_email': len(satisfied_sites),
+        'pages_per_email': round(pages / max(len(found), 1), 1),
+        'peak_memory_mb': round(peak_memory, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Crawl the synthetic site farm and report crawl performance.')
+    parser.add_argument('--sites', type=int, default=1000, help='number of farm sites to crawl')
+    parser.add_argument('--seed', type=int, default=42, help='farm sites are the same for the same seed')
+    parser.add_argument('-s', '--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='override a scrape_emails.py setting, can be given several times')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON e.g. to compare runs')
+    parser.add_argument('--keep', action='store_true', help="keep the crawl directory with its log, stats and found emails")
+    args = parser.parse_args()
+
+    farm = SiteFarm(args.sites, args.seed)
+    work_dir = tempfile.mkdtemp(prefix='crawl_benchmark_')
+    # A failed crawl leaves its directory for its log
+    results = report(farm, *crawl(farm, work_dir, args.set))
+    if args.keep:
+        print(f'Crawl directory: {work_dir}', file=sys.stderr)
+    else:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, value in results.items():
+            print(f'{name.replace("_", " "):28} {value}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Micro-benchmarks of the hot functions of the crawl, over corpora derived from scraped_companies/*.json.
+
+Every company with a website gets generated pages with emails of its domain, links
+of its site and a list of emails to pick the most relevant one from, so the numbers
+reflect real domain names and their distribution. Run from the repository root:
+
+    python benchmarks/micro_benchmarks.py
+"""
+import argparse, glob, os, random, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from scrapy.link import Link
+from company_files import iter_companies
+from company_index import host, registrable_domain
+from email_extraction import extract_emails
+from email_priority import most_relevant_email_or_default, priority_email_keywords
+from email_spider import domain as url_domain, remove_fragment
+from extract_emails_benchmark import generate_page
+from link_scoring import LinkScorer, prioritize_links
+
+# Same as PRIORITY_URL_KEYWORDS setting of scrape_emails.py
+PRIORITY_URL_KEYWORDS = ['career', 'job', 'work', 'employment', 'join', 'opportunity', 'recruiting', 'apply', 'opening',
+                         'position', 'talent', 'vacancy', 'vacancies', 'hiring', 'contact', 'about', 'connect', 'team', 'hire']
+
+PATH_SEGMENTS = ['about', 'about-us', 'careers', 'jobs', 'contact', 'team', 'blog', 'news', 'products', 'solutions',
+                 'services', 'customers', 'partners', 'events', 'resources', 'en', 'de', 'support', 'privacy', 'legal']
+
+EMAIL_USERNAMES = priority_email_keywords + ['sales', 'support', 'press', 'marketing', 'john.smith', 'a.jones', 'noreply']
+
+def company_domains(pattern):
+    domains = []
+    for path in sorted(glob.glob(pattern)):
+        for company in iter_companies(path):
+            if company.get('url'):
+                domains.append(registrable_domain(host(company['url'])))
+    return list(dict.fromkeys(domains))
+
+def generate_links(domain, count, rnd):
+    links = []
+    for _ in range(count):
+        path = '/'.join(rnd.choices(PATH_SEGMENTS, k=rnd.randint(1, 3)))
+        if rnd.random() < 0.3:
+            path += f'/item-{rnd.randint(1, 1000)}'
+        fragment = rnd.choice(['', '', '#top', '#main-content'])
+        links.append(Link(f'https://www.{domain}/{path}{fragment}'))
+    return links
+
+def generate_emails(domain, rnd):
+    return [f'{username}@{domain}' for username in rnd.sample(EMAIL_USERNAMES, rnd.randint(1, 12))]
+
+def best_of(func, repeat):
+    """Shortest time of several runs, the least disturbed by anything else running"""
+    times = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started_at)
+    return min(times)
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the crawl hot functions.')
+    parser.add_argument('--companies', default=os.path.join(os.path.dirname(__file__), '..', 'scraped_companies', '*.json'),
+                        help='companies files the corpora are derived from')
+    parser.add_argument('--repeat', type=int, default=5, help='every benchmark is run this many times, the best time is reported')
+    args = parser.parse_args()
+
+    rnd = random.Random(42)
+    domains = company_domains(args.companies)
+    if not domains:
+        sys.exit(f'No companies with websites found in {args.companies}')
+
+    pages = [(generate_page(domain, rnd.choice([20_000, 100_000]), rnd), domain) for domain in domains[:200]]
+    site_links = [generate_links(domain, 100, rnd) for domain in domains]
+    urls = [link.url for links in site_links for link in links]
+    email_lists = [generate_emails(domain, rnd) for domain in domains]
+    link_scorer = LinkScorer(PRIORITY_URL_KEYWORDS)
+
+    print(f'Corpora of {len(domains)} company domains: {len(pages)} pages, {len(urls)} links, {len(email_lists)} email lists')
+
+    page_bytes = sum(len(body) for body, _ in pages)
+    elapsed = best_of(lambda: [extract_emails(body, {domain}) for body, domain in pages], args.repeat)
+    print(f'extract_emails:                  {page_bytes / elapsed / 1024 / 1024:12.1f} MB/s')
+
+    elapsed = best_of(lambda: [prioritize_links(links, PRIORITY_URL_KEYWORDS) for links in site_links], args.repeat)
+    print(f'prioritize_links:                {len(urls) / elapsed:12.0f} links/s')
+
+    elapsed = best_of(lambda: [link_scorer.top_links(links, 50) for links in site_links], args.repeat)
+    print(f'LinkScorer.top_links:            {len(urls) / elapsed:12.0f} links/s')
+
+    elapsed = best_of(lambda: [remove_fragment(url) for url in urls], args.repeat)
+    print(f'remove_fragment:                 {len(urls) / elapsed:12.0f} urls/s')
+
+    elapsed = best_of(lambda: [url_domain(url) for url in urls], args.repeat)
+    print(f'domain:                          {len(urls) / elapsed:12.0f} urls/s')
+
+    elapsed = best_of(lambda: [most_relevant_email_or_default(emails, priority_email_keywords) for emails in email_lists], args.repeat)
+    print(f'most_relevant_email_or_default:  {len(email_lists) / elapsed:12.0f} lists/s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+"""Synthetic farm of company websites served by one local HTTP server.
+
+Thousands of generated sites named company<N>.test are served as an HTTP proxy would serve
+them, so the crawler reaches them through `http_proxy` without any DNS setup and without
+touching the network. Sites are generated from their number and the seed, the same ones on
+every run, with careers and contact pages, blogs, robots.txt and sitemaps. Some of them
+redirect to another host, are slow or time out, have huge pages, link binary downloads,
+are rendered with JavaScript only or have no emails at all.
+
+Run it on its own and write the companies file for its sites with:
+
+    python benchmarks/site_farm.py --sites 2000 --port 8899 --companies farm_companies.jsonl
+"""
+import argparse, json, random, re, threading, time
+from functools import cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+# Share of sites of every kind
+SITE_KINDS = {
+    'plain': 45,  # Careers and contact pages linked from the start page
+    'sitemap_only': 10,  # Careers page isn't linked from the start page, only listed in the sitemap
+    'no_emails': 10,
+    'redirect': 10,  # Start page redirects to www. host or to another domain of the company
+    'slow': 8,  # Every page takes SLOW_DELAY seconds
+    'timeout': 2,  # Start page takes longer than the crawl download timeout
+    'large': 5,  # Pages are several megabytes
+    'binary': 5,  # Start page links big downloads that don't look like files by their url
+    'js': 5,  # Content is rendered with JavaScript, static pages have no emails
+}
+
+SLOW_DELAY = 2
+TIMEOUT_DELAY = 15
+LARGE_PAGE_SIZE = 3 * 1024 * 1024
+BINARY_SIZE = 5 * 1024 * 1024
+
+CAREERS_PATHS = ['/careers', '/jobs', '/join-us', '/work-with-us', '/about/careers']
+CAREERS_USERNAMES = ['careers', 'jobs', 'hr', 'recruiting', 'talent']
+CONTACT_USERNAMES = ['info', 'contact', 'hello', 'office']
+STAFF_NAMES = ['anna', 'john.smith', 'm.jones', 'peter', 'sales', 'support', 'press']
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt '
+         'ut labore et dolore magna aliqua solutions platform customers enterprise cloud data').split()
+
+HOST = re.compile(r'^(?:www\.)?company(\d+)(-group)?\.test$')
+
+def filler(rnd, words):
+    return ' '.join(rnd.choice(WORDS) for _ in range(words))
+
+class Site:
+    """Generated company website, its pages are rendered on request"""
+
+    def __init__(self, number, seed):
+        self.number = number
+        rnd = random.Random(f'{seed}:{number}')
+        self.kind = rnd.choices(list(SITE_KINDS), weights=SITE_KINDS.values())[0]
+        self.domain = f'company{number}.test'
+        # Sites that redirect to another domain serve all their pages and emails there
+        self.redirects_to_domain = self.kind == 'redirect' and rnd.random() < 0.5
+        self.home_domain = f'company{number}-group.test' if self.redirects_to_domain else self.domain
+        self.home_host = self.home_domain if self.redirects_to_domain else f'www.{self.domain}' if self.kind == 'redirect' else self.domain
+
+        self.careers_path = rnd.choice(CAREERS_PATHS)
+        self.blog_paths = [f'/blog/{filler(rnd, 3).replace(" ", "-")}-{n}' for n in range(rnd.randint(10, 60))]
+        self.product_paths = [f'/products/product-{n}' for n in range(rnd.randint(5, 30))]
+        self.has_robots_sitemap = rnd.random() < 0.5
+        self.has_sitemap = rnd.random() < 0.7 or self.kind == 'sitemap_only'
+        self.paragraphs = [filler(rnd, rnd.randint(20, 80)) for _ in range(8)]
+
+        self.emails = {}
+        if self.kind != 'no_emails':
+            self.emails['/contact'] = [f'{rnd.choice(CONTACT_USERNAMES)}@{self.home_domain}']
+            self.emails[self.careers_path] = [f'{rnd.choice(CAREERS_USERNAMES)}@{self.home_domain}']
+            if rnd.random() < 0.3:
+                self.emails['/team'] = [f'{name}@{self.home_domain}' for name in rnd.sample(STAFF_NAMES, 3)]
+
+    @property
+    def url(self):
+        return f'http://{self.domain}'
+
+    def static_emails(self):
+        """Emails found in static pages, JavaScript sites have none there"""
+        if self.kind == 'js':
+            return set()
+        return { email for emails in self.emails.values() for email in emails }
+
+    def paths(self):
+        return ['/', '/about', '/contact', '/team', self.careers_path, *self.blog_paths, *self.product_paths]
+
+    def linked_paths(self):
+        """Paths linked from the start page"""
+        paths = self.paths()[1:]
+        if self.kind == 'sitemap_only':
+            paths.remove(self.careers_path)
+        return paths
+
+    def delay(self, path):
+        if self.kind == 'slow':
+            return SLOW_DELAY
+        if self.kind == 'timeout' and path == '/':
+            return TIMEOUT_DELAY
+        return 0
+
+    def response(self, host, path):
+        """(status, headers, body) of the page"""
+        if self.kind == 'redirect' and host != self.home_host:
+            return 301, { 'Location': f'http://{self.home_host}{path}' }, b''
+        if path == '/robots.txt':
+            return self.robots()
+        if path == '/sitemap.xml':
+            return self.sitemap()
+        if path.startswith('/downloads/') and self.kind == 'binary':
+            return 200, { 'Content-Type': 'application/octet-stream' }, bytes(BINARY_SIZE)
+        if path == '/static/app.js' and self.kind == 'js':
+            return 200, { 'Content-Type': 'application/javascript' }, b'fetch("/api/content").then(render);' * 100
+        if path in self.paths():
+            return 200, { 'Content-Type': 'text/html; charset=utf-8' }, self.page(path)
+        return 404, { 'Content-Type': 'text/html' }, b'<html><body>Not found</body></html>'
+
+    def robots(self):
+        lines = ['User-agent: *', 'Disallow: /admin/']
+        if self.has_robots_sitemap:
+            lines.append(f'Sitemap: http://{self.home_host}/sitemap.xml')
+        return 200, { 'Content-Type': 'text/plain' }, '\n'.join(lines).encode()
+
+    def sitemap(self):
+        if not self.has_sitemap:
+            return 404, { 'Content-Type': 'text/html' }, b'<html><body>Not found</body></html>'
+        urls = ''.join(f'<url><loc>http://{self.home_host}{path}</loc></url>' for path in self.paths())
+        body = f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{urls}</urlset>'
+        return 200, { 'Content-Type': 'application/xml' }, body.encode()
+
+    def page(self, path):
+        title = f'Company {self.number} - {path.strip("/") or "home"}'
+        if self.kind == 'js':
+            return (f'<html><head><title>{title}</title></head><body><div id="root"></div>'
+                    f'<script src="/static/app.js"></script></body></html>').encode()
+
+        chunks = [f'<html><head><title>{title}</title></head><body><nav>']
+        links = self.linked_paths() if path == '/' else ['/', '/about', '/contact']
+        chunks += [f'<a href="{link}">{link.strip("/").replace("-", " ")}</a>' for link in links]
+        if path == '/':
+            chunks.append('<a href="/files/brochure.pdf">Brochure</a>')
+            if self.kind == 'binary':
+                chunks += [f'<a href="/downloads/report-{n}">Annual report {n}</a>' for n in range(3)]
+        chunks.append('</nav><main>')
+        chunks += [f'<p>{paragraph}</p>' for paragraph in self.paragraphs]
+        chunks += [f'<p>Write to us at <a href="mailto:{email}">{email}</a></p>' for email in self.emails.get(path, [])]
+        chunks.append('</main>')
+        if self.kind == 'large':
+            chunks.append(large_filler())
+        chunks.append('</body></html>')
+        return ''.join(chunks).encode()
+
+@cache
+def large_filler():
+    paragraph = f'<p>{filler(random.Random(0), 200)}</p>'
+    return paragraph * (LARGE_PAGE_SIZE // len(paragraph))
+
+class SiteFarm:
+    """Sites of the farm by their number, generated on the first request"""
+
+    def __init__(self, sites, seed=42):
+        self.size = sites
+        self.seed = seed
+        self.sites = {}
+        self.lock = threading.Lock()
+
+    def site(self, number):
+        with self.lock:
+            if number not in self.sites:
+                self.sites[number] = Site(number, self.seed)
+            return self.sites[number]
+
+    def site_for_host(self, host):
+        match = HOST.match(host)
+        if not match or int(match.group(1)) >= self.size:
+            return None
+        return self.site(int(match.group(1)))
+
+    def __iter__(self):
+        return (self.site(number) for number in range(self.size))
+
+    def companies(self):
+        for site in self:
+            yield { 'linkedin_id': f'farm-{site.number}', 'name': f'Company {site.number}', 'url': site.url, 'emails': [] }
+
+    def write_companies(self, path):
+        with open(path, 'w') as f:
+            for company in self.companies():
+                f.write(json.dumps(company) + '\n')
+
+def make_handler(farm):
+    class FarmHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            # Proxied requests have the absolute url in the request line
+            url = urlsplit(self.path)
+            host = (url.hostname or self.headers.get('Host', '').split(':')[0]).lower()
+            path = url.path or '/'
+
+            site = farm.site_for_host(host)
+            if site is None:
+                status, headers, body = 502, { 'Content-Type': 'text/plain' }, f'Unknown host {host}'.encode()
+            else:
+                time.sleep(site.delay(path))
+                status, headers, body = site.response(host, path)
+
+            try:
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            except ConnectionError:
+                # The crawler gave up on the page e.g. it timed out or the download was stopped
+                self.close_connection = True
+
+        def log_message(self, format, *args):
+            pass
+
+    return FarmHandler
+
+def start_farm(farm, port=0):
+    """Serve the farm in a background thread, returns the server, its port is `server.server_port`"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(farm))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a farm of synthetic company websites.')
+    parser.add_argument('--sites', type=int, default=2000, help='number of sites')
+    parser.add_argument('--seed', type=int, default=42, help='sites are the same for the same seed')
+    parser.add_argument('--port', type=int, default=8899)
+    parser.add_argument('--companies', help='write companies file of the farm sites to this path')
+    args = parser.parse_args()
+
+    farm = SiteFarm(args.sites, args.seed)
+    if args.companies:
+        farm.write_companies(args.companies)
+        print(f'Wrote {args.sites} companies to {args.companies}')
+
+    server = start_farm(farm, args.port)
+    print(f'Serving {args.sites} sites, crawl them with http_proxy=http://127.0.0.1:{server.server_port}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
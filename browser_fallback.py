@@ -0,0 +1,147 @@
+import re, threading
+from queue import Queue
+from playwright.sync_api import sync_playwright
+from twisted.internet.defer import Deferred, fail
+
+# Markup of single page apps that render their content with JavaScript
+JS_APP_MARKERS = [
+    b'id="root"></div>',
+    b'id="app"></div>',
+    b'id="__next"',
+    b'__next_data__',
+    b'window.__nuxt__',
+    b'data-reactroot',
+    b'ng-version=',
+    b'data-server-rendered',
+    b'enable javascript',
+    b'javascript is required',
+]
+
+# Pages with less visible text than this are most likely rendered by scripts
+MIN_TEXT_LENGTH = 500
+
+SCRIPTS_AND_STYLES = re.compile(rb'<(script|style|noscript)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+TAGS = re.compile(rb'<[^>]*>')
+WHITESPACE = re.compile(rb'\s+')
+
+def looks_js_rendered(body):
+    """Whether the page content is most likely rendered with JavaScript"""
+    lower_body = body.lower()
+    if any(marker in lower_body for marker in JS_APP_MARKERS):
+        return True
+    if b'<script' not in lower_body:
+        return False
+    text = WHITESPACE.sub(b' ', TAGS.sub(b' ', SCRIPTS_AND_STYLES.sub(b' ', body))).strip()
+    return len(text) < MIN_TEXT_LENGTH
+
+# Resources that don't affect page text
+BLOCKED_RESOURCE_TYPES = {'image', 'media', 'font', 'stylesheet'}
+
+BLOCKED_URL_PARTS = [
+    'google-analytics.com',
+    'googletagmanager.com',
+    'doubleclick.net',
+    'facebook.net',
+    'hotjar.com',
+]
+
+def block_heavy_resources(page):
+    def handle_route(route):
+        request = route.request
+        if request.resource_type in BLOCKED_RESOURCE_TYPES or any(part in request.url for part in BLOCKED_URL_PARTS):
+            route.abort()
+        else:
+            route.continue_()
+    page.route('**/*', handle_route)
+
+class BrowserPool:
+    """Small pool of headless browser pages rendering urls for the crawl.
+
+    Every page lives in its own thread with its own Playwright instance, since Playwright
+    sync API can't run in the reactor thread. Browsers are launched on the first render,
+    so crawls that never need them don't pay for them. If a browser can't be launched or
+    its thread fails, the pool is broken: pending and later renders fail with the error.
+    """
+
+    def __init__(self, size=2, timeout=20):
+        self.size = size
+        self.timeout = timeout
+        self.jobs = Queue()
+        self.threads = []
+        # Error that broke the pool, jobs are never queued once it's set
+        self.broken = None
+        self.lock = threading.Lock()
+
+    def render(self, url):
+        """Deferred firing with (url, status, html) of the rendered page"""
+        with self.lock:
+            if self.broken:
+                return fail(self.broken)
+            if not self.threads:
+                self.start()
+            deferred = Deferred()
+            self.jobs.put((url, deferred))
+        return deferred
+
+    def start(self):
+        self.threads = [threading.Thread(target=self.worker, daemon=True) for _ in range(self.size)]
+        for thread in self.threads: thread.start()
+
+    def close(self):
+        for _ in self.threads: self.jobs.put(None)
+        for thread in self.threads: thread.join(timeout=self.timeout)
+        self.threads = []
+
+    def worker(self):
+        from twisted.internet import reactor
+
+        deferred = None
+        try:
+            with sync_playwright() as playwright:
+                browser = playwright.chromium.launch(headless=True)
+                page = browser.new_page()
+                block_heavy_resources(page)
+
+                while True:
+                    job = self.jobs.get()
+                    if job is None: break
+                    url, deferred = job
+                    try:
+                        response = page.goto(url, timeout=self.timeout * 1000)
+                        try:
+                            # Let scripts fetch and render the content
+                            page.wait_for_load_state('networkidle', timeout=self.timeout * 1000 / 2)
+                        except Exception:
+                            pass
+                        result = (page.url, response.status if response else 200, page.content())
+                        reactor.callFromThread(deferred.callback, result)
+                    except Exception as error:
+                        # The page may be dead after a crash, it's checked before the next job
+                        if page.is_closed():
+                            raise
+                        reactor.callFromThread(deferred.errback, error)
+                    deferred = None
+
+                browser.close()
+        except Exception as error:
+            self.fail_jobs(error, deferred)
+
+    def fail_jobs(self, error, deferred=None):
+        """Mark the pool broken and fail the job being rendered and all queued ones"""
+        from twisted.internet import reactor
+
+        with self.lock:
+            self.broken = error
+            failed = [deferred] if deferred else []
+            stops = 0
+            while not self.jobs.empty():
+                job = self.jobs.get_nowait()
+                if job is None:
+                    stops += 1
+                else:
+                    failed.append(job[1])
+            # Other threads still have to get their stop from close()
+            for _ in range(stops): self.jobs.put(None)
+
+        for deferred in failed:
+            reactor.callFromThread(deferred.errback, error)
@@ -0,0 +1,72 @@
+import json, os, re
+
+CHUNK_SIZE = 64 * 1024
+
+# Whitespace and commas between items of a JSON array
+ITEMS_SEPARATOR = re.compile(r'[\s,]*')
+
+def is_jsonl(path):
+    if path.endswith('.jsonl'):
+        return True
+    # JSON companies file is an array, JSONL one starts with an object
+    with open(path, 'r') as f:
+        return f.read(CHUNK_SIZE).lstrip().startswith('{')
+
+def iter_companies(path):
+    """Read companies from JSON array or JSONL file one by one, the file is never loaded whole"""
+    with open(path, 'r') as f:
+        if is_jsonl(path):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from iter_json_array(f)
+
+def iter_json_array(f):
+    decoder = json.JSONDecoder()
+    buffer = f.read(CHUNK_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError(f"{f.name} isn't a JSON array")
+    position = 1
+
+    while True:
+        position = ITEMS_SEPARATOR.match(buffer, position).end()
+        if position < len(buffer) and buffer[position] == ']':
+            return
+
+        try:
+            if position == len(buffer):
+                raise json.JSONDecodeError('Expecting value', buffer, position)
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # Item is cut by the end of the chunk, read more of it
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                raise
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+
+        yield item
+
+def write_companies(path, companies, jsonl=None):
+    """Write companies one by one as JSONL or JSON array, by default depending on the file extension.
+
+    Companies are written to a temporary file first, so a crash never leaves the file half written.
+    """
+    if jsonl is None:
+        jsonl = path.endswith('.jsonl')
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        if jsonl:
+            for company in companies:
+                f.write(json.dumps(company) + '\n')
+        else:
+            # Same layout as json.dump(companies, f, indent=2)
+            separator = '[\n'
+            for company in companies:
+                f.write(separator + '  ' + json.dumps(company, indent=2).replace('\n', '\n  '))
+                separator = ',\n'
+            f.write('[]' if separator == '[\n' else '\n]')
+    os.replace(tmp_path, path)
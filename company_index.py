@@ -0,0 +1,67 @@
+import hashlib
+from urllib.parse import urlparse
+
+# Public suffix list is used if tldextract is installed, it's optional though
+try:
+    import tldextract
+    # Use the suffix list snapshot bundled with the package instead of fetching it
+    extract_domain = tldextract.TLDExtract(suffix_list_urls=())
+except ImportError:
+    extract_domain = None
+
+# The most common public suffixes consisting of several labels, used when tldextract isn't installed
+MULTI_LABEL_SUFFIXES = {
+    'co.uk', 'org.uk', 'ac.uk', 'gov.uk', 'me.uk', 'ltd.uk', 'plc.uk',
+    'com.au', 'net.au', 'org.au', 'edu.au', 'gov.au',
+    'co.nz', 'org.nz', 'net.nz',
+    'co.za', 'org.za',
+    'co.in', 'net.in', 'org.in', 'firm.in',
+    'co.jp', 'ne.jp', 'or.jp',
+    'co.kr', 'or.kr',
+    'co.il', 'org.il',
+    'com.br', 'net.br', 'org.br',
+    'com.mx', 'org.mx',
+    'com.ar', 'com.co', 'com.pe', 'com.tr', 'com.ua', 'com.pl', 'com.cn', 'com.hk', 'com.tw',
+    'com.sg', 'com.my', 'com.ph', 'com.vn', 'com.eg', 'com.sa', 'com.pk', 'com.ng',
+}
+
+def host(url):
+    # Company websites are often written without scheme e.g. www.example.com
+    if '://' not in url:
+        url = 'https://' + url
+    return (urlparse(url).hostname or '').lower()
+
+def registrable_domain(hostname):
+    """Domain a company owns under a public suffix e.g. foo.co.uk for jobs.foo.co.uk"""
+    hostname = hostname.lower().rstrip('.')
+    if extract_domain:
+        extracted = extract_domain(hostname)
+        return extracted.registered_domain or hostname
+
+    labels = hostname.split('.')
+    # IP addresses and local hosts have nothing to strip
+    if len(labels) <= 2 or labels[-1].isdigit():
+        return hostname
+    if '.'.join(labels[-2:]) in MULTI_LABEL_SUFFIXES:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+def company_key(company):
+    """Identifier of the company crawled pages and found emails are attributed to"""
+    return company.get('linkedin_id') or company.get('url')
+
+def build_company_index(companies):
+    """Map registrable domain of every company website to the company key"""
+    index = {}
+    for company in companies:
+        if company.get('url'):
+            index.setdefault(registrable_domain(host(company['url'])), company_key(company))
+    return index
+
+def company_for_host(index, hostname):
+    return index.get(registrable_domain(hostname))
+
+def shard_of(url, shards):
+    """Shard number of the url's registrable domain, the same in every process and on every machine"""
+    digest = hashlib.blake2b(registrable_domain(host(url)).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % shards
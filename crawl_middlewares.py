@@ -0,0 +1,143 @@
+import os
+from urllib.parse import urlparse
+from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, StopDownload
+from scrapy.http import HtmlResponse
+from scrapy.linkextractors import IGNORED_EXTENSIONS
+from browser_fallback import BrowserPool
+
+class SkipDoneSitesMiddleware:
+    """Cancel requests of sites the spider is already done with (see `EmailSpider.done_sites`).
+
+    Queued requests are dropped before they are downloaded, downloads in flight
+    are stopped as soon as their next chunk arrives and responses that have already
+    arrived are dropped before they are parsed.
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        crawler.signals.connect(self.bytes_received, signal=signals.bytes_received)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def is_site_done(self, request, spider):
+        return request.meta.get('site') in getattr(spider, 'done_sites', ())
+
+    def process_request(self, request, spider):
+        if self.is_site_done(request, spider):
+            self.stats.inc_value('done_sites/requests_dropped', spider=spider)
+            raise IgnoreRequest(f"Site {request.meta['site']} is done")
+
+    def process_response(self, request, response, spider):
+        if self.is_site_done(request, spider):
+            self.stats.inc_value('done_sites/responses_dropped', spider=spider)
+            raise IgnoreRequest(f"Site {request.meta['site']} is done")
+        return response
+
+    def bytes_received(self, data, request, spider):
+        if self.is_site_done(request, spider):
+            self.stats.inc_value('done_sites/downloads_stopped', spider=spider)
+            raise StopDownload(fail=True)
+
+def has_denied_extension(url, extensions):
+    extension = os.path.splitext(urlparse(url).path)[1].lower().lstrip('.')
+    return extension in extensions
+
+class DownloadGuardMiddleware:
+    """Avoid downloading what can't contain emails and cap the size of what can.
+
+    - Requests to urls with binary file extensions e.g. pdf, zip or mp4 are dropped before download.
+    - Downloads are stopped right after headers if Content-Type isn't one of `DOWNLOAD_GUARD_CONTENT_TYPES`.
+    - Bodies are streamed only up to `DOWNLOAD_GUARD_MAXSIZE` bytes, the truncated prefix is still
+      passed to the spider to scan it for emails.
+
+    Bytes that weren't downloaded thanks to the guard are counted per site in crawl stats.
+    Requests with `download_guard_content_types` meta accept these content types instead e.g. xml,
+    their urls aren't checked for binary file extensions either e.g. sitemap.xml.gz.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.stats = crawler.stats
+        self.denied_extensions = set(IGNORED_EXTENSIONS) | set(settings.getlist('DOWNLOAD_GUARD_DENY_EXTENSIONS'))
+        self.content_types = settings.getlist('DOWNLOAD_GUARD_CONTENT_TYPES', ['text/html', 'application/xhtml+xml', 'text/plain'])
+        self.maxsize = settings.getint('DOWNLOAD_GUARD_MAXSIZE', 1024 * 1024)
+        crawler.signals.connect(self.headers_received, signal=signals.headers_received)
+        crawler.signals.connect(self.bytes_received, signal=signals.bytes_received)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def count_saved_bytes(self, request, saved_bytes, reason, spider):
+        self.stats.inc_value(f'download_guard/{reason}', spider=spider)
+        if saved_bytes > 0:
+            self.stats.inc_value('download_guard/bytes_saved', saved_bytes, spider=spider)
+            self.stats.inc_value(f"download_guard/bytes_saved/{request.meta.get('site')}", saved_bytes, spider=spider)
+
+    def process_request(self, request, spider):
+        if 'download_guard_content_types' in request.meta:
+            return
+        if has_denied_extension(request.url, self.denied_extensions):
+            self.stats.inc_value('download_guard/denied_extension', spider=spider)
+            raise IgnoreRequest(f'Url has binary file extension: {request.url}')
+
+    def headers_received(self, headers, body_length, request, spider):
+        request.meta['download_guard_expected_size'] = body_length
+        request.meta['download_guard_received'] = 0
+
+        content_type = headers.get(b'Content-Type', b'').decode('latin-1').split(';')[0].strip().lower()
+        content_types = request.meta.get('download_guard_content_types', self.content_types)
+        # Some sites don't send Content-Type at all, give them a chance
+        if content_type and content_type not in content_types:
+            self.count_saved_bytes(request, body_length, 'content_type_rejected', spider)
+            raise StopDownload(fail=True)
+
+    def bytes_received(self, data, request, spider):
+        received = request.meta.get('download_guard_received', 0) + len(data)
+        request.meta['download_guard_received'] = received
+        if received >= self.maxsize:
+            expected_size = request.meta.get('download_guard_expected_size', -1)
+            self.count_saved_bytes(request, expected_size - received, 'truncated', spider)
+            # Keep the downloaded prefix, it's scanned for emails as a regular response
+            raise StopDownload(fail=False)
+
+class BrowserFallbackMiddleware:
+    """Render requests with `render` meta in a headless browser instead of downloading them.
+
+    Pages are rendered by a pool of `BROWSER_FALLBACK_PAGES` browser pages blocking images,
+    fonts and styles. Rendered pages aren't cached, the cache keeps their static versions.
+    Once the pool is broken e.g. the browser isn't installed, render requests are dropped.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.stats = crawler.stats
+        self.pool = BrowserPool(settings.getint('BROWSER_FALLBACK_PAGES', 2), settings.getfloat('BROWSER_FALLBACK_TIMEOUT', 20))
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def spider_closed(self, spider):
+        self.pool.close()
+
+    def process_request(self, request, spider):
+        if not request.meta.get('render'):
+            return None
+
+        if self.pool.broken:
+            self.stats.inc_value('browser_fallback/dropped', spider=spider)
+            raise IgnoreRequest(f'Browser fallback is broken: {self.pool.broken!r}')
+
+        self.stats.inc_value('browser_fallback/pages', spider=spider)
+
+        def rendered(result):
+            url, status, html = result
+            return HtmlResponse(url=url, status=status, body=html.encode('utf-8'), encoding='utf-8', request=request)
+
+        return self.pool.render(request.url).addCallback(rendered)
@@ -0,0 +1,121 @@
+from collections import Counter, deque
+from scrapy import signals
+from scrapy.core.scheduler import BaseScheduler
+from scrapy.utils.misc import load_object
+from email_spider import site
+
+def request_site(request):
+    return request.meta.get('site') or site(request.url)
+
+class RoundRobinSiteScheduler(BaseScheduler):
+    """Scheduler serving sites in turns so link-heavy sites don't starve small ones.
+
+    - Every site has its own in-memory queue and sites are served round-robin.
+    - A site isn't served while it has `MAX_CONCURRENT_REQUESTS_PER_SITE` requests in the downloader.
+    - Page budget (`MAX_PAGES_PER_DOMAIN`) is counted when a request is enqueued,
+      so requests in flight are counted too and requests over budget are never downloaded.
+      Discovery requests e.g. robots.txt and sitemaps aren't pages and don't count,
+      neither do pages rendered in a browser, the spider limits them itself.
+    - Requests with positive priority e.g. pages found in sitemaps go ahead of other requests of their site.
+    - Queued requests of sites the spider is done with (see `EmailSpider.done_sites`) are dropped.
+    """
+
+    def __init__(self, crawler, dupefilter):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.dupefilter = dupefilter
+        self.max_pages_per_site = crawler.settings.getint('MAX_PAGES_PER_DOMAIN', 50)
+        self.max_concurrent_requests_per_site = crawler.settings.getint('MAX_CONCURRENT_REQUESTS_PER_SITE', 2)
+        self.spider = None
+
+        self.queues = {}
+        # Sites having queued requests in round-robin order
+        self.sites = deque()
+        self.enqueued_per_site = Counter()
+        self.in_flight_per_site = Counter()
+
+        crawler.signals.connect(self.request_reached_downloader, signal=signals.request_reached_downloader)
+        crawler.signals.connect(self.request_left_downloader, signal=signals.request_left_downloader)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        dupefilter_cls = load_object(crawler.settings['DUPEFILTER_CLASS'])
+        return cls(crawler, dupefilter_cls.from_crawler(crawler))
+
+    def open(self, spider):
+        self.spider = spider
+        return self.dupefilter.open()
+
+    def close(self, reason):
+        return self.dupefilter.close(reason)
+
+    def request_reached_downloader(self, request, spider):
+        self.in_flight_per_site[request_site(request)] += 1
+
+    def request_left_downloader(self, request, spider):
+        self.in_flight_per_site[request_site(request)] -= 1
+
+    def is_site_done(self, site):
+        return site in getattr(self.spider, 'done_sites', ())
+
+    def counts_to_budget(self, request):
+        # Redirects and retries are the same page that has been already counted
+        if 'redirect_times' in request.meta or 'retry_times' in request.meta:
+            return False
+        return not request.meta.get('discovery') and not request.meta.get('render')
+
+    def enqueue_request(self, request):
+        if not request.dont_filter and self.dupefilter.request_seen(request):
+            self.dupefilter.log(request, self.spider)
+            return False
+
+        site = request_site(request)
+        if self.is_site_done(site):
+            self.stats.inc_value('scheduler/dropped/site_done', spider=self.spider)
+            return False
+
+        if self.counts_to_budget(request):
+            if self.enqueued_per_site[site] >= self.max_pages_per_site:
+                self.stats.inc_value('scheduler/dropped/over_budget', spider=self.spider)
+                return False
+            self.enqueued_per_site[site] += 1
+
+        if site not in self.queues:
+            # Priority and regular requests of the site
+            self.queues[site] = (deque(), deque())
+            self.sites.append(site)
+        priority_queue, queue = self.queues[site]
+        (priority_queue if request.priority > 0 else queue).append(request)
+        self.stats.inc_value('scheduler/enqueued', spider=self.spider)
+        return True
+
+    def next_request(self):
+        for _ in range(len(self.sites)):
+            site = self.sites.popleft()
+            priority_queue, queue = self.queues[site]
+
+            if self.is_site_done(site):
+                self.stats.inc_value('scheduler/dropped/site_done', len(priority_queue) + len(queue), spider=self.spider)
+                del self.queues[site]
+                continue
+
+            # Let other sites go first while this one is busy
+            if self.in_flight_per_site[site] >= self.max_concurrent_requests_per_site:
+                self.sites.append(site)
+                continue
+
+            request = (priority_queue or queue).popleft()
+            if priority_queue or queue:
+                self.sites.append(site)
+            else:
+                del self.queues[site]
+            self.stats.inc_value('scheduler/dequeued', spider=self.spider)
+            return request
+
+        return None
+
+    def has_pending_requests(self):
+        return bool(self.queues)
+
+    def __len__(self):
+        return sum(len(priority_queue) + len(queue) for priority_queue, queue in self.queues.values())
@@ -0,0 +1,257 @@
+import csv, json, math, os, time
+from collections import Counter
+from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, StopDownload
+from scrapy.spidermiddlewares.httperror import HttpError
+from twisted.internet import task
+from twisted.internet.error import TCPTimedOutError, TimeoutError
+from email_spider import site_crawled, site_request_failed
+
+CSV_FIELDS = [
+    'site', 'company_id', 'status', 'requests', 'pages', 'discovery_requests', 'bytes',
+    'latency_p50', 'latency_p90', 'latency_p99', 'latency_max', 'http_errors', 'timeouts', 'errors',
+    'emails', 'first_email', 'first_email_url', 'first_email_depth', 'first_email_page', 'productive_keywords', 'duration',
+]
+
+# Upper bounds of download latency histogram buckets, in seconds
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of sorted values"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return round(sorted_values[index], 3)
+
+class SiteTelemetry:
+    """Per site record of the crawl: pages, bytes, latencies, errors and how its emails were found"""
+
+    def __init__(self, site, company_id):
+        self.site = site
+        self.company_id = company_id
+        self.status = 'unfinished'
+        self.pages = 0
+        self.discovery_requests = 0
+        self.bytes = 0
+        self.latencies = []
+        self.http_errors = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.emails = 0
+        self.first_email = None
+        self.first_email_url = None
+        self.first_email_depth = None
+        self.first_email_page = None
+        # Url of every page that produced new emails -> priority keyword its link matched, if any
+        self.productive_links = {}
+        self.started_at = time.time()
+        self.finished_at = None
+
+    def record(self):
+        latencies = sorted(self.latencies)
+        return {
+            'site': self.site,
+            'company_id': self.company_id,
+            'status': self.status,
+            'requests': self.pages + self.discovery_requests + self.timeouts + self.errors,
+            'pages': self.pages,
+            'discovery_requests': self.discovery_requests,
+            'bytes': self.bytes,
+            'latency_p50': percentile(latencies, 50),
+            'latency_p90': percentile(latencies, 90),
+            'latency_p99': percentile(latencies, 99),
+            'latency_max': round(latencies[-1], 3) if latencies else None,
+            'http_errors': self.http_errors,
+            'timeouts': self.timeouts,
+            'errors': self.errors,
+            'emails': self.emails,
+            'first_email': self.first_email,
+            'first_email_url': self.first_email_url,
+            'first_email_depth': self.first_email_depth,
+            'first_email_page': self.first_email_page,
+            'productive_links': [{ 'url': url, 'keyword': keyword } for url, keyword in self.productive_links.items()],
+            'duration': round((self.finished_at or time.time()) - self.started_at, 3),
+        }
+
+class CrawlTelemetry:
+    """Scrapy extension recording telemetry of every crawled site.
+
+    A site's record is appended to `TELEMETRY_JSONL` and `TELEMETRY_CSV` reports as soon as
+    its crawl is over, so memory is held only for sites being crawled. Reports of previous
+    runs are kept, resumed crawls append to them. Sites still being crawled when the spider
+    closes are reported as 'unfinished'. With `TELEMETRY_PROMETHEUS_FILE`
+    set, totals of the whole crawl are written in Prometheus text format every
+    `TELEMETRY_PROMETHEUS_INTERVAL` seconds, e.g. for node_exporter textfile collector.
+    """
+
+    def __init__(self, crawler, jsonl_path, csv_path, prometheus_path, prometheus_interval):
+        self.crawler = crawler
+        self.jsonl_path = jsonl_path
+        self.csv_path = csv_path
+        self.prometheus_path = prometheus_path
+        self.prometheus_interval = prometheus_interval
+
+        # Sites being crawled, site -> SiteTelemetry
+        self.sites = {}
+        self.spider = None
+
+        # Totals of the whole crawl
+        self.site_statuses = Counter()
+        self.totals = Counter()
+        self.latency_buckets = Counter()
+        self.latency_sum = 0
+        self.productive_keywords = Counter()
+
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(self.response_received, signal=signals.response_received)
+        crawler.signals.connect(self.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(self.request_failed, signal=site_request_failed)
+        crawler.signals.connect(self.site_crawled, signal=site_crawled)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(crawler, settings.get('TELEMETRY_JSONL', 'crawl_telemetry.jsonl'), settings.get('TELEMETRY_CSV', 'crawl_telemetry.csv'),
+                   settings.get('TELEMETRY_PROMETHEUS_FILE'), settings.getfloat('TELEMETRY_PROMETHEUS_INTERVAL', 30))
+
+    def spider_opened(self, spider):
+        self.spider = spider
+        self.jsonl_file = open(self.jsonl_path, 'a')
+        self.csv_file = open(self.csv_path, 'a', newline='')
+        self.csv_writer = csv.DictWriter(self.csv_file, fieldnames=CSV_FIELDS, extrasaction='ignore')
+        if self.csv_file.tell() == 0:
+            self.csv_writer.writeheader()
+
+        if self.prometheus_path:
+            self.prometheus_task = task.LoopingCall(self.write_prometheus)
+            self.prometheus_task.start(self.prometheus_interval, now=False)
+
+    def spider_closed(self, spider):
+        for telemetry in list(self.sites.values()):
+            self.write_site(telemetry)
+        self.sites.clear()
+        self.jsonl_file.close()
+        self.csv_file.close()
+
+        if self.prometheus_path:
+            if self.prometheus_task.running:
+                self.prometheus_task.stop()
+            self.write_prometheus()
+
+    def site_telemetry(self, request):
+        current_site = request.meta.get('site')
+        # Responses, items and failures of finished sites are ignored: sites finished as crawled have no
+        # requests pending anymore and sites finished as done still get the ones of their requests in flight
+        if current_site is None or current_site not in self.spider.site_pending or current_site in self.spider.done_sites:
+            return None
+        if current_site not in self.sites:
+            self.sites[current_site] = SiteTelemetry(current_site, request.meta.get('company_id'))
+        return self.sites[current_site]
+
+    def response_received(self, response, request, spider):
+        telemetry = self.site_telemetry(request)
+        if telemetry is None:
+            return
+
+        if request.meta.get('discovery'):
+            telemetry.discovery_requests += 1
+        else:
+            telemetry.pages += 1
+            self.totals['pages'] += 1
+        telemetry.bytes += len(response.body)
+        self.totals['bytes'] += len(response.body)
+        if response.status >= 400:
+            telemetry.http_errors += 1
+            self.totals['http_errors'] += 1
+
+        # Rendered pages aren't downloaded, they have no latency
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            telemetry.latencies.append(latency)
+            self.latency_sum += latency
+            self.totals['downloads'] += 1
+            for bucket in LATENCY_BUCKETS:
+                if latency <= bucket:
+                    self.latency_buckets[bucket] += 1
+
+    def item_scraped(self, item, response, spider):
+        telemetry = self.site_telemetry(response.request)
+        if telemetry is None:
+            return
+
+        telemetry.emails += 1
+        self.totals['emails'] += 1
+        if telemetry.first_email is None:
+            telemetry.first_email = item['email']
+            telemetry.first_email_url = response.url
+            telemetry.first_email_depth = response.meta.get('depth', 0)
+            telemetry.first_email_page = telemetry.pages
+
+        if response.url not in telemetry.productive_links:
+            # Keyword of the link the page was requested by, before any redirects
+            link_url = response.meta.get('redirect_urls', [response.url])[0]
+            keyword = spider.link_scorer.matched_keyword(link_url)
+            telemetry.productive_links[response.url] = keyword
+            self.productive_keywords[keyword or ''] += 1
+
+    def request_failed(self, request, failure):
+        telemetry = self.site_telemetry(request)
+        # Requests cancelled on purpose aren't errors and HTTP errors are counted with their responses
+        if telemetry is None or failure.check(IgnoreRequest, StopDownload, HttpError):
+            return
+
+        if failure.check(TimeoutError, TCPTimedOutError):
+            telemetry.timeouts += 1
+            self.totals['timeouts'] += 1
+        else:
+            telemetry.errors += 1
+            self.totals['errors'] += 1
+
+    def site_crawled(self, site, company_id, status, pages, emails):
+        telemetry = self.sites.pop(site, None) or SiteTelemetry(site, company_id)
+        telemetry.status = status
+        telemetry.finished_at = time.time()
+        self.write_site(telemetry)
+
+    def write_site(self, telemetry):
+        record = telemetry.record()
+        self.site_statuses[telemetry.status] += 1
+        self.jsonl_file.write(json.dumps(record) + '\n')
+        self.csv_writer.writerow({ **record, 'productive_keywords': ' '.join(
+            sorted({ link['keyword'] for link in record['productive_links'] if link['keyword'] })) })
+
+    def write_prometheus(self):
+        site_statuses = { **self.site_statuses, 'in_progress': len(self.sites) }
+        lines = [
+            '# HELP email_spider_sites Sites by crawl status',
+            '# TYPE email_spider_sites gauge',
+            *(f'email_spider_sites{{status="{status}"}} {count}' for status, count in sorted(site_statuses.items())),
+        ]
+        for name, help_text in [
+            ('pages', 'Pages downloaded'),
+            ('bytes', 'Bytes downloaded'),
+            ('emails', 'New emails found'),
+            ('http_errors', 'Responses with HTTP error status'),
+            ('timeouts', 'Requests that timed out'),
+            ('errors', 'Requests that failed for other reasons'),
+        ]:
+            lines += [f'# HELP email_spider_{name}_total {help_text}', f'# TYPE email_spider_{name}_total counter',
+                      f'email_spider_{name}_total {self.totals[name]}']
+
+        lines += ['# HELP email_spider_download_latency_seconds Download latency', '# TYPE email_spider_download_latency_seconds histogram']
+        lines += [f'email_spider_download_latency_seconds_bucket{{le="{bucket}"}} {self.latency_buckets[bucket]}' for bucket in LATENCY_BUCKETS]
+        lines += [f'email_spider_download_latency_seconds_bucket{{le="+Inf"}} {self.totals["downloads"]}',
+                  f'email_spider_download_latency_seconds_sum {self.latency_sum:.3f}',
+                  f'email_spider_download_latency_seconds_count {self.totals["downloads"]}']
+
+        lines += ['# HELP email_spider_productive_links_total Pages with new emails by the priority keyword their link matched',
+                  '# TYPE email_spider_productive_links_total counter']
+        lines += [f'email_spider_productive_links_total{{keyword="{keyword}"}} {count}'
+                  for keyword, count in sorted(self.productive_keywords.items())]
+
+        # Collectors may read the file any time, it's replaced whole
+        tmp_path = self.prometheus_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.prometheus_path)
@@ -0,0 +1,142 @@
+import re
+from functools import lru_cache
+
+def byte_table(chars):
+    """Lookup table telling if a byte belongs to the given characters"""
+    table = [False] * 256
+    for char in chars.encode():
+        table[char] = True
+    return table
+
+# Bytes allowed in the email username (based on [\w\.-]) and in the email domain
+USERNAME_CHARS = b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_.-+"
+DOMAIN_BYTES = byte_table("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-")
+
+# Longest username allowed by RFC 5321, longer runs of username bytes are cut to it
+MAX_USERNAME_LENGTH = 64
+
+# "@" and common ways to hide it from naive scrapers e.g. "hr [at] example.com" or "hr&#64;example.com",
+# longer ones go first so " [at] " isn't matched as "[at]"
+AT_SIGNS = [b' [at] ', b' (at) ', b' {at} ', b'[at]', b'(at)', b'{at}', b'&#064;', b'&#x40;', b'&#64;', b'%40', b'@']
+AT_SIGN_LAST_BYTES = byte_table("@]}); 0")
+
+# Dot and its obfuscated forms e.g. "hr [at] example [dot] com"
+DOTS = [b'.', b' [dot] ', b' (dot) ', b'[dot]', b'(dot)', b'&#46;']
+
+# Address of a `mailto:` link, its domain may be written in any case
+MAILTO_ADDRESS_PATTERN = re.compile(rb'mailto:([a-zA-Z0-9_.+-]+@(?:[a-zA-Z0-9-]+\.)+[a-zA-Z0-9-]+)')
+
+def at_sign_before(body, pos):
+    """Return the length of the "@" sign or its obfuscated form ending at `pos`, 0 if there is none"""
+    if pos == 0 or not AT_SIGN_LAST_BYTES[body[pos - 1]]:
+        return 0
+    if body[pos - 1] == 64:
+        return 1
+    for at_sign in AT_SIGNS:
+        if body.startswith(at_sign, pos - len(at_sign), pos):
+            return len(at_sign)
+    return 0
+
+def domain_end(body, pos, labels):
+    """Return the end of the domain continuing at `pos` with given labels (all but the first one), -1 if it doesn't"""
+    for dot in DOTS:
+        end = pos
+        for label in labels:
+            if not body.startswith(dot, end) or not body.startswith(label, end + len(dot)):
+                break
+            end += len(dot) + len(label)
+        else:
+            return end
+    return -1
+
+@lru_cache(maxsize=1024)
+def domain_pattern(first_label, rest_domains):
+    """Occurrences of the first label of the domains right after the "@" sign, its obfuscated form or a subdomain dot.
+
+    The pattern starts with the label, so the regex engine skips to its occurrences in C and
+    the lookbehind rejects most of them there too, e.g. links like "https://example.com/" or
+    other domains that only end with this one like "myexample.com". The rest of the domain
+    written with plain dots is matched there as well, e.g. ".com" and ".co.uk" for example.com
+    and example.co.uk, but not if the domain continues e.g. "example.com.au".
+    """
+    rest = b'|'.join(re.escape(b'.' + rest_domain) for rest_domain in rest_domains)
+    return re.compile(re.escape(first_label) + rb'(?<=[@\]}); 0.].{%d})(?:(%s)(?![a-zA-Z0-9-]|\.[a-zA-Z0-9-]))?' % (len(first_label), rest))
+
+def find_domain_emails(body, first_label, domains_labels, emails):
+    """Find emails of the domains sharing the first label and their subdomains, "@" and dots may be obfuscated.
+
+    `domains_labels` are lists of the rest labels of every domain e.g. [b'com'] and [b'co', b'uk']
+    for example.com and example.co.uk. The body isn't lowercased, so domains are found as
+    written in lowercase, usernames in any case.
+    """
+    body_len = len(body)
+    pattern = domain_pattern(first_label, tuple(b'.'.join(labels) for labels in domains_labels))
+
+    for match in pattern.finditer(body):
+        pos = match.start()
+        rest = match.group(1)
+        if rest is None:
+            # Domain with obfuscated dots e.g. "example [dot] com"
+            label_end = match.end()
+            for labels in domains_labels:
+                end = domain_end(body, label_end, labels)
+                # Domain must not continue after the match e.g. "example.com" in "example.com.au"
+                if end != -1 and not (end < body_len and (DOMAIN_BYTES[body[end]] or body[end] == 46 and end + 1 < body_len and DOMAIN_BYTES[body[end + 1]])):
+                    rest = b'.' + b'.'.join(labels)
+                    break
+            else:
+                continue
+
+        start = pos
+        if body[pos - 1] == 46:
+            # Walk backwards over whole subdomain labels e.g. "jobs." in "career [at] jobs.example.com"
+            while start > 0 and (body[start - 1] == 46 or DOMAIN_BYTES[body[start - 1]]):
+                start -= 1
+        at_sign_len = at_sign_before(body, start)
+
+        if at_sign_len:
+            username_end = start - at_sign_len
+            window_start = username_end - MAX_USERNAME_LENGTH if username_end > MAX_USERNAME_LENGTH else 0
+            username = body[window_start:username_end]
+            username = username[len(username.rstrip(USERNAME_CHARS)):].strip(b'.-')
+            if username:
+                emails.add((username + b'@' + body[start:pos] + first_label + rest).decode().lower())
+
+def find_mailto_emails(body, emails):
+    """Find addresses of `mailto:` links whatever their domain is"""
+    for address in MAILTO_ADDRESS_PATTERN.findall(body):
+        username, domain = address.split(b'@')
+        username = username.strip(b'.-')
+        if username:
+            emails.add((username + b'@' + domain).decode().lower())
+
+def extract_emails(body, domains, include_mailto=True):
+    """Extract emails of the given domains from the page body.
+
+    `body` is the raw response body, bytes are scanned without decoding or copying and all
+    the searching is done by the regex engine, so Python code runs only around matches.
+    `domains` is a domain or a set of domains emails are accepted for, their subdomains are
+    accepted too, by whole labels only. Domains are found as sites write them, in lowercase.
+    Addresses of `mailto:` links are accepted in any case and regardless of their domain as
+    the site explicitly publishes them. Emails are returned lowercased.
+    """
+    if isinstance(body, str):
+        body = body.encode()
+    if isinstance(domains, str):
+        domains = {domains}
+
+    emails = set()
+
+    # Domains with the same first label e.g. example.com and example.co.uk are searched in one pass
+    labels_by_first_label = {}
+    for domain in {d.lower().removeprefix('www.') for d in domains}:
+        first_label, *labels = domain.encode().split(b'.')
+        labels_by_first_label.setdefault(first_label, []).append(labels)
+
+    for first_label, domains_labels in labels_by_first_label.items():
+        find_domain_emails(body, first_label, domains_labels, emails)
+
+    if include_mailto:
+        find_mailto_emails(body, emails)
+
+    return emails
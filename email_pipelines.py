@@ -0,0 +1,132 @@
+import json, os
+from collections import defaultdict
+from company_index import build_company_index, company_for_host, company_key, registrable_domain
+from company_files import is_jsonl, iter_companies, write_companies
+from email_spider import site_crawled
+from lead_store import LeadStore
+
+class EmailJournalPipeline:
+    """Append every found email with its site and page url to a JSONL journal as soon as it's found.
+
+    Nothing is lost if the crawl is killed, the journal is merged into the companies
+    file with `merge_emails_into_companies()`.
+    """
+
+    def __init__(self, journal_path):
+        self.journal_path = journal_path
+        self.journal_file = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings.get('EMAILS_JOURNAL', 'found_emails.jsonl'))
+
+    def open_spider(self, spider):
+        self.journal_file = open(self.journal_path, 'a')
+
+    def close_spider(self, spider):
+        self.journal_file.close()
+
+    def process_item(self, item, spider):
+        self.journal_file.write(json.dumps(dict(item)) + '\n')
+        self.journal_file.flush()
+        return item
+
+class LeadStorePipeline:
+    """Upsert every found email and the crawl status of every crawled site into the leads database (see `lead_store.py`)"""
+
+    def __init__(self, crawler, store_path):
+        self.store_path = store_path
+        self.store = None
+        crawler.signals.connect(self.site_crawled, signal=site_crawled)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler, crawler.settings.get('LEAD_STORE', 'leads.db'))
+
+    def open_spider(self, spider):
+        self.store = LeadStore(self.store_path)
+
+    def close_spider(self, spider):
+        self.store.close()
+
+    def process_item(self, item, spider):
+        self.store.add_emails([dict(item)])
+        return item
+
+    def site_crawled(self, site, company_id, status, pages, emails):
+        self.store.set_crawl_status(registrable_domain(site), company_id, status, pages, emails)
+
+def read_emails_journal(journal_path):
+    """Read journal records skipping a partially written last line"""
+    if not os.path.exists(journal_path):
+        return
+
+    with open(journal_path, 'r') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+def merge_emails_into_companies(companies_path, journal_paths):
+    """Add emails from the journals to their companies in the companies file.
+
+    Emails are attributed to companies by `company_id` the crawl tagged them with,
+    older records without it are attributed by the registrable domain of their site.
+    Merging is idempotent and deterministic: emails the company already has are kept,
+    new ones are added sorted regardless of the journals order and the same journals
+    can be merged any number of times. Companies are streamed from and to the file
+    (JSON or JSONL), only found emails are kept in memory. The file is replaced only
+    if some company got new emails. Returns the number of updated companies.
+    """
+    emails_by_company = defaultdict(set)
+    # Emails of records without company id by their site
+    emails_by_site = defaultdict(set)
+    for journal_path in journal_paths:
+        for record in read_emails_journal(journal_path):
+            if record.get('company_id'):
+                emails_by_company[record['company_id']].add(record['email'])
+            else:
+                emails_by_site[record['site']].add(record['email'])
+
+    if emails_by_site:
+        company_index = build_company_index(iter_companies(companies_path))
+        for site, emails in emails_by_site.items():
+            company_id = company_for_host(company_index, site)
+            if company_id:
+                emails_by_company[company_id].update(emails)
+
+    if not emails_by_company:
+        return 0
+
+    updated_count = 0
+
+    def updated_companies():
+        nonlocal updated_count
+        for company in iter_companies(companies_path):
+            found_emails = emails_by_company.get(company_key(company))
+            if found_emails:
+                emails = company.get('emails', [])
+                new_emails = sorted(found_emails.difference(emails))
+                if new_emails:
+                    company['emails'] = emails + new_emails
+                    updated_count += 1
+            yield company
+
+    # The companies file is written next to the original and replaces it only if anything changed
+    tmp_path = companies_path + '.merged'
+    write_companies(tmp_path, updated_companies(), jsonl=is_jsonl(companies_path))
+    if updated_count:
+        os.replace(tmp_path, companies_path)
+    else:
+        os.remove(tmp_path)
+
+    return updated_count
+
+def merge_emails_into_store(store_path, journal_paths):
+    """Add emails from the journals to the leads database, returns the number of emails that weren't there yet"""
+    with LeadStore(store_path) as store:
+        changes_before = store.connection.total_changes
+        for journal_path in journal_paths:
+            store.add_emails(read_emails_journal(journal_path))
+        return store.connection.total_changes - changes_before
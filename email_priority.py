@@ -0,0 +1,74 @@
+import re
+
+# Emails are ranked by these keywords found in their username, the ones at the top are the most relevant.
+# We are going to scrape job-related emails
+priority_email_keywords = [
+    "cv",
+    "career",
+    "job",
+    "resume",
+    "hr",
+    "recruiting",
+    "recruitment",
+    "hiring",
+    "hire",
+    "humanresource",
+    "apply",
+    "application",
+    "opportunities",
+    "talent",
+    "join",
+    "employment",
+    "staffing",
+    "work",
+    "vacancy",
+    "vacancies",
+    "people",
+    "personnel",
+    "team",
+
+    # More generic emails but still more relevant than some random addresses
+    "contact",
+    "info",
+    "hello",
+    "general",
+    "inquiry",
+    "office"
+]
+
+# Characters separating words in the email username e.g. "hr.team" or "jobs-de"
+USERNAME_SEPARATORS = re.compile(r'[._+-]')
+
+def email_score(email, keywords):
+    """Score the email by keywords, the lower score the more relevant the email is"""
+    prefix = email.split('@')[0].lower()
+
+    # Check for exact matches
+    for i, keyword in enumerate(keywords):
+        if prefix == keyword:
+            return i  # Score is just the index for exact match
+
+    # Check for partial matches
+    for i, keyword in enumerate(keywords):
+        if keyword in prefix:
+            return i + 0.5  # Add small penalty for partial match
+
+    # No match
+    return len(keywords) * 2  # Large score for no match
+
+def most_relevant_email_or_default(emails, keywords):
+    if not emails:
+        return None
+
+    return min(emails, key=lambda email: email_score(email, keywords))  # Select email with lowest score
+
+def username_words(email):
+    """Words of the email username e.g. hr and team of HR.Team@example.com"""
+    return USERNAME_SEPARATORS.split(email.split('@')[0].lower())
+
+def is_satisfying_email(email, keywords):
+    """Check if a whole word of the email username is one of the keywords or its plural, so there is no need to look for a better one.
+
+    E.g. "careers@" and "hr-de@" match, but "chris@" doesn't match "hr" and "throne@" doesn't match "cv".
+    """
+    return any(word in keywords or word.endswith('s') and word[:-1] in keywords for word in username_words(email))
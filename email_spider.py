@@ -1,70 +1,353 @@
-from collections import defaultdict
+from collections import Counter, defaultdict
+from functools import wraps
 import scrapy
-from scrapy.linkextractors import LinkExtractor
-from urllib.parse import urlparse, urlunparse
+from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, StopDownload
+from scrapy.http import TextResponse
+from scrapy.link import Link
+from scrapy.linkextractors import IGNORED_EXTENSIONS, LinkExtractor
+from urllib.parse import urljoin, urlparse, urlunparse
+from email_extraction import extract_emails
+from email_priority import is_satisfying_email
+from company_index import company_for_host, company_key, host, registrable_domain
+from link_scoring import LinkScorer
+from sitemap_discovery import SITEMAP_CONTENT_TYPES, iter_sitemap, sitemap_urls_from_robots
+from crawl_middlewares import has_denied_extension
+from browser_fallback import looks_js_rendered
+
+# Sent once crawling of a site is over, with its site, company_id, status ('done' or 'crawled'), pages and emails count
+site_crawled = object()
+
+# Sent when a request of a site fails, with its request and failure, including requests cancelled on purpose
+site_request_failed = object()
+
+# Platforms hosting pages of many companies that sites redirect to, e.g. parked domains, site builders,
+# social networks and job boards. Emails of their own domains don't belong to the company.
+SHARED_PLATFORM_DOMAINS = {
+    # Parking and domain marketplaces
+    'sedo.com', 'sedoparking.com', 'parkingcrew.net', 'bodis.com', 'above.com', 'dan.com', 'afternic.com',
+    'hugedomains.com', 'godaddy.com', 'namecheap.com', 'namebright.com', 'uniregistry.com',
+    # Hosting and site builders
+    'wix.com', 'wixsite.com', 'squarespace.com', 'weebly.com', 'wordpress.com', 'blogspot.com', 'webflow.io',
+    'shopify.com', 'myshopify.com', 'github.io', 'netlify.app', 'vercel.app', 'herokuapp.com', 'carrd.co',
+    'notion.site', 'google.com', 'linktr.ee',
+    # Social networks and company profiles
+    'linkedin.com', 'facebook.com', 'instagram.com', 'twitter.com', 'x.com', 'youtube.com', 'medium.com',
+    'crunchbase.com', 'glassdoor.com', 'indeed.com', 'wellfound.com', 'angel.co',
+    # Applicant tracking systems hosting careers pages
+    'greenhouse.io', 'lever.co', 'workable.com', 'bamboohr.com', 'recruitee.com', 'smartrecruiters.com',
+    'ashbyhq.com', 'personio.de', 'teamtailor.com', 'jobvite.com', 'breezy.hr', 'myworkdayjobs.com',
+}
+
+def finishes_site_request(callback):
+    """Count the request of the site as finished once the callback has yielded everything"""
+    @wraps(callback)
+    def wrapper(self, response):
+        try:
+            yield from callback(self, response)
+        finally:
+            self.site_request_finished(response.request)
+    return wrapper
 
 class EmailSpider(scrapy.Spider):
     name = 'email_spider'
 
-    def __init__(self, start_urls, *args, **kwargs):
+    def __init__(self, start_urls=None, companies=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         # Split the comma-separated start URLs into a list
         if isinstance(start_urls, str):
             self.start_urls = start_urls.split(',')
         else:
-            self.start_urls = start_urls
-        
-        self.start_urls = ensure_urls_valid(self.start_urls)
+            self.start_urls = start_urls or []
+
+        # Companies to crawl websites of, pages and emails are attributed to them.
+        # It can be any iterable e.g. a stream of companies read from a file, it's consumed lazily by start_requests()
+        self.companies = companies if companies is not None else ({ 'url': url } for url in self.start_urls)
+
+        # Registrable domain -> company key, for pages that lost their company e.g. requests not made by the spider
+        self.company_index = {}
 
         # Use default values that will be overridden by from_crawler()
         self.max_pages_per_domain = 50
         self.priority_url_keywords = []
+        self.satisfying_email_keywords = []
+        self.deny_extensions = IGNORED_EXTENSIONS
+        self.link_scorer = LinkScorer(self.priority_url_keywords)
+        self.sitemap_discovery = False
+        self.sitemap_max_sitemaps = 5
+        self.sitemap_max_urls = 10
+        self.browser_fallback = False
+        self.browser_fallback_max_pages = 3
+        self.depth_limit = 0
+
+        # Pages parsed and new emails found, to measure how many pages it takes to find an email
+        self.pages_parsed = 0
+        self.emails_found = 0
+
+        # Emails already found per site
+        self.site_emails = defaultdict(set)
+
+        # Domains emails are accepted for per site e.g. the start url domain and domains it redirected to
+        self.site_domains = defaultdict(set)
+
+        # Sites where good enough email is already found, their remaining requests are cancelled
+        self.done_sites = set()
+
+        # Sitemaps requested and sitemap urls enqueued per site
+        self.site_sitemaps = Counter()
+        self.site_sitemap_urls = Counter()
+
+        # Requests of the site that are scheduled but not finished yet, the site is finished when it gets to 0
+        self.site_pending = Counter()
+
+        # Pages parsed per site
+        self.site_pages = Counter()
+
+        # Start pages of sites that look rendered with JavaScript, site -> (url, company id).
+        # These are rendered in a browser if their static pages have no emails.
+        self.js_sites = {}
+
+    def start_requests(self):
+        for company in self.companies:
+            yield from self.site_requests(company)
+
+    def site_requests(self, company):
+        """Requests starting the crawl of the company website, e.g. to add sites to a running crawl with `engine.crawl()`"""
+        if not company.get('url'):
+            return
+        url = ensure_url_valid(company['url'])
+        self.company_index.setdefault(registrable_domain(host(url)), company_key(company))
+
+        # Every page of the site is tagged with the start url domain and the company it belongs to,
+        # so pages are attributed to the company even if the site redirects to another domain
+        meta = { 'site': site(url), 'company_id': company_key(company) }
+        yield self.track(scrapy.Request(url, callback=self.parse, errback=self.request_failed, dont_filter=True,
+                                        meta={ **meta, 'start_page': True }))
+
+        # Sitemaps often list careers and contact pages the start page doesn't link to
+        if self.sitemap_discovery:
+            yield self.track(scrapy.Request(urljoin(url, '/robots.txt'), callback=self.parse_robots, errback=self.discovery_failed,
+                                            meta={ **meta, 'discovery': True, 'handle_httpstatus_list': [404] }))
+
+    def track(self, request):
+        self.site_pending[request.meta['site']] += 1
+        return request
+
+    def within_depth_limit(self, response):
+        """Whether requests made from the response are within DEPTH_LIMIT.
+
+        DepthMiddleware drops the ones that aren't without any signal, so they would
+        never finish and their site would never be finished. These aren't made at all.
+        """
+        return not self.depth_limit or response.meta.get('depth', 0) < self.depth_limit
+
+    def site_request_finished(self, request):
+        current_site = request.meta.get('site')
+        # Done sites are finished already, their remaining requests are cancelled
+        if current_site in self.done_sites:
+            self.site_pending.pop(current_site, None)
+            return
+
+        self.site_pending[current_site] -= 1
+        if self.site_pending[current_site] > 0:
+            return
+        del self.site_pending[current_site]
+
+        # Static crawl of the site is over, render it in a browser if it found nothing because of JavaScript
+        js_start_page = self.js_sites.pop(current_site, None)
+        if js_start_page and current_site not in self.done_sites and not self.site_emails.get(current_site):
+            url, company_id = js_start_page
+            self.crawler.stats.inc_value('browser_fallback/sites', spider=self)
+            meta = { 'site': current_site, 'company_id': company_id, 'start_page': True, 'render': True, 'dont_cache': True }
+            self.crawler.engine.crawl(self.track(
+                scrapy.Request(url, callback=self.parse, errback=self.request_failed, dont_filter=True, meta=meta)))
+            return
+
+        self.site_finished(current_site, request.meta.get('company_id'), 'crawled')
 
-        # Set to store already found emails
-        self.found_emails = set()
+    def site_finished(self, current_site, company_id, status):
+        self.crawler.signals.send_catch_log(
+            site_crawled, site=current_site, company_id=company_id, status=status,
+            pages=self.site_pages[current_site], emails=len(self.site_emails.get(current_site, ())))
 
-         # Counter to track pages crawled per domain
-        self.pages_crawled_per_domain = defaultdict(int)
+        # Nothing is parsed for the site anymore
+        self.site_emails.pop(current_site, None)
+        self.site_domains.pop(current_site, None)
+        self.site_sitemaps.pop(current_site, None)
+        self.site_sitemap_urls.pop(current_site, None)
+        self.site_pages.pop(current_site, None)
 
+    def request_dropped(self, request, spider):
+        # Requests dropped by the scheduler e.g. duplicates or over budget are finished too
+        if 'site' in request.meta:
+            self.site_request_finished(request)
+
+    @finishes_site_request
     def parse(self, response):
         current_domain = domain(response.url)
+        current_site = response.meta.get('site') or site(response.url)
+        company_id = response.meta.get('company_id') or company_for_host(self.company_index, host(response.url))
 
-        # Use the efficient email extraction function, 
-        # NOTE: regex is very slow against whole response
-        emails = extract_emails(response.text, current_domain)
-        
-        # Only yield emails that haven't been found yet
-        for email in emails:
-            if email not in self.found_emails:
-                self.found_emails.add(email)
-                yield { 'email': email }
-
-        # Increment the counter for this domain
-        self.pages_crawled_per_domain[current_domain] += 1
-
-        # Follow links only if we haven't reached the max pages for this domain
-        if self.pages_crawled_per_domain[current_domain] > self.max_pages_per_domain:
-            return 
+        # Accept emails of the whole registrable domain of the site and of the domains it redirected through,
+        # e.g. hr@example.co.uk found on careers.example.co.uk
+        site_domains = self.site_domains[current_site]
+        site_domains.add(registrable_domain(current_site))
+        for url in [*response.meta.get('redirect_urls', []), response.url]:
+            redirect_domain = registrable_domain(host(url))
+            if redirect_domain not in site_domains and self.is_company_domain(redirect_domain, company_id):
+                site_domains.add(redirect_domain)
+
+        # Scan raw bytes, decoding the whole response is a waste since most pages have no emails
+        emails = extract_emails(response.body, site_domains)
         
-        # Follow links only from the start pages (depth 0)
-        if response.meta.get('depth', 0) == 0:
+        # Only yield emails that haven't been found on this site yet
+        site_emails = self.site_emails[current_site]
+        new_emails = emails.difference(site_emails)
+        for email in new_emails:
+            site_emails.add(email)
+            yield { 'email': email, 'company_id': company_id, 'site': current_site, 'url': response.url }
+
+        # Learn which links lead to pages with new emails
+        self.link_scorer.record_page(response.meta.get('link_features', []), bool(new_emails))
+        self.pages_parsed += 1
+        self.emails_found += len(new_emails)
+        self.site_pages[current_site] += 1
+
+        # Stop crawling the site once it has an email we would pick for sending anyway
+        if any(is_satisfying_email(email, self.satisfying_email_keywords) for email in emails):
+            self.logger.debug(f'Found satisfying email on {response.url}, stop crawling {current_site}')
+            self.done_sites.add(current_site)
+            self.crawler.stats.inc_value('done_sites/count', spider=self)
+            self.site_finished(current_site, company_id, 'done')
+            return
+
+        rendered = response.meta.get('render', False)
+        if self.browser_fallback and response.meta.get('start_page') and not rendered and looks_js_rendered(response.body):
+            self.js_sites[current_site] = (response.url, company_id)
+
+        # Follow links only from the start pages
+        if response.meta.get('start_page') and isinstance(response, TextResponse) and self.within_depth_limit(response):
             le = LinkExtractor(
                 # Avoid crawling external links e.g. youtube
                 allow_domains=[current_domain], 
                 # Avoid duplicate crawling of already visited pages
                 process_value=remove_fragment,
+                # Avoid downloading binary files e.g. pdf, images or videos
+                deny_extensions=self.deny_extensions,
             )
             links = le.extract_links(response)
             
-            # Prioritize links containing keywords
-            prioritized_links = prioritize_links(links, self.priority_url_keywords)
-            
-            # How many requests we could send to this domain
-            links_limit = self.max_pages_per_domain - self.pages_crawled_per_domain[current_domain]
-            
-            for link in prioritized_links[:links_limit]:
-                yield scrapy.Request(link.url, callback=self.parse)
+            # Pages budget of the site is enforced by the scheduler when requests are enqueued,
+            # the most relevant links go first so they get into the budget.
+            # Part of the budget is left for pages found in sitemaps.
+            max_links = self.max_pages_per_domain - (self.sitemap_max_urls if self.sitemap_discovery else 0)
+            # Rendered pages have their own small budget, they were likely downloaded statically before
+            if rendered:
+                max_links = self.browser_fallback_max_pages - 1
+            for link in self.link_scorer.top_links(links, max_links):
+                meta = {
+                    'site': current_site,
+                    'company_id': company_id,
+                    'link_features': self.link_scorer.features(link.url),
+                }
+                if rendered:
+                    meta.update({ 'render': True, 'dont_cache': True })
+                yield self.track(scrapy.Request(link.url, callback=self.parse, errback=self.request_failed, meta=meta,
+                                                dont_filter=rendered))
+
+    def is_company_domain(self, domain, company_id):
+        """Check if a domain the site redirected to belongs to the company, not to another one or to a shared platform"""
+        owner = self.company_index.get(domain)
+        if owner is not None:
+            return owner == company_id
+        return domain not in SHARED_PLATFORM_DOMAINS
+
+    @finishes_site_request
+    def parse_robots(self, response):
+        if not self.within_depth_limit(response):
+            return
+        sitemap_urls = sitemap_urls_from_robots(response.body) if response.status == 200 else []
+        # Most sites without Sitemap line in robots.txt still have the sitemap at the default location
+        if not sitemap_urls:
+            sitemap_urls = [urljoin(response.url, '/sitemap.xml')]
+
+        for url in sitemap_urls:
+            yield from self.sitemap_request(url, response)
+
+    def sitemap_request(self, url, response):
+        current_site = response.meta['site']
+        if self.site_sitemaps[current_site] >= self.sitemap_max_sitemaps:
+            return
+        self.site_sitemaps[current_site] += 1
+        self.crawler.stats.inc_value('sitemap/sitemaps', spider=self)
+
+        meta = {
+            'site': current_site,
+            'company_id': response.meta.get('company_id'),
+            'discovery': True,
+            'download_guard_content_types': SITEMAP_CONTENT_TYPES,
+        }
+        yield self.track(scrapy.Request(url, callback=self.parse_sitemap, errback=self.discovery_failed, meta=meta))
+
+    @finishes_site_request
+    def parse_sitemap(self, response):
+        current_site = response.meta['site']
+        if current_site in self.done_sites or not self.within_depth_limit(response):
+            return
+        site_domains = { registrable_domain(current_site), registrable_domain(host(response.url)) }
+        # Sitemaps listed by a sitemap index
+        child_sitemaps = []
+
+        def page_links():
+            for kind, url in iter_sitemap(response.body):
+                if kind == 'sitemap':
+                    child_sitemaps.append(url)
+                    continue
+                self.crawler.stats.inc_value('sitemap/urls_listed', spider=self)
+                if registrable_domain(host(url)) in site_domains and not has_denied_extension(url, self.deny_extensions):
+                    yield Link(remove_fragment(url))
+
+        # Sitemaps can list thousands of pages, only the best scored ones are kept while streaming them
+        max_urls = self.sitemap_max_urls - self.site_sitemap_urls[current_site]
+        for link in self.link_scorer.top_links(page_links(), max_urls):
+            self.site_sitemap_urls[current_site] += 1
+            self.crawler.stats.inc_value('sitemap/urls_enqueued', spider=self)
+            meta = {
+                'site': current_site,
+                'company_id': response.meta.get('company_id'),
+                'link_features': self.link_scorer.features(link.url),
+            }
+            # Go ahead of the links extracted from the start page
+            yield self.track(scrapy.Request(link.url, callback=self.parse, errback=self.request_failed, meta=meta, priority=1))
+
+        for url in child_sitemaps:
+            yield from self.sitemap_request(url, response)
+
+    def discovery_failed(self, failure):
+        # Sites without robots.txt or sitemaps are common, these aren't worth a warning
+        self.logger.debug(f'Discovery request to {failure.request.url} failed: {failure.value!r}')
+        self.crawler.signals.send_catch_log(site_request_failed, request=failure.request, failure=failure)
+        self.site_request_finished(failure.request)
+
+    def request_failed(self, failure):
+        self.crawler.signals.send_catch_log(site_request_failed, request=failure.request, failure=failure)
+        self.site_request_finished(failure.request)
+        # Requests cancelled on purpose e.g. by download guard or for done sites aren't errors
+        if failure.check(IgnoreRequest, StopDownload):
+            return
+        self.logger.warning(f'Request to {failure.request.url} failed: {failure.value!r}')
+
+    def closed(self, reason):
+        self.link_scorer.save()
+
+        pages_per_email = self.pages_parsed / self.emails_found if self.emails_found else None
+        self.crawler.stats.set_value('link_scoring/pages_parsed', self.pages_parsed, spider=self)
+        self.crawler.stats.set_value('link_scoring/emails_found', self.emails_found, spider=self)
+        self.crawler.stats.set_value('link_scoring/pages_per_email', pages_per_email, spider=self)
+        if pages_per_email:
+            self.logger.info(f'{self.pages_parsed} pages parsed, {self.emails_found} emails found, '
+                             f'{pages_per_email:.1f} pages per email')
 
     @classmethod
     def from_crawler(cls, crawler, *args, **kwargs):
@@ -72,73 +355,33 @@ class EmailSpider(scrapy.Spider):
         # Set these attributes after the spider is created
         spider.max_pages_per_domain = crawler.settings.get('MAX_PAGES_PER_DOMAIN', 50)
         spider.priority_url_keywords = crawler.settings.get('PRIORITY_URL_KEYWORDS', [])
+        spider.satisfying_email_keywords = crawler.settings.get('SATISFYING_EMAIL_KEYWORDS', [])
+        spider.deny_extensions = list(IGNORED_EXTENSIONS) + crawler.settings.getlist('DOWNLOAD_GUARD_DENY_EXTENSIONS')
+        spider.link_scorer = LinkScorer(spider.priority_url_keywords, crawler.settings.get('LINK_SCORES_FILE'),
+                                        crawler.settings.get('LINK_SCORES_SHARD_FILE'))
+        spider.sitemap_discovery = crawler.settings.getbool('SITEMAP_DISCOVERY', False)
+        spider.sitemap_max_sitemaps = crawler.settings.getint('SITEMAP_MAX_SITEMAPS', 5)
+        spider.sitemap_max_urls = crawler.settings.getint('SITEMAP_MAX_URLS', 10)
+        spider.browser_fallback = crawler.settings.getbool('BROWSER_FALLBACK', False)
+        spider.browser_fallback_max_pages = crawler.settings.getint('BROWSER_FALLBACK_MAX_PAGES', 3)
+        spider.depth_limit = crawler.settings.getint('DEPTH_LIMIT')
+        crawler.signals.connect(spider.request_dropped, signal=signals.request_dropped)
         return spider
 
 def domain(url):
     parsed_url = urlparse(url)
     return parsed_url.netloc
 
+def site(url):
+    """Domain of the url without www. prefix"""
+    return domain(url).removeprefix('www.')
+
 def remove_fragment(url):
     parsed = urlparse(url)
     return urlunparse(parsed._replace(fragment=''))
 
-def ensure_urls_valid(urls):
+def ensure_url_valid(url):
     # Avoid missing scheme errors
-    valid_urls = []
-    for url in urls:
-        if not url.startswith(("http://", "https://")):
-            url = "https://" + url  # Assume HTTPS by default
-        valid_urls.append(url)
-    return valid_urls
-
-def prioritize_links(links, priority_keywords):
-    """Sort links based on highest priority keyword found in the URL path.
-    
-    1. Only checks the URL path for the first matching keyword.
-    2. Priority is based on the keyword position in the priority_keywords list.
-    3. URLs whose paths don't match any keyword have the lowest priority.
-    """
-    def priority_score(link):
-        path = urlparse(link.url).path.lower()
-        for index, keyword in enumerate(priority_keywords):
-            if keyword.lower() in path:
-                # Lower index means higher priority
-                return index
-        # If no keywords match, return a value higher than any index
-        return len(priority_keywords) + 1
-    
-    return sorted(links, key=priority_score)
-
-def extract_emails(text, domain):
-    target = "@" + domain.replace('www.', '')
-    # Allowed characters for the email username (based on [\w\.-])
-    allowed_chars = set("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_.-")
-    emails = set()
-    pos = 0
-    target_len = len(target)
-    
-    while True:
-        # Use str.find to locate the target pattern which is fast in C
-        pos = text.find(target, pos)
-        if pos == -1:
-            break
-        
-        # Ensure the match is exact:
-        # Check that the character right after the domain is not part of the email
-        end_idx = pos + target_len
-        if end_idx < len(text) and text[end_idx] in allowed_chars:
-            pos += target_len  # skip if the domain continues (e.g. matching "example.com" in "example.com.au")
-            continue
-
-        # Walk backwards from the '@' sign to extract the email username
-        start = pos - 1
-        while start >= 0 and text[start] in allowed_chars:
-            start -= 1
-        
-        username = text[start + 1: pos]
-        if username:
-            emails.add(username + target)
-        
-        pos += target_len  # Continue searching after this occurrence
-    
-    return emails
\ No newline at end of file
+    if not url.startswith(("http://", "https://")):
+        url = "https://" + url  # Assume HTTPS by default
+    return url
@@ -1,10 +1,19 @@
+import argparse
 import json
+import os
 import re
 import time
 import random
+import threading
 import traceback
+from datetime import timedelta
+from functools import partial
+from glob import glob
+from queue import Empty, Queue
 from playwright.sync_api import sync_playwright, Page
 from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
+from rate_limit import AdaptivePacer, TokenBucket
+from lead_store import LeadStore
 
 def merge_query_params(url, params):
     parsed_url = urlparse(url)
@@ -24,6 +33,55 @@ def random_sleep(min, max):
     random_sleep_time = random.uniform(min, max)
     time.sleep(random_sleep_time)
 
+def default_pace():
+    """Pause before every navigation to look like a human"""
+    random_sleep(6, 10)
+
+def launch_browser(playwright, headless=False, lean=False):
+    # No need to slow down actions when the pace is driven by page load times
+    return playwright.chromium.launch(headless = headless, args= ['--start-maximized'], slow_mo = 0 if lean else 50)
+
+## Lean mode
+# Heavy resources aren't needed to parse companies, they only cost bandwidth and time.
+
+BLOCKED_RESOURCE_TYPES = {'image', 'media', 'font'}
+
+BLOCKED_URL_PARTS = [
+    'px.ads.linkedin.com',
+    'li/track',
+    'google-analytics.com',
+    'googletagmanager.com',
+    'doubleclick.net',
+]
+
+def block_heavy_resources(page: Page):
+    def handle_route(route):
+        request = route.request
+        if request.resource_type in BLOCKED_RESOURCE_TYPES or any(part in request.url for part in BLOCKED_URL_PARTS):
+            route.abort()
+        else:
+            route.continue_()
+    page.route('**/*', handle_route)
+
+def is_challenge_url(url):
+    return '/checkpoint/' in url or '/authwall' in url
+
+def watch_page_load(page: Page, pacer: AdaptivePacer):
+    """Feed page load times and throttling signals of the page to the pacer"""
+    def on_response(response):
+        if response.status == 429:
+            print('Linkedin responded with 429 Too Many Requests, slowing down.')
+            pacer.throttled()
+
+    def on_navigated(frame):
+        if frame == page.main_frame and is_challenge_url(frame.url):
+            print('Linkedin challenge page detected, slowing down.')
+            pacer.throttled()
+
+    page.on('load', lambda _: pacer.record_page_loaded())
+    page.on('response', on_response)
+    page.on('framenavigated', on_navigated)
+
 def login(page, email, password):
     page.goto('https://www.linkedin.com/')
     page.type('#session_key', email)
@@ -61,36 +119,420 @@ def parse_company_from_company_details_page(page: Page):
         print(e)
     return company
 
-def next_company(page: Page):
-    while True:
-        # 25 is the limit of search results per page
-        for i in range(25):
-            try:
-                search_result = page.locator('.artdeco-list__item').nth(i)
+def scroll_to_search_result(page: Page, i):
+    """Scroll to the i-th search result and wait until it's loaded, return None if there is no such result"""
+    try:
+        search_result = page.locator('.artdeco-list__item').nth(i)
 
-                # Scroll down to current search result in order to trigger its loading
-                search_result.evaluate("node => node.scrollIntoView({ behavior: 'smooth', block: 'start' })")
+        # Scroll down to current search result in order to trigger its loading
+        search_result.evaluate("node => node.scrollIntoView({ behavior: 'smooth', block: 'start' })")
 
-                # Wait until search result is fully loaded
-                search_result.locator('[data-anonymize="company-name"]').wait_for()
-            except:
-                return None
-            
-            # Go to company details page
-            random_sleep(6, 10)
-            search_result.locator('[data-control-name="view_company_via_result_name"]').click()
-            page.wait_for_url('**/sales/company/**')
+        # Wait until search result is fully loaded
+        search_result.locator('[data-anonymize="company-name"]').wait_for()
+    except:
+        return None
+    return search_result
 
-            yield parse_company_from_company_details_page(page)
-            
-            # Return back to search results page
-            random_sleep(6, 10) 
-            page.go_back()
+def parse_company_via_details_page(page: Page, search_result, pace=default_pace):
+    # Go to company details page
+    pace()
+    search_result.locator('[data-control-name="view_company_via_result_name"]').click()
+    page.wait_for_url('**/sales/company/**')
+
+    company = parse_company_from_company_details_page(page)
+
+    # Return back to search results page
+    pace()
+    page.go_back()
+    return company
+
+def search_result_linkedin_id(search_result):
+    href = search_result.locator('[data-control-name="view_company_via_result_name"]').get_attribute('href')
+    match = re.search(r'company/(\d+)', href or '')
+    return match.group(1) if match else None
+
+def parse_search_results_page(page: Page, start_index=0, cursor=None, skip_company=None, pace=default_pace):
+    """Yield companies of the current search results page by visiting their details pages.
+
+    Results for which `skip_company(linkedin_id)` is true are skipped without visiting them.
+    Returns True if the page ended before the 25th result, i.e. there are no more results.
+    """
+    if cursor is None: cursor = {}
+    search_page_num = page_num(page)
+
+    # 25 is the limit of search results per page
+    for i in range(start_index, 25):
+        search_result = scroll_to_search_result(page, i)
+        if not search_result:
+            # Linkedin often shows no results at all when it throttles us
+            if i == 0 and isinstance(pace, AdaptivePacer): pace.throttled()
+            return True
+
+        if skip_company and skip_company(search_result_linkedin_id(search_result)):
+            continue
+
+        company = parse_company_via_details_page(page, search_result, pace)
+        cursor['page'] = search_page_num
+        cursor['index'] = i + 1
+        yield company
+
+    return False
+
+def next_company(page: Page, start_index=0, cursor=None, parse_page=parse_search_results_page):
+    """Yield companies from the search results starting at result `start_index` of the current page.
+
+    If `cursor` dict is given it's updated with the search page and the index of
+    the next result to parse right before each company is yielded.
+    """
+    while True:
+        no_more_results = yield from parse_page(page, start_index, cursor)
+        if no_more_results: return None
+
+        # Next pages are always parsed from the first result
+        start_index = 0
 
         if is_last_page(page): break
         else: next_page(page)
 
 
+## Network capture mode
+# Sales Navigator renders search results and company details from JSON API responses,
+# so we can read companies from those responses instead of clicking into every company.
+
+SEARCH_API_URL_PART = '/sales-api/salesApiAccountSearch'
+COMPANY_API_URL_PART = '/sales-api/salesApiCompanies/'
+COMPANY_API_URL = 'https://www.linkedin.com/sales-api/salesApiCompanies/{linkedin_id}?decoration=%28entityUrn%2Cname%2Cindustry%2Cwebsite%29'
+
+# Attributes we expect every parsed company to have
+COMPANY_FIELDS = ['linkedin_id', 'name', 'industry', 'url']
+
+def company_from_api_payload(payload):
+    """Build a company from Sales Navigator search result element or company details payload"""
+    urn = payload.get('entityUrn') or payload.get('companyUrn') or ''
+    match = re.search(r'(\d+)$', urn)
+    if not match:
+        return None
+
+    company = { 'linkedin_id': match.group(1) }
+    name = payload.get('companyName') or payload.get('name')
+    if name: company['name'] = name.strip()
+    if payload.get('industry'): company['industry'] = payload['industry'].strip()
+    if payload.get('website'): company['url'] = payload['website']
+    return company
+
+def missing_fields(company):
+    return [field for field in COMPANY_FIELDS if not company.get(field)]
+
+def merge_companies(company, fallback):
+    """Fill missing attributes of the company from the fallback one"""
+    return { **fallback, **{ k: v for k, v in company.items() if v } }
+
+def capture_api_responses(page: Page):
+    """Start collecting companies from Sales Navigator API responses received by the page.
+
+    Returns a dict with `search` mapping search results offset to the list of companies
+    and `companies` mapping linkedin_id to the company loaded by the company details API.
+    """
+    captured = { 'search': {}, 'companies': {} }
+
+    def on_response(response):
+        is_search = SEARCH_API_URL_PART in response.url
+        if not is_search and COMPANY_API_URL_PART not in response.url:
+            return
+        try:
+            data = response.json()
+        except Exception:
+            return
+
+        if is_search:
+            start = int(parse_qs(urlparse(response.url).query).get('start', ['0'])[0])
+            companies = [company_from_api_payload(element) for element in data.get('elements', [])]
+            captured['search'][start] = [company for company in companies if company]
+        else:
+            company = company_from_api_payload(data)
+            if company: captured['companies'][company['linkedin_id']] = company
+
+    page.on('response', on_response)
+    return captured
+
+def wait_for_captured_search_results(page: Page, captured, start, timeout=15):
+    """Wait until the search API response for results from `start` offset is captured"""
+    deadline = time.time() + timeout
+    while start not in captured['search'] and time.time() < deadline:
+        # Unlike time.sleep() this lets playwright dispatch response events
+        page.wait_for_timeout(250)
+    return captured['search'].get(start)
+
+def fetch_company_from_api(page: Page, linkedin_id):
+    """Request company details API directly with the session of the logged in page"""
+    try:
+        csrf_token = next(c['value'] for c in page.context.cookies() if c['name'] == 'JSESSIONID')
+        response = page.request.get(
+            COMPANY_API_URL.format(linkedin_id=linkedin_id),
+            headers={ 'csrf-token': csrf_token.strip('"'), 'x-restli-protocol-version': '2.0.0' })
+        return company_from_api_payload(response.json()) if response.ok else None
+    except Exception:
+        return None
+
+def capture_search_results_page(page: Page, start_index=0, cursor=None, skip_company=None, pace=default_pace, captured=None):
+    """Yield companies of the current search results page built from captured API responses.
+
+    Companies that miss some attributes are completed from company details API
+    and, if it's not available, from their details page.
+    """
+    if cursor is None: cursor = {}
+    search_page_num = page_num(page)
+    companies = wait_for_captured_search_results(page, captured, (search_page_num - 1) * 25)
+
+    if companies is None:
+        print(f'Search results API response of page {search_page_num} was not captured, '
+              'parsing companies via their details pages.')
+        return (yield from parse_search_results_page(page, start_index, cursor, skip_company, pace))
+
+    for i in range(start_index, len(companies)):
+        company = companies[i]
+
+        if skip_company and skip_company(company['linkedin_id']):
+            continue
+
+        if missing_fields(company):
+            details = captured['companies'].get(company['linkedin_id']) or fetch_company_from_api(page, company['linkedin_id'])
+            if details:
+                # Whatever is still missing the company simply doesn't have e.g. website
+                company = merge_companies(company, details)
+            else:
+                search_result = scroll_to_search_result(page, i)
+                if search_result:
+                    company = merge_companies(company, parse_company_via_details_page(page, search_result, pace))
+
+        cursor['page'] = search_page_num
+        cursor['index'] = i + 1
+        yield company
+
+    # 25 is the limit of search results per page
+    return len(companies) < 25
+
+
+## Parallel mode
+# Search results pages are shared between several browsers logged in with the same session.
+# All of them take turns from a single rate limiter so together they don't exceed Linkedin limits.
+
+def parse_whole_search_page(page: Page, url, parse_page, start_index, pace):
+    """Go to the search results page and parse it, returns its companies and whether there are no more results"""
+    pace()
+    page.goto(url)
+    companies = parse_page(page, start_index, {}, pace=pace)
+    page_companies = []
+    while True:
+        try:
+            page_companies.append(next(companies))
+        except StopIteration as result:
+            return page_companies, result.value
+
+def parse_search_page_again_if_empty(page: Page, url, parse_page, start_index, pace):
+    """Parse the search results page, an empty one is parsed again after backing off `empty_page_retries` times.
+
+    Linkedin often shows no results at all when it throttles us, it isn't the end of results then.
+    """
+    for attempt in range(empty_page_retries + 1):
+        if attempt:
+            print(f'No results on {url}, parsing it again in case Linkedin throttled us.')
+            time.sleep(empty_page_backoff * attempt)
+        page_companies, no_more_results = parse_whole_search_page(page, url, parse_page, start_index, pace)
+        if page_companies or not no_more_results:
+            break
+    return page_companies, no_more_results
+
+def parse_search_pages_worker(storage_state, start_url, pages, results, make_parse_page, limiter, pacing=None, lean=False, headless=False):
+    """Parse search results pages taken from `pages` state and put (page, companies, error) to `results` queue.
+
+    In lean mode the worker paces itself by load times of its own pages with an `AdaptivePacer(**pacing)`.
+    """
+    def pace():
+        limiter.acquire()
+        # Some jitter so requests of different workers don't look synchronized
+        random_sleep(0, 2)
+
+    if lean:
+        # Adaptive pacer takes tokens from the shared limiter itself
+        pacer = pace = AdaptivePacer(**(pacing or {}), limiter=limiter)
+
+    with sync_playwright() as playwright:
+        browser = launch_browser(playwright, headless, lean)
+        context = browser.new_context(storage_state=storage_state, no_viewport=True)
+        page = context.new_page()
+        if lean:
+            block_heavy_resources(page)
+            watch_page_load(page, pacer)
+        parse_page = make_parse_page(page)
+
+        while True:
+            with pages['lock']:
+                search_page_num = pages['next']
+                if search_page_num > pages['last']: break
+                pages['next'] += 1
+
+            start_index = pages['start_index'] if search_page_num == pages['first'] else 0
+            try:
+                page_companies, no_more_results = parse_search_page_again_if_empty(
+                    page, merge_query_params(start_url, { 'page': search_page_num }), parse_page, start_index, pace)
+
+                if no_more_results or is_last_page(page):
+                    with pages['lock']:
+                        pages['last'] = min(pages['last'], search_page_num)
+
+                results.put((search_page_num, page_companies, None))
+            except Exception:
+                results.put((search_page_num, None, traceback.format_exc()))
+                break
+
+        browser.close()
+
+def next_company_parallel(storage_state, start_url, workers, limiter, make_parse_page, start_page=1, start_index=0, cursor=None,
+                          pacing=None, lean=False, headless=False):
+    """Yield companies parsed by `workers` browsers in search results page order.
+
+    `cursor` is updated to point to the next page once all companies of a page are yielded.
+    """
+    if cursor is None: cursor = {}
+    pages = {
+        'lock': threading.Lock(),
+        'first': start_page,
+        'start_index': start_index,
+        'next': start_page,
+        # The last page is unknown until some worker reaches it
+        'last': float('inf'),
+    }
+    results = Queue()
+    threads = [
+        threading.Thread(
+            target=parse_search_pages_worker,
+            args=(storage_state, start_url, pages, results, make_parse_page, limiter, pacing, lean, headless),
+            daemon=True)
+        for _ in range(workers)
+    ]
+    for thread in threads: thread.start()
+
+    # Pages are parsed out of order, so keep them until all previous pages are yielded
+    parsed_pages = {}
+    next_page_num = start_page
+    while next_page_num <= pages['last']:
+        if next_page_num not in parsed_pages:
+            try:
+                search_page_num, companies, error = results.get(timeout=1)
+            except Empty:
+                # All workers are done but the page was never parsed
+                if not any(thread.is_alive() for thread in threads): break
+                continue
+            if error:
+                raise Exception(f'Worker failed at page {search_page_num}:\n{error}')
+            parsed_pages[search_page_num] = companies
+            continue
+
+        for company in parsed_pages.pop(next_page_num):
+            yield company
+        next_page_num += 1
+        cursor['page'] = next_page_num
+        cursor['index'] = 0
+
+    for thread in threads: thread.join()
+
+
+def append_to_journal(journal_file, company):
+    """Append the company as a single JSON line and make sure it hits the disk"""
+    journal_file.write(json.dumps(company) + '\n')
+    journal_file.flush()
+    os.fsync(journal_file.fileno())
+
+def read_journal(file_path):
+    """Read companies from the journal skipping duplicates and a partially written last line"""
+    companies = {}
+    if not os.path.exists(file_path):
+        return []
+
+    with open(file_path, 'r') as f:
+        for line in f:
+            try:
+                company = json.loads(line)
+            except json.JSONDecodeError:
+                # The process was probably killed in the middle of writing this line
+                continue
+            # Companies re-parsed after resume override previous records
+            key = company.get('linkedin_id') or len(companies)
+            companies[key] = company
+    return list(companies.values())
+
+def save_cursor(file_path, cursor):
+    """Atomically replace the cursor file so a crash never leaves it half written"""
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(cursor, f)
+    os.replace(tmp_path, file_path)
+
+def load_cursor(file_path):
+    if not os.path.exists(file_path):
+        return None
+    with open(file_path, 'r') as f:
+        return json.load(f)
+
+def read_companies_file(file_path):
+    """Read companies from a journal or a JSON output file, an output file that doesn't exist or is broken has none"""
+    if file_path.endswith('.jsonl'):
+        return read_journal(file_path)
+    try:
+        with open(file_path, 'r') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return []
+
+def merge_output_companies(previous, parsed):
+    """Previous output companies updated with the parsed ones, companies without linkedin_id are kept as they are"""
+    companies = {}
+    for company in [*previous, *parsed]:
+        key = company.get('linkedin_id') or len(companies)
+        companies[key] = company
+    return list(companies.values())
+
+def load_known_companies(index_path, output_paths):
+    """Load linkedin_id -> last scraped time index of already scraped companies.
+
+    Companies from output files that are not in the index yet are added to it
+    with the file modification time as their scrape time.
+    """
+    known = {}
+    if os.path.exists(index_path):
+        with open(index_path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                known[record['linkedin_id']] = max(record['scraped_at'], known.get(record['linkedin_id'], 0))
+
+    with open(index_path, 'a') as index_file:
+        for file_path in output_paths:
+            scraped_at = os.path.getmtime(file_path)
+            for company in read_companies_file(file_path):
+                linkedin_id = company.get('linkedin_id')
+                if linkedin_id and linkedin_id not in known:
+                    known[linkedin_id] = scraped_at
+                    index_file.write(json.dumps({ 'linkedin_id': linkedin_id, 'scraped_at': scraped_at }) + '\n')
+    return known
+
+def add_known_company(index_file, known, linkedin_id):
+    known[linkedin_id] = time.time()
+    index_file.write(json.dumps({ 'linkedin_id': linkedin_id, 'scraped_at': known[linkedin_id] }) + '\n')
+    index_file.flush()
+
+def is_known_company(known, linkedin_id, refresh_older_than=None):
+    """Check if the company was scraped before and doesn't need to be refreshed yet"""
+    if linkedin_id not in known:
+        return False
+    if refresh_older_than is None:
+        return True
+    return time.time() - known[linkedin_id] < refresh_older_than.total_seconds()
+
+
 ## Settings
 
 linkedin_email = "your_linkedin_email",
@@ -99,44 +541,184 @@ linkedin_password = "your_linkedin_password",
 # Linkedin Sales Navigator companies search results page URL
 start_url = "https://www.linkedin.com/sales/search/company?query=(spellCorrectionEnabled%3Atrue%2Ckeywords%3Asitecore)"
 
+# Final output file, the journal is merged into it once parsing is stopped
+output_file_path = 'companies.json'
+
+# Every parsed company is appended to the journal right away
+journal_file_path = 'companies.jsonl'
+
+# Search page and result index to resume parsing from
+cursor_file_path = 'companies.cursor.json'
+
+# Linkedin ids of all companies scraped so far, they are skipped in search results
+known_companies_index_path = 'known_companies.jsonl'
+
+# Previous output files the known companies index is built from
+known_companies_sources = [output_file_path, *glob('scraped_companies/*.json')]
+
+# Leads database every parsed company is upserted into, see lead_store.py
+lead_store_path = 'leads.db'
+
+# Navigations per minute allowed for all parallel workers together
+actions_per_minute = 8
+
+# Search results page with no results in parallel mode is parsed again this many times before it's taken
+# as the end of results, after waiting `empty_page_backoff` seconds times the attempt number
+empty_page_retries = 2
+empty_page_backoff = 60
+
+# Pause before a navigation in --lean mode is `load_time_factor` times the average page load time,
+# it's multiplied by `backoff_factor` each time Linkedin throttles us
+lean_pacing = {
+    'min_delay': 2,
+    'max_delay': 300,
+    'load_time_factor': 2,
+    'backoff_factor': 2,
+}
+
 
 ## MAIN
 
-with sync_playwright() as playwright:
-    print('Launching Chrome browser...')
-    browser = playwright.chromium.launch(headless = False, args= ['--start-maximized'], slow_mo = 50)
-    page = browser.new_page(no_viewport = True)
-    
-    print('Logging in...')
-    login(page, linkedin_email, linkedin_password)
-    print('Successfully logged in!')
-    
-    # Check if manual verification is required and wait for user input
-    if not re.search(r'feed', page.url):
-        print('Waiting until manual verification is done...')
-
-    page.wait_for_url("**/feed/**", timeout=0)
-
-    # Go to search results page
-    print('Navigating to search results page.')
-    random_sleep(6, 10)
-    page.goto(start_url)
-    
-    print('Start parsing companies...')
-    
-    try:
-        companies = []
+parser = argparse.ArgumentParser(description='Extract companies from Linkedin Sales Navigator search results.')
+parser.add_argument('--resume', action='store_true',
+                    help='continue from the last saved search page and result instead of starting over')
+parser.add_argument('--capture-api', action='store_true',
+                    help='build companies from Sales Navigator API responses and visit details pages only for missing attributes')
+parser.add_argument('--refresh-older-than', type=float, metavar='DAYS',
+                    help='parse again already known companies scraped more than DAYS ago')
+parser.add_argument('--no-skip-known', action='store_true',
+                    help='parse all search results even if they were scraped before')
+parser.add_argument('--workers', type=int, default=1,
+                    help='number of browsers parsing search results pages in parallel')
+parser.add_argument('--lean', action='store_true',
+                    help='block images, fonts, media and trackers and pace actions by measured page load times')
+parser.add_argument('--headless', action='store_true',
+                    help='run browser without a window, manual login verification is not possible then')
 
-        for company in next_company(page):
-            companies.append(company)
-        
-        print('Parsing finished sucessfully!')
-    except Exception as e:
-        print(f'An error occurred at page {page_num(page)}.')
-        print(traceback.format_exc())
-    finally:
-        with open('companies.json', 'w') as output_file:
-            json.dump(companies, output_file, indent=4)
-        print(f'{len(companies)} companies were parsed and saved to "companies.json" file.')
-
-    browser.close()
\ No newline at end of file
+def extracted_companies(args):
+    """Parse companies from search results, every company is yielded once it's saved to the journal, the leads database and the cursor.
+
+    Closing the generator stops parsing the same way the end of search results does, `companies.json` is written then too.
+    """
+    refresh_older_than = timedelta(days=args.refresh_older_than) if args.refresh_older_than is not None else None
+
+    if args.no_skip_known:
+        known_companies = {}
+        skip_company = None
+    else:
+        known_companies = load_known_companies(
+            known_companies_index_path, [path for path in known_companies_sources if os.path.exists(path)])
+        skip_company = lambda linkedin_id: is_known_company(known_companies, linkedin_id, refresh_older_than)
+        print(f'{len(known_companies)} already known companies will be skipped.')
+
+    cursor = load_cursor(cursor_file_path) if args.resume else None
+
+    if args.resume and not cursor:
+        print(f'No cursor found in "{cursor_file_path}", starting from the first page.')
+
+    with sync_playwright() as playwright:
+        print('Launching Chrome browser...')
+        browser = launch_browser(playwright, args.headless, args.lean)
+        page = browser.new_page(no_viewport = True)
+        if args.lean:
+            block_heavy_resources(page)
+
+        print('Logging in...')
+        login(page, linkedin_email, linkedin_password)
+        print('Successfully logged in!')
+
+        # Check if manual verification is required and wait for user input
+        if not re.search(r'feed', page.url):
+            print('Waiting until manual verification is done...')
+
+        page.wait_for_url("**/feed/**", timeout=0)
+
+        def make_parse_page(page):
+            # Start listening before search results are requested so the first page response isn't missed
+            if args.capture_api:
+                captured = capture_api_responses(page)
+                return partial(capture_search_results_page, captured=captured, skip_company=skip_company)
+            return partial(parse_search_results_page, skip_company=skip_company)
+
+        if cursor:
+            print(f"Resuming from page {cursor['page']}, result {cursor['index'] + 1}.")
+        else:
+            cursor = { 'page': 1, 'index': 0 }
+
+        if args.workers > 1:
+            print(f'Starting {args.workers} workers sharing the logged in session...')
+            storage_state = page.context.storage_state()
+            browser.close()
+            limiter = TokenBucket(actions_per_minute / 60)
+            companies_iter = next_company_parallel(
+                storage_state, start_url, args.workers, limiter, make_parse_page, cursor['page'], cursor['index'], cursor,
+                lean_pacing, args.lean, args.headless)
+        else:
+            if args.lean:
+                pacer = AdaptivePacer(**lean_pacing)
+                watch_page_load(page, pacer)
+                parse_page = partial(make_parse_page(page), pace=pacer)
+            else:
+                parse_page = make_parse_page(page)
+
+            # Go to search results page
+            print('Navigating to search results page.')
+            random_sleep(6, 10)
+            page.goto(merge_query_params(start_url, { 'page': cursor['page'] }) if cursor['page'] > 1 else start_url)
+            companies_iter = next_company(page, cursor['index'], cursor, parse_page)
+
+        print('Start parsing companies...')
+
+        # Keep the journal of the interrupted run when resuming
+        journal_file = open(journal_file_path, 'a' if args.resume else 'w')
+        known_companies_index = open(known_companies_index_path, 'a')
+        lead_store = None
+        parsed_count = 0
+        parsing_started_at = last_parsed_at = time.monotonic()
+
+        try:
+            lead_store = LeadStore(lead_store_path)
+
+            for company in companies_iter:
+                append_to_journal(journal_file, company)
+                lead_store.upsert_company(company)
+                save_cursor(cursor_file_path, cursor)
+                if company.get('linkedin_id'):
+                    add_known_company(known_companies_index, known_companies, company['linkedin_id'])
+                parsed_count += 1
+
+                if args.lean:
+                    now = time.monotonic()
+                    print(f"{company.get('name', company.get('linkedin_id'))} parsed in {now - last_parsed_at:.1f}s, "
+                          f"{(now - parsing_started_at) / parsed_count:.1f}s per company on average.")
+                    last_parsed_at = now
+
+                yield company
+
+            print('Parsing finished sucessfully!')
+        except Exception as e:
+            print(f"An error occurred at page {cursor['page']}.")
+            print(traceback.format_exc())
+        finally:
+            journal_file.close()
+            known_companies_index.close()
+            if lead_store:
+                lead_store.close()
+            # Companies skipped as known aren't in the journal of a fresh run, the ones of the previous output are kept
+            companies = merge_output_companies(read_companies_file(output_file_path), read_journal(journal_file_path))
+            with open(output_file_path, 'w') as output_file:
+                json.dump(companies, output_file, indent=4)
+            print(f'{parsed_count} companies were parsed in this run, '
+                  f'{len(companies)} companies were saved to "{output_file_path}" file.')
+            if parsed_count:
+                print(f'{(time.monotonic() - parsing_started_at) / parsed_count:.1f}s per company on average.')
+
+        if args.workers <= 1:
+            browser.close()
+
+def main():
+    for company in extracted_companies(parser.parse_args()):
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+import random, threading, time, uuid
+import httplib2
+from googleapiclient.errors import HttpError
+
+class FakeGmailService:
+    """Local stand-in for the Gmail API service, only `users().messages().send()` is supported.
+
+    Sending takes `latency` seconds and fails with 429 Too Many Requests with `throttle_rate`
+    probability, like Gmail does under load. Sent messages are kept in `sent` with the time
+    they were sent at, so a run can be checked without sending anything for real.
+    """
+
+    def __init__(self, account='me', latency=0.2, throttle_rate=0):
+        self.account = account
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def send(self, userId, body):
+        return FakeSendRequest(self, body)
+
+class FakeSendRequest:
+    def __init__(self, service, body):
+        self.service = service
+        self.body = body
+
+    def execute(self):
+        time.sleep(self.service.latency)
+        if random.random() < self.service.throttle_rate:
+            raise HttpError(httplib2.Response({'status': 429}), b'{"error": {"message": "Too many requests"}}')
+
+        message = { 'id': uuid.uuid4().hex, 'account': self.service.account, 'sent_at': time.time() }
+        with self.service.lock:
+            self.service.sent.append({ **message, 'raw': self.body['raw'] })
+        return message
@@ -0,0 +1,57 @@
+import time
+from scrapy.downloadermiddlewares.httpcache import HttpCacheMiddleware
+from scrapy.extensions.httpcache import RFC2616Policy
+
+# Header the time a response was cached at is stored in
+CACHED_AT_HEADER = b'X-Cached-At'
+
+class TTLRevalidatePolicy(RFC2616Policy):
+    """HTTP cache policy for re-scraping the same sites.
+
+    Company sites rarely send useful cache headers, so cached pages are fresh for
+    `HTTPCACHE_TTL` seconds regardless of them. Stale pages are revalidated with
+    If-None-Match/If-Modified-Since and are downloaded again only if they changed.
+    With `HTTPCACHE_CACHED_ONLY` every cached page is fresh, which together with
+    `HTTPCACHE_IGNORE_MISSING` re-runs the crawl over cached pages without network access.
+    """
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.ttl = settings.getint('HTTPCACHE_TTL', 7 * 24 * 3600)
+        self.cached_only = settings.getbool('HTTPCACHE_CACHED_ONLY')
+        self.ignore_http_codes = [int(code) for code in settings.getlist('HTTPCACHE_IGNORE_HTTP_CODES')]
+
+    def should_cache_response(self, response, request):
+        # Cache pages even if the site asks not to, the TTL decides when they get stale
+        if response.status in self.ignore_http_codes:
+            return False
+        response.headers[CACHED_AT_HEADER] = str(int(time.time()))
+        return True
+
+    def is_cached_response_fresh(self, cachedresponse, request):
+        if self.cached_only:
+            return True
+
+        cached_at = int(cachedresponse.headers.get(CACHED_AT_HEADER, 0))
+        if time.time() - cached_at < self.ttl:
+            return True
+
+        # Let the site tell if the page has changed since it was cached
+        self._set_conditional_validators(request, cachedresponse)
+        return False
+
+class RevalidatingHttpCacheMiddleware(HttpCacheMiddleware):
+    """HTTP cache middleware storing pages again once the site confirms they haven't changed.
+
+    Scrapy returns the cached page on 304 Not Modified without storing it, so its
+    `X-Cached-At` would stay old and the page would be revalidated on every run.
+    Storing it again goes through `TTLRevalidatePolicy.should_cache_response()`,
+    which refreshes the time and the page is fresh for another `HTTPCACHE_TTL`.
+    """
+
+    def process_response(self, request, response, spider):
+        cachedresponse = request.meta.get('cached_response')
+        result = super().process_response(request, response, spider)
+        if cachedresponse is not None and result is cachedresponse:
+            self._cache_response(spider, cachedresponse, request, None)
+        return result
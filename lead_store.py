@@ -0,0 +1,265 @@
+import argparse, json, sqlite3, time
+from company_files import iter_companies, write_companies
+from company_index import company_key, host, registrable_domain
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS companies (
+    key TEXT PRIMARY KEY,
+    linkedin_id TEXT,
+    domain TEXT,
+    name TEXT,
+    industry TEXT,
+    url TEXT,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS companies_linkedin_id ON companies (linkedin_id);
+CREATE INDEX IF NOT EXISTS companies_domain ON companies (domain);
+
+CREATE TABLE IF NOT EXISTS emails (
+    company_key TEXT NOT NULL,
+    linkedin_id TEXT,
+    domain TEXT,
+    email TEXT NOT NULL,
+    source_url TEXT,
+    found_at REAL NOT NULL,
+    PRIMARY KEY (company_key, email)
+);
+CREATE INDEX IF NOT EXISTS emails_linkedin_id ON emails (linkedin_id);
+CREATE INDEX IF NOT EXISTS emails_domain ON emails (domain);
+
+CREATE TABLE IF NOT EXISTS crawl_status (
+    domain TEXT PRIMARY KEY,
+    company_key TEXT,
+    linkedin_id TEXT,
+    status TEXT NOT NULL,
+    pages INTEGER NOT NULL DEFAULT 0,
+    emails INTEGER NOT NULL DEFAULT 0,
+    crawled_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS crawl_status_linkedin_id ON crawl_status (linkedin_id);
+
+CREATE TABLE IF NOT EXISTS send_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    company_key TEXT,
+    linkedin_id TEXT,
+    domain TEXT,
+    email TEXT NOT NULL,
+    status TEXT NOT NULL,
+    message_id TEXT,
+    error TEXT,
+    sent_at REAL NOT NULL,
+    account TEXT
+);
+CREATE INDEX IF NOT EXISTS send_log_linkedin_id ON send_log (linkedin_id);
+CREATE INDEX IF NOT EXISTS send_log_domain ON send_log (domain);
+CREATE INDEX IF NOT EXISTS send_log_email ON send_log (email);
+CREATE INDEX IF NOT EXISTS send_log_company_key ON send_log (company_key);
+'''
+
+# Account emails logged before send_log had the account column were sent from, the only token file older versions used
+LEGACY_SEND_ACCOUNT = 'token.json'
+
+def company_domain(company):
+    return registrable_domain(host(company['url'])) if company.get('url') else None
+
+class LeadStore:
+    """Companies, their emails, crawl status of their sites and sent emails in a single SQLite database.
+
+    All stages upsert what they produce as they go instead of rewriting the companies file.
+    The database is in WAL mode, so a stage can read it while another one writes, e.g. shards of a crawl.
+    Companies are identified by `company_key()`, the same key crawled emails are attributed with.
+    """
+
+    def __init__(self, path='leads.db'):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        # Durable enough with WAL, a crash can lose only the last transactions, never corrupt the database
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+        self.migrate()
+
+    def migrate(self):
+        """Add columns missing in databases created by older versions"""
+        send_log_columns = [row['name'] for row in self.connection.execute('PRAGMA table_info(send_log)')]
+        if 'account' not in send_log_columns:
+            with self.connection:
+                self.connection.execute('ALTER TABLE send_log ADD COLUMN account TEXT')
+
+        # Sends logged without the account count to the quota of the account they were sent from
+        with self.connection:
+            self.connection.execute('UPDATE send_log SET account = ? WHERE account IS NULL', (LEGACY_SEND_ACCOUNT,))
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def upsert_companies(self, companies):
+        """Insert or update companies, attributes already stored but missing in the update are kept.
+
+        The whole company is kept as JSON, its main attributes in their own columns too.
+        Emails listed by companies are added to the emails table.
+        """
+        now = time.time()
+        with self.connection:
+            for company in companies:
+                key = company_key(company)
+                if not key:
+                    continue
+                company = dict(company)
+                emails = company.pop('emails', None) or []
+
+                row = self.connection.execute('SELECT data FROM companies WHERE key = ?', (key,)).fetchone()
+                if row:
+                    company = { **json.loads(row['data']), **company }
+
+                self.connection.execute(
+                    '''INSERT INTO companies (key, linkedin_id, domain, name, industry, url, data, updated_at)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                       ON CONFLICT (key) DO UPDATE SET
+                           linkedin_id = excluded.linkedin_id, domain = excluded.domain, name = excluded.name,
+                           industry = excluded.industry, url = excluded.url, data = excluded.data,
+                           updated_at = excluded.updated_at''',
+                    (key, company.get('linkedin_id'), company_domain(company), company.get('name'),
+                     company.get('industry'), company.get('url'), json.dumps(company), now))
+                self.insert_emails(key, company, ({ 'email': email } for email in emails), now)
+
+    def upsert_company(self, company):
+        self.upsert_companies([company])
+
+    def insert_emails(self, key, company, records, now):
+        self.connection.executemany(
+            '''INSERT INTO emails (company_key, linkedin_id, domain, email, source_url, found_at)
+               VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT (company_key, email) DO NOTHING''',
+            [(key, company.get('linkedin_id'), company_domain(company), record['email'], record.get('url'), now)
+             for record in records])
+
+    def add_emails(self, records):
+        """Add emails found by the crawl, records are the same as in the found emails journal"""
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                '''INSERT INTO emails (company_key, linkedin_id, domain, email, source_url, found_at)
+                   VALUES (?, (SELECT linkedin_id FROM companies WHERE key = ?), ?, ?, ?, ?)
+                   ON CONFLICT (company_key, email) DO NOTHING''',
+                [(record['company_id'], record['company_id'], registrable_domain(record['site']), record['email'],
+                  record.get('url'), now)
+                 for record in records if record.get('company_id')])
+
+    def set_crawl_status(self, domain, company_key, status, pages=0, emails=0):
+        with self.connection:
+            self.connection.execute(
+                '''INSERT INTO crawl_status (domain, company_key, linkedin_id, status, pages, emails, crawled_at)
+                   VALUES (?, ?, (SELECT linkedin_id FROM companies WHERE key = ?), ?, ?, ?, ?)
+                   ON CONFLICT (domain) DO UPDATE SET
+                       company_key = excluded.company_key, linkedin_id = excluded.linkedin_id, status = excluded.status,
+                       pages = excluded.pages, emails = excluded.emails, crawled_at = excluded.crawled_at''',
+                (domain, company_key, company_key, status, pages, emails, time.time()))
+
+    def log_send(self, company_key, email, status, message_id=None, error=None, account=None):
+        """Log the email sent to the company from the account, returns id of the log entry to update its status later"""
+        with self.connection:
+            cursor = self.connection.execute(
+                '''INSERT INTO send_log (company_key, linkedin_id, domain, email, status, message_id, error, sent_at, account)
+                   VALUES (?, (SELECT linkedin_id FROM companies WHERE key = ?), ?, ?, ?, ?, ?, ?, ?)''',
+                (company_key, company_key, email.rsplit('@', 1)[-1], email, status, message_id, error, time.time(), account))
+            return cursor.lastrowid
+
+    def update_send(self, send_id, status, message_id=None, error=None):
+        with self.connection:
+            self.connection.execute(
+                'UPDATE send_log SET status = ?, message_id = ?, error = ? WHERE id = ?',
+                (status, message_id, error, send_id))
+
+    # Emails being sent when a run was killed may have been sent, they are never sent again
+    SENT_STATUSES = ('sent', 'sending')
+
+    def was_sent(self, email, company_key=None):
+        """Whether the email address or the company, if given, was already mailed"""
+        row = self.connection.execute(
+            'SELECT 1 FROM send_log WHERE (email = ? OR company_key = ?) AND status IN (?, ?) LIMIT 1',
+            (email, company_key, *self.SENT_STATUSES))
+        return row.fetchone() is not None
+
+    def sent_times(self, since, account=None):
+        """Times emails were sent at since the given time, from the account if given, oldest first"""
+        rows = self.connection.execute(
+            '''SELECT sent_at FROM send_log
+               WHERE sent_at > ? AND status IN (?, ?) AND (? IS NULL OR account = ?)
+               ORDER BY sent_at''',
+            (since, *self.SENT_STATUSES, account, account))
+        return [row['sent_at'] for row in rows]
+
+    def iter_companies(self, where='', params=(), page_size=None):
+        """Companies in the companies file format, with their emails, in the order they were first stored.
+
+        With `page_size` companies are read that many at a time, no read transaction is left open
+        between pages, so other connections can write and checkpoint while the caller is slow.
+        """
+        after = 0
+        while True:
+            # LIMIT -1 is no limit, the whole result is read through the open cursor then
+            rows = self.connection.execute(
+                f'''SELECT companies.rowid AS rowid, companies.data, group_concat(emails.email, char(10)) AS emails
+                    FROM companies LEFT JOIN emails ON emails.company_key = companies.key
+                    {where} {'AND' if where else 'WHERE'} companies.rowid > ?
+                    GROUP BY companies.key
+                    ORDER BY companies.rowid
+                    LIMIT ?''', (*params, after, page_size or -1))
+            if page_size:
+                rows = rows.fetchall()
+            for row in rows:
+                company = json.loads(row['data'])
+                company['emails'] = sorted(row['emails'].split('\n')) if row['emails'] else []
+                yield company
+            if not page_size or len(rows) < page_size:
+                return
+            after = rows[-1]['rowid']
+
+    def companies_to_crawl(self, page_size=None):
+        """Companies with a website that hasn't been crawled yet"""
+        return self.iter_companies('WHERE companies.url IS NOT NULL AND companies.domain NOT IN (SELECT domain FROM crawl_status)',
+                                   page_size=page_size)
+
+    def companies_to_send(self, page_size=None):
+        """Crawled companies with emails, the ones already mailed are skipped by the sender"""
+        return self.iter_companies('''WHERE companies.domain IN (SELECT domain FROM crawl_status)
+                                      AND companies.key IN (SELECT company_key FROM emails)''', page_size=page_size)
+
+    def company(self, key):
+        return next(self.iter_companies('WHERE companies.key = ?', (key,)), None)
+
+    def import_json(self, path):
+        """Import companies from a companies file, JSON or JSONL"""
+        self.upsert_companies(iter_companies(path))
+
+    def export_json(self, path):
+        """Export companies with their emails to a companies file, JSON or JSONL by the file extension"""
+        write_companies(path, self.iter_companies())
+
+
+## MAIN
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import companies files into the leads database or export it to a companies file.')
+    parser.add_argument('command', choices=['import', 'export'])
+    parser.add_argument('files', nargs='+', help='companies files to import, or a single file to export to')
+    parser.add_argument('--db', default='leads.db', help='leads database path')
+    args = parser.parse_args()
+
+    with LeadStore(args.db) as store:
+        if args.command == 'import':
+            for path in args.files:
+                store.import_json(path)
+                print(f'Imported companies from {path}')
+        else:
+            store.export_json(args.files[0])
+            print(f'Exported companies to {args.files[0]}')
@@ -0,0 +1,132 @@
+import heapq, json, os, re
+from urllib.parse import urlparse
+
+def compile_keywords(keywords):
+    """Compile keywords into a single pattern, duplicates are dropped keeping the first occurrence"""
+    keywords = list(dict.fromkeys(keyword.lower() for keyword in keywords))
+    # Longer keywords go first so e.g. "vacancies" isn't matched as "vacancy"
+    alternatives = sorted(keywords, key=len, reverse=True)
+    pattern = re.compile('|'.join(re.escape(keyword) for keyword in alternatives)) if keywords else None
+    return keywords, pattern
+
+def matched_keywords(pattern, path):
+    return set(pattern.findall(path)) if pattern else set()
+
+def prioritize_links(links, priority_keywords):
+    """Sort links based on highest priority keyword found in the URL path.
+    
+    1. Only checks the URL path for the first matching keyword.
+    2. Priority is based on the keyword position in the priority_keywords list.
+    3. URLs whose paths don't match any keyword have the lowest priority.
+    """
+    keywords, pattern = compile_keywords(priority_keywords)
+    rank = { keyword: index for index, keyword in enumerate(keywords) }
+
+    def priority_score(link):
+        matched = matched_keywords(pattern, urlparse(link.url).path.lower())
+        # If no keywords match, return a value higher than any index
+        return min((rank[keyword] for keyword in matched), default=len(keywords) + 1)
+
+    return sorted(links, key=priority_score)
+
+class LinkScorer:
+    """Score links by how likely their pages are to contain new emails.
+
+    Link features are priority keywords found in the url path and its first path segments.
+    Every feature has a success rate learned from the crawl history: how many pages with
+    this feature were fetched and how many of them produced new emails. Until a feature
+    has enough history its rate stays close to a prior given by the keyword position in
+    the priority list. History is persisted between runs in `scores_path` file.
+
+    Shards of a crawl don't write `scores_path`, each of them saves only the history it
+    has recorded to its own `shard_scores_path` and these are merged with `merge_link_scores()`.
+    """
+
+    # How many pages of history weigh as much as the prior
+    PRIOR_WEIGHT = 5
+    # Prior success rate of the most and the least relevant keyword and of other features
+    TOP_KEYWORD_PRIOR = 0.5
+    LAST_KEYWORD_PRIOR = 0.1
+    SEGMENT_PRIOR = 0.05
+    NO_FEATURES_SCORE = 0.01
+
+    def __init__(self, keywords, scores_path=None, shard_scores_path=None):
+        self.keywords, self.pattern = compile_keywords(keywords)
+        self.scores_path = scores_path
+        self.shard_scores_path = shard_scores_path
+        # Feature -> [pages fetched, pages that produced new emails]
+        self.history = read_link_scores(scores_path)
+        # History recorded by this crawl only
+        self.recorded = {}
+
+    def keyword_prior(self, keyword):
+        position = self.keywords.index(keyword) / max(len(self.keywords) - 1, 1)
+        return self.TOP_KEYWORD_PRIOR - position * (self.TOP_KEYWORD_PRIOR - self.LAST_KEYWORD_PRIOR)
+
+    def features(self, url):
+        path = urlparse(url).path.lower()
+        features = [f'keyword:{keyword}' for keyword in matched_keywords(self.pattern, path)]
+        segments = [segment for segment in path.split('/') if segment][:2]
+        features += [f'segment:{segment}' for segment in segments]
+        return features
+
+    def prior(self, feature):
+        kind, value = feature.split(':', 1)
+        return self.keyword_prior(value) if kind == 'keyword' and value in self.keywords else self.SEGMENT_PRIOR
+
+    def feature_score(self, feature):
+        pages, productive_pages = self.history.get(feature, (0, 0))
+        return (productive_pages + self.PRIOR_WEIGHT * self.prior(feature)) / (pages + self.PRIOR_WEIGHT)
+
+    def score(self, url):
+        return max((self.feature_score(feature) for feature in self.features(url)), default=self.NO_FEATURES_SCORE)
+
+    def top_links(self, links, k):
+        """Select k links with the highest scores without sorting all of them"""
+        return heapq.nlargest(k, links, key=lambda link: self.score(link.url))
+
+    def matched_keyword(self, url):
+        """The most relevant priority keyword found in the url path, if any"""
+        matched = matched_keywords(self.pattern, urlparse(url).path.lower())
+        return min(matched, key=self.keywords.index) if matched else None
+
+    def record_page(self, features, produced_emails):
+        for feature in features:
+            for history in (self.history.setdefault(feature, [0, 0]), self.recorded.setdefault(feature, [0, 0])):
+                history[0] += 1
+                if produced_emails:
+                    history[1] += 1
+
+    def save(self):
+        if self.shard_scores_path:
+            write_link_scores(self.shard_scores_path, self.recorded)
+        elif self.scores_path:
+            write_link_scores(self.scores_path, self.history)
+
+def read_link_scores(path):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def write_link_scores(path, history):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(history, f)
+    os.replace(tmp_path, path)
+
+def merge_link_scores(scores_path, shard_scores_paths):
+    """Add history recorded by crawl shards to the scores file, merged shard files are removed"""
+    history = read_link_scores(scores_path)
+    shard_scores_paths = [path for path in shard_scores_paths if os.path.exists(path)]
+    for path in shard_scores_paths:
+        for feature, (pages, productive_pages) in read_link_scores(path).items():
+            feature_history = history.setdefault(feature, [0, 0])
+            feature_history[0] += pages
+            feature_history[1] += productive_pages
+
+    if shard_scores_paths:
+        write_link_scores(scores_path, history)
+        # Shard history is in the scores file now, merging it again would count it twice
+        for path in shard_scores_paths:
+            os.remove(path)
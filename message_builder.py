@@ -0,0 +1,117 @@
+import base64, mimetypes, os, random
+from email import encoders
+from email.header import Header
+from email.mime.base import MIMEBase
+from email.mime.text import MIMEText
+from string import Formatter
+
+def compile_template(template):
+    """Parse a str.format() template once, the returned function renders it with the given values"""
+    pieces = []
+    for literal, field, format_spec, conversion in Formatter().parse(template):
+        if literal:
+            pieces.append((literal, None))
+        if field is not None:
+            if format_spec or conversion:
+                raise ValueError(f'Only plain {{field}} placeholders are supported, got {{{field}!{conversion}:{format_spec}}}')
+            pieces.append((None, field))
+
+    def render(**values):
+        return ''.join(literal if field is None else str(values[field]) for literal, field in pieces)
+
+    return render
+
+def attachment_part(file_path):
+    """Attachment MIME part with the file content base64 encoded"""
+    # Guess the content type based on the file extension
+    content_type, encoding = mimetypes.guess_type(file_path)
+
+    if content_type is None or encoding is not None:
+        # If type cannot be guessed, use a generic type
+        content_type = 'application/octet-stream'
+
+    main_type, sub_type = content_type.split('/', 1)
+
+    with open(file_path, 'rb') as fp:
+        attachment = MIMEBase(main_type, sub_type)
+        attachment.set_payload(fp.read())
+
+    encoders.encode_base64(attachment)
+    attachment.add_header('Content-Disposition', 'attachment', filename=os.path.basename(file_path))
+    return attachment
+
+def pad_to_base64_block(data, padding=b'\n'):
+    """Append padding so the data is base64 encoded without `=` and can be concatenated with other encoded data"""
+    return data + padding * (-len(data) % 3)
+
+class MessageBuilder:
+    """Build Gmail API messages from templates, with attachments that are the same in every message.
+
+    Templates are compiled and attachments are read, MIME encoded and base64 encoded for
+    the Gmail API once. Every message only encodes its headers and body and concatenates
+    them with the encoded attachments: base64 of data whose length is a multiple of 3 has
+    no padding, so encoded pieces concatenate into the encoding of the whole message.
+    The builder isn't changed by building messages, so it can be shared between threads.
+    """
+
+    def __init__(self, sender, subject_template, body_template, attachments=()):
+        self.sender = sender
+        self.render_subject = compile_template(subject_template)
+        self.render_body = compile_template(body_template)
+        # The same boundary for all messages, it's random so it never appears in the content
+        self.boundary = '=' * 15 + ''.join(random.choices('0123456789', k=19)) + '=='
+
+        parts = []
+        for file_path in attachments:
+            if not os.path.isfile(file_path):
+                print(f"Warning: Attachment not found - {file_path}")
+                continue
+            parts.append(attachment_part(file_path).as_bytes())
+
+        delimiter = f'\n--{self.boundary}\n'.encode()
+        # Blank lines after base64 data of the last attachment are ignored by decoders
+        self.attachments = pad_to_base64_block(delimiter.join(parts)) if parts else b''
+        self.encoded_attachments = base64.urlsafe_b64encode(self.attachments)
+
+    def headers(self, to, subject):
+        """Headers of the message, a line break in a value would start a header of its own e.g. Bcc"""
+        if '\r' in to or '\n' in to:
+            raise ValueError(f'Line break in the recipient address {to!r}')
+        # Subject contains scraped values e.g. the company name, line breaks in them are only formatting
+        subject = ' '.join(subject.split())
+        if not subject.isascii():
+            subject = Header(subject, 'utf-8').encode()
+        return (
+            f'Content-Type: multipart/mixed; boundary="{self.boundary}"\n'
+            f'MIME-Version: 1.0\n'
+            f'to: {to}\n'
+            f'from: {self.sender}\n'
+            f'subject: {subject}\n'
+            f'\n'
+        ).encode()
+
+    def parts(self, to, **values):
+        """Message before attachments, attachments and message after them"""
+        body = MIMEText(self.render_body(**values)).as_bytes()
+        before = self.headers(to, self.render_subject(**values)) + f'--{self.boundary}\n'.encode() + body
+        if not self.attachments:
+            return before, b'', f'\n--{self.boundary}--\n'.encode()
+        before += f'\n--{self.boundary}\n'.encode()
+        after = f'\n--{self.boundary}--\n'.encode()
+        return before, self.attachments, after
+
+    def build_bytes(self, to, **values):
+        """The whole MIME message e.g. to save it as .eml file"""
+        return b''.join(self.parts(to, **values))
+
+    def build(self, to, **values):
+        """Gmail API message"""
+        before, attachments, after = self.parts(to, **values)
+        if not attachments:
+            return { 'raw': base64.urlsafe_b64encode(before + after).decode() }
+
+        # Blank lines before the first boundary are a MIME preamble ignored by email clients
+        headers_end = before.index(b'\n\n') + 2
+        before = before[:headers_end] + b'\n' * (-len(before) % 3) + before[headers_end:]
+        raw = base64.urlsafe_b64encode(before) + self.encoded_attachments + base64.urlsafe_b64encode(after)
+        return { 'raw': raw.decode() }
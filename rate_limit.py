@@ -0,0 +1,158 @@
+import random
+from collections import deque
+import threading
+import time
+
+class TokenBucket:
+    """Thread-safe token bucket rate limiter.
+
+    Tokens are refilled at `rate` tokens per second up to `capacity` tokens,
+    `acquire()` blocks until a token is available.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, tokens=1):
+        """Take tokens if available, otherwise return the time in seconds until they are"""
+        with self.lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        while True:
+            wait_time = self.try_acquire(tokens)
+            if not wait_time:
+                return
+            time.sleep(wait_time)
+
+class AdaptivePacer:
+    """Pauses between actions in proportion to the measured page load time.
+
+    The pause grows exponentially every time throttling is detected and shrinks
+    back gradually while pages keep loading normally. If `limiter` is given the
+    token is taken from it after the pause, so several workers can share it.
+    """
+
+    def __init__(self, min_delay=1, max_delay=300, load_time_factor=2, backoff_factor=2,
+                 recovery_factor=0.8, jitter=0.3, limiter=None):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.load_time_factor = load_time_factor
+        self.backoff_factor = backoff_factor
+        self.recovery_factor = recovery_factor
+        self.jitter = jitter
+        self.limiter = limiter
+        self.avg_load_time = None
+        self.backoff = 1
+        self.action_started_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def record_load_time(self, seconds):
+        with self.lock:
+            # Exponential moving average smooths out single slow pages
+            if self.avg_load_time is None:
+                self.avg_load_time = seconds
+            else:
+                self.avg_load_time = 0.7 * self.avg_load_time + 0.3 * seconds
+            self.backoff = max(1, self.backoff * self.recovery_factor)
+
+    def record_page_loaded(self):
+        self.record_load_time(time.monotonic() - self.action_started_at)
+
+    def throttled(self):
+        with self.lock:
+            self.backoff = min(self.backoff * self.backoff_factor, self.max_delay / self.min_delay)
+
+    def delay(self):
+        with self.lock:
+            base = self.min_delay if self.avg_load_time is None else max(self.min_delay, self.avg_load_time * self.load_time_factor)
+            delay = min(self.max_delay, base * self.backoff)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def wait(self):
+        time.sleep(self.delay())
+        if self.limiter:
+            self.limiter.acquire()
+        self.action_started_at = time.monotonic()
+
+    __call__ = wait
+
+class RollingWindowLimit:
+    """Thread-safe limit of `limit` actions within any `window` seconds e.g. 500 emails per rolling 24 hours.
+
+    Times (`time.time()`) of actions done before e.g. by previous runs count too.
+    """
+
+    def __init__(self, limit, window, times=()):
+        self.limit = limit
+        self.window = window
+        self.times = deque(sorted(times))
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        """Count the action if allowed, otherwise return the time in seconds until it is"""
+        with self.lock:
+            now = time.time()
+            while self.times and self.times[0] <= now - self.window:
+                self.times.popleft()
+            if len(self.times) < self.limit:
+                self.times.append(now)
+                return 0
+            return self.times[0] + self.window - now
+
+    def acquire(self):
+        while True:
+            wait_time = self.try_acquire()
+            if not wait_time:
+                return
+            time.sleep(wait_time)
+
+class QuotaPacer:
+    """Paces actions to stay within per-minute and rolling daily quotas.
+
+    The daily quota is spread evenly over the day instead of being spent in a burst,
+    the per-minute quota caps bursts and the rolling window is the hard limit that
+    also counts actions done before, given by their `times`.
+    """
+
+    DAY = 24 * 3600
+
+    def __init__(self, per_minute, per_day, times=()):
+        self.per_minute = per_minute
+        self.per_day = per_day
+        self.minute_bucket = TokenBucket(per_minute / 60, capacity=per_minute)
+        self.day_bucket = TokenBucket(per_day / self.DAY)
+        self.day_window = RollingWindowLimit(per_day, self.DAY, times)
+
+    def wait(self):
+        self.day_window.acquire()
+        self.day_bucket.acquire()
+        self.minute_bucket.acquire()
+
+    __call__ = wait
+
+    def projected_finish(self, count):
+        """Time (`time.time()`) the last of `count` actions would be done at if they started now"""
+        interval = max(self.DAY / self.per_day, 60 / self.per_minute)
+        times = list(self.day_window.times)
+        now = next_time = time.time()
+        for _ in range(count):
+            action_time = next_time
+            if len(times) >= self.per_day:
+                action_time = max(action_time, times[-self.per_day] + self.DAY)
+            times.append(action_time)
+            next_time = action_time + interval
+        return times[-1] if count else now
@@ -0,0 +1,275 @@
+import argparse, shlex, threading, time
+from collections import Counter
+from queue import Empty, Full, Queue
+from scrapy import signals
+from scrapy.crawler import CrawlerProcess
+from scrapy.exceptions import DontCloseSpider
+from twisted.internet import task
+from company_index import company_key, host, registrable_domain
+from email_spider import EmailSpider, site_crawled
+from lead_store import LeadStore
+import extract_companies, scrape_emails, send_emails
+
+def extraction_worker(extract_args, crawl_queue, stop, progress):
+    """Extract companies and queue them for the crawl, waits while the crawl queue is full"""
+    companies = extract_companies.extracted_companies(extract_args)
+    try:
+        for company in companies:
+            progress['extracted'] += 1
+            if not company.get('url'):
+                continue
+            while not stop.is_set():
+                try:
+                    crawl_queue.put(company, timeout=1)
+                    break
+                except Full:
+                    pass
+            if stop.is_set():
+                break
+    finally:
+        # Extraction stops the same way as at the end of search results, companies.json is written
+        companies.close()
+
+class CrawlFeeder:
+    """Add companies to the running crawl while it has fewer than `max_sites` sites in progress.
+
+    Companies of previous runs that weren't crawled yet go first, then the ones coming from
+    extraction. The spider is kept open while extraction is running, and every crawled
+    company is queued for sending. If the send queue is full, the company stays in the leads
+    database only, `send_backlog` tells the sending stage to pick it up from there. A site
+    that isn't finished within `site_timeout` seconds stops taking a slot of the crawl.
+    """
+
+    def __init__(self, crawler, crawl_queue, extraction, leftovers, send_queue, send_backlog, max_sites, site_timeout, progress):
+        self.crawler = crawler
+        self.crawl_queue = crawl_queue
+        self.extraction = extraction
+        self.leftovers = leftovers
+        self.send_queue = send_queue
+        self.send_backlog = send_backlog
+        self.max_sites = max_sites
+        self.site_timeout = site_timeout
+        self.progress = progress
+        self.spider = None
+        # Sites started by this run, a company extracted again or left over from a killed run isn't crawled twice
+        self.started_domains = set()
+        # Sites being crawled, site -> when it was started
+        self.sites_started = {}
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(self.site_crawled, signal=site_crawled)
+
+    def spider_opened(self, spider):
+        self.spider = spider
+        self.feed_task = task.LoopingCall(self.feed)
+        self.feed_task.start(1)
+
+    def spider_closed(self, spider):
+        if self.feed_task.running:
+            self.feed_task.stop()
+
+    def sites_in_progress(self):
+        started_before = time.monotonic() - self.site_timeout
+        for timed_out in [site for site, started_at in self.sites_started.items() if started_at < started_before]:
+            print(f'{timed_out} is not finished after {self.site_timeout} seconds, starting other sites')
+            del self.sites_started[timed_out]
+        return len(self.sites_started)
+
+    def next_company(self):
+        if self.leftovers is not None:
+            company = next(self.leftovers, None)
+            if company is not None:
+                return company
+            self.leftovers = None
+        try:
+            return self.crawl_queue.get_nowait()
+        except Empty:
+            return None
+
+    def feed(self):
+        while self.sites_in_progress() < self.max_sites:
+            company = self.next_company()
+            if company is None:
+                return
+            domain = registrable_domain(host(company['url']))
+            if domain in self.started_domains:
+                continue
+            self.started_domains.add(domain)
+            for request in self.spider.site_requests(company):
+                self.sites_started.setdefault(request.meta['site'], time.monotonic())
+                self.crawler.engine.crawl(request)
+
+    def upstream_running(self):
+        return self.leftovers is not None or not self.crawl_queue.empty() or (self.extraction and self.extraction.is_alive())
+
+    def spider_idle(self, spider):
+        self.feed()
+        if self.upstream_running():
+            raise DontCloseSpider
+
+    def site_crawled(self, site, company_id, status, pages, emails):
+        self.sites_started.pop(site, None)
+        self.progress['crawled'] += 1
+        if self.send_queue is None or not company_id:
+            return
+        try:
+            self.send_queue.put_nowait(company_id)
+        except Full:
+            self.send_backlog.set()
+
+def send_dispatcher(send_queue, send_backlog, senders, store_path, backlog_page_size):
+    """Send to companies as their crawl finishes, and to crawled companies in the leads database backlog.
+
+    The backlog is scanned when the send queue has overflowed and on start, so companies crawled
+    by previous runs are mailed too. It's read `backlog_page_size` companies at a time, so no read
+    transaction is held while sending blocks. Companies already mailed or handed to the senders
+    by this run are skipped, so a company queued and found in the backlog is mailed once.
+    """
+    store = LeadStore(store_path)
+    # Companies handed to the senders, their sends may not be logged yet
+    dispatched = set()
+
+    def send(companies):
+        for company, recipient in send_emails.recipients(companies, store):
+            key = company_key(company)
+            if key in dispatched:
+                continue
+            dispatched.add(key)
+            senders.send(company, recipient)
+
+    while True:
+        if send_backlog.is_set() and send_queue.empty():
+            send_backlog.clear()
+            send(store.companies_to_send(backlog_page_size))
+        try:
+            company_id = send_queue.get(timeout=1)
+        except Empty:
+            continue
+        if company_id is None:
+            break
+        company = store.company(company_id)
+        if company:
+            send([company])
+
+    if send_backlog.is_set():
+        send(store.companies_to_send(backlog_page_size))
+    store.close()
+
+def print_progress(crawl_queue, feeder, send_queue, send_backlog, senders, progress, started_at):
+    sent = sum(senders.sent_counts.values()) if senders else 0
+    if sent and 'first_sent_after' not in progress:
+        progress['first_sent_after'] = time.monotonic() - started_at
+
+    stages = [
+        f"extracted {progress['extracted']}, crawl queue {crawl_queue.qsize()}/{crawl_queue.maxsize}",
+        f"crawling {feeder.sites_in_progress() if feeder.spider else 0} sites, crawled {progress['crawled']}",
+    ]
+    if senders:
+        backlog = ', backlog in the database' if send_backlog.is_set() else ''
+        stages.append(f"send queue {send_queue.qsize()}/{send_queue.maxsize}{backlog}, "
+                      f"{senders.pending()} waiting for quota, sent {sent}")
+    if crawl_queue.full():
+        stages.append('extraction is waiting for the crawl')
+    print(' | '.join(stages))
+
+
+## Settings
+
+# Companies extracted but not being crawled yet, extraction waits while the queue is full
+crawl_queue_size = 100
+
+# Sites crawled at once, new ones are started as others finish
+max_sites_in_crawl = 200
+
+# Seconds a site may take before it stops counting to max_sites_in_crawl, e.g. if its crawl is never finished
+site_timeout = 30 * 60
+
+# Crawled companies waiting to be mailed, more of them wait in the leads database
+send_queue_size = 100
+
+# Companies read from the leads database at a time, the database is not kept locked for reading while they are sent
+backlog_page_size = 100
+
+# Seconds between progress lines
+progress_interval = 30
+
+
+## Main
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Extract companies, scrape their emails and send them emails, all at once: '
+                    'every company is crawled as soon as it is extracted and mailed as soon as its crawl is over.')
+    parser.add_argument('--db', default='leads.db', help='leads database all stages share, their progress is resumed from it')
+    parser.add_argument('--no-extract', action='store_true',
+                        help="don't extract companies, only crawl and mail companies in the database that weren't yet")
+    parser.add_argument('--no-send', action='store_true', help="don't send emails, crawled companies are mailed by a later run")
+    parser.add_argument('--fake-gmail', action='store_true',
+                        help='send through a local stand-in for Gmail API instead, to check a run without sending anything')
+    parser.add_argument('--extract-args', default='', metavar='ARGS',
+                        help='extract_companies.py options e.g. "--resume --lean --workers 2"')
+    args = parser.parse_args()
+
+    progress = Counter()
+    started_at = time.monotonic()
+    store = LeadStore(args.db)
+
+    # Stage 1: extraction runs in its own thread, Playwright sync API blocks
+    extract_companies.lead_store_path = args.db
+    crawl_queue = Queue(maxsize=crawl_queue_size)
+    stop = threading.Event()
+    extraction = None
+    if not args.no_extract:
+        extract_args = extract_companies.parser.parse_args(shlex.split(args.extract_args))
+        extraction = threading.Thread(target=extraction_worker, args=(extract_args, crawl_queue, stop, progress), daemon=True)
+        extraction.start()
+
+    # Stage 3: sending runs in a thread per account, fed by the dispatcher thread
+    send_queue = Queue(maxsize=send_queue_size)
+    # Crawled companies waiting in the database, including ones crawled by previous runs
+    send_backlog = threading.Event()
+    send_backlog.set()
+    senders = dispatcher = None
+    if not args.no_send:
+        senders = send_emails.Senders(send_emails.authorized_accounts(args.fake_gmail), send_emails.make_message_builder(), args.db)
+        dispatcher = threading.Thread(target=send_dispatcher, args=(send_queue, send_backlog, senders, args.db, backlog_page_size), daemon=True)
+        dispatcher.start()
+
+    # Stage 2: the crawl runs in the main thread, companies are added to it as they come
+    settings = { **scrape_emails.settings, 'LEAD_STORE': args.db }
+    process = CrawlerProcess(settings)
+    process.crawl(EmailSpider, companies=[])
+    crawler = list(process.crawlers)[0]
+    feeder = CrawlFeeder(crawler, crawl_queue, extraction, store.companies_to_crawl(backlog_page_size),
+                         None if args.no_send else send_queue, send_backlog, max_sites_in_crawl, site_timeout, progress)
+
+    close_reason = {}
+    crawler.signals.connect(lambda spider, reason: close_reason.update(reason=reason), signal=signals.spider_closed)
+    progress_task = task.LoopingCall(print_progress, crawl_queue, feeder, send_queue, send_backlog, senders, progress, started_at)
+    progress_task.start(progress_interval, now=False)
+
+    process.start()  # blocks until the crawl is over, it's over once extraction is finished and all sites are crawled
+
+    stop.set()
+    if extraction:
+        # Extraction stops after the company it's parsing, its journal and cursor are saved after every company anyway
+        extraction.join(timeout=60)
+
+    if senders:
+        if close_reason.get('reason') == 'finished':
+            print('Crawling finished, sending the remaining emails...')
+            send_queue.put(None)
+            dispatcher.join()
+            senders.join()
+        else:
+            print('Stopped, emails that were not sent yet will be sent by the next run.')
+
+    print(f"{progress['extracted']} companies extracted, {progress['crawled']} sites crawled, "
+          f"{sum(senders.sent_counts.values()) if senders else 0} emails sent.")
+    if 'first_sent_after' in progress:
+        print(f"The first email was sent {progress['first_sent_after'] / 60:.1f} minutes after the start.")
+    store.close()
+
+if __name__ == '__main__':
+    main()
@@ -1,49 +1,132 @@
 from scrapy.crawler import CrawlerProcess, Crawler
 from scrapy import signals
-import json, sys
-from email_spider import EmailSpider, domain
+import argparse, itertools, json, os, subprocess, sys
+from glob import escape, glob
+from company_files import iter_companies
+from company_index import shard_of
+from email_spider import EmailSpider
+from email_pipelines import merge_emails_into_companies, merge_emails_into_store
+from email_priority import priority_email_keywords
+from lead_store import LeadStore
+from link_scoring import merge_link_scores
 
-def update_companies_with_emails(file_path, spider):
-    # Load the original JSON file
-    with open(file_path, 'r') as f:
-        companies = json.load(f)
-    
-    # Create a dictionary to map domains to emails
-    domain_to_emails = {}
-    for email in spider.found_emails:
-        # Extract domain from email
-        email_domain = email.split('@')[1]
-        
-        if email_domain not in domain_to_emails:
-            domain_to_emails[email_domain] = []
-        domain_to_emails[email_domain].append(email)
-    
-    # Update each company with relevant emails
-    for company in companies:
-        if 'url' in company:
-            company_domain = domain(company['url']).replace('www.', '')
-            # Find emails for this domain
-            company['emails'] = domain_to_emails.get(company_domain, [])
-    
-    # Save the updated JSON back to the file
-    with open(file_path, 'w') as f:
-        json.dump(companies, f, indent=2)
-        
-    print(f"Updated {file_path} with found emails")
+def parse_shard(value):
+    """Parse k/N shard argument, shards are numbered from 1"""
+    try:
+        shard, shards = (int(number) for number in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Shard must look like 2/8, got {value}")
+    if not 1 <= shard <= shards:
+        raise argparse.ArgumentTypeError(f"Shard {shard} isn't between 1 and {shards}")
+    return shard, shards
+
+def parse_setting(value):
+    """Parse NAME=VALUE setting override, the value is JSON if it can be parsed as such, a string otherwise"""
+    name, separator, raw_value = value.partition('=')
+    if not name or not separator:
+        raise argparse.ArgumentTypeError(f"Setting must look like MAX_PAGES_PER_DOMAIN=20, got {value}")
+    try:
+        return name, json.loads(raw_value)
+    except ValueError:
+        return name, raw_value
+
+def shard_path(path, shard, shards):
+    """Output file of a shard e.g. found_emails.2-of-8.jsonl for found_emails.jsonl"""
+    base, extension = os.path.splitext(path)
+    return f"{base}.{shard}-of-{shards}{extension}"
+
+def shard_paths(path):
+    """Output files of all shards found, in the same order on every machine"""
+    base, extension = os.path.splitext(path)
+    return sorted(glob(f"{escape(base)}.*-of-*{extension}"))
+
+def is_lead_store(path):
+    return path.endswith('.db')
+
+def merge_found_emails(companies_path, journal_path):
+    journal_paths = [journal_path, *shard_paths(journal_path)]
+    if is_lead_store(companies_path):
+        added_count = merge_emails_into_store(companies_path, journal_paths)
+        print(f"Added {added_count} emails found in {len(journal_paths)} journals to {companies_path}")
+    else:
+        updated_count = merge_emails_into_companies(companies_path, journal_paths)
+        print(f"Updated {updated_count} companies in {companies_path} with emails found in {len(journal_paths)} journals")
+
+    merge_link_scores(settings['LINK_SCORES_FILE'], shard_paths(settings['LINK_SCORES_FILE']))
+
+def run_workers(args, workers):
+    """Crawl every shard in its own process and merge what they found once all of them are finished"""
+    options = [option for option, enabled in (('--cached-only', args.cached_only), ('--no-cache', args.no_cache)) if enabled]
+    options += [f"--set={name}={json.dumps(value)}" for name, value in args.set]
+    processes = [
+        subprocess.Popen([sys.executable, sys.argv[0], args.input_file, '--shard', f"{shard}/{workers}", *options])
+        for shard in range(1, workers + 1)
+    ]
+    exit_codes = [process.wait() for process in processes]
+    failed_shards = [shard for shard, exit_code in enumerate(exit_codes, 1) if exit_code != 0]
+    if failed_shards:
+        print(f"Shards {failed_shards} failed, merging emails they found before failing")
+    merge_found_emails(args.input_file, settings['EMAILS_JOURNAL'])
+    return 1 if failed_shards else 0
 
 
 ## Settings
 
 settings = {
     # Let's override some Scrapy settings for better performance
-    "DEPTH_LIMIT": 1,  # Limit the depth of the crawl
+    "DEPTH_LIMIT": 3,  # Limit the depth of the crawl, robots.txt -> sitemap index -> sitemap -> page
     "DOWNLOAD_TIMEOUT": 10,  # Short timeout to fail fast
     "RETRY_TIMES": 1,  # Only retry once
     "REDIRECT_MAX_TIMES": 3,  # Limit redirect
+    "CONCURRENT_REQUESTS": 64,  # Many sites are crawled at once, each of them slowly
+    "SCHEDULER": "crawl_scheduler.RoundRobinSiteScheduler",  # Serve sites in turns and enforce their page budget
+    "DOWNLOADER_MIDDLEWARES": {
+        # Cancel requests of sites that already have a good enough email
+        "crawl_middlewares.SkipDoneSitesMiddleware": 50,
+        # Avoid downloading binary files and huge pages
+        "crawl_middlewares.DownloadGuardMiddleware": 60,
+        # Render pages of JavaScript sites in a browser, before the cache could return their static versions
+        "crawl_middlewares.BrowserFallbackMiddleware": 70,
+        # Store revalidated pages again so they are fresh for another HTTPCACHE_TTL
+        "scrapy.downloadermiddlewares.httpcache.HttpCacheMiddleware": None,
+        "http_cache.RevalidatingHttpCacheMiddleware": 900,
+    },
+    "EXTENSIONS": {
+        # Report pages, bytes, latencies, errors and how emails were found for every site
+        "crawl_telemetry.CrawlTelemetry": 500,
+    },
+    "ITEM_PIPELINES": {
+        # Save every found email right away so nothing is lost if the crawl is killed
+        "email_pipelines.EmailJournalPipeline": 100,
+        # Keep found emails and crawl status of every site in the leads database
+        "email_pipelines.LeadStorePipeline": 200,
+    },
+
+    # Keep downloaded pages to avoid downloading them again on re-runs
+    "HTTPCACHE_ENABLED": True,
+    "HTTPCACHE_DIR": "httpcache",
+    "HTTPCACHE_GZIP": True,
+    "HTTPCACHE_POLICY": "http_cache.TTLRevalidatePolicy",
+    "HTTPCACHE_TTL": 7 * 24 * 3600,  # Cached pages older than this are revalidated with the site
 
     # Additional custom EmailScraper settings
+
+    "EMAILS_JOURNAL": "found_emails.jsonl", # Found emails are appended here and merged into the companies file
+
+    "LEAD_STORE": "leads.db", # Leads database found emails and crawl status of sites are upserted into, see lead_store.py
     
+    "TELEMETRY_JSONL": "crawl_telemetry.jsonl", # Telemetry of every crawled site, written as soon as its crawl is over
+    "TELEMETRY_CSV": "crawl_telemetry.csv", # The same as CSV, productive links are reduced to their keywords
+    "TELEMETRY_PROMETHEUS_FILE": None, # Totals of the crawl in Prometheus text format, e.g. "crawl_metrics.prom"
+    "TELEMETRY_PROMETHEUS_INTERVAL": 30, # Seconds between refreshes of the Prometheus file
+
     "MAX_PAGES_PER_DOMAIN": 50, # Maximum number of pages to crawl per domain
+
+    "MAX_CONCURRENT_REQUESTS_PER_SITE": 2, # Site isn't served by scheduler while it has this many requests in flight
+
+    "DOWNLOAD_GUARD_CONTENT_TYPES": ['text/html', 'application/xhtml+xml', 'text/plain'], # Other downloads are stopped after headers
+    "DOWNLOAD_GUARD_MAXSIZE": 1024 * 1024, # Only this many bytes of a page are downloaded and scanned for emails
+    "DOWNLOAD_GUARD_DENY_EXTENSIONS": ['json', 'xml', 'rss', 'atom', 'woff', 'woff2', 'ttf', 'eot', 'map'], # In addition to Scrapy's IGNORED_EXTENSIONS
    
     "PRIORITY_URL_KEYWORDS": [  # Keywords that indicate a high priority URL to crawl first
         'career',
@@ -60,36 +143,119 @@ settings = {
         'vacancy',
         'vacancies',
         'hiring',
-        'work',
         'contact',
         'about',
         'connect',
         'team',
-        'hiring',
         'hire'
-    ]
+    ],
+
+    # Which links led to pages with new emails is learned from the crawl history kept in this file,
+    # links are prioritized by it together with PRIORITY_URL_KEYWORDS
+    "LINK_SCORES_FILE": "link_scores.json",
+
+    # Fetch robots.txt and sitemaps of every site and crawl the best scored pages they list
+    # ahead of the links found on the start page, these get SITEMAP_MAX_URLS of the pages budget
+    "SITEMAP_DISCOVERY": True,
+    "SITEMAP_MAX_SITEMAPS": 5, # Maximum number of sitemaps to fetch per site, including sitemap index entries
+    "SITEMAP_MAX_URLS": 10, # Maximum number of pages from sitemaps to crawl per site
+
+    # Sites that look rendered with JavaScript and have no emails after their static crawl
+    # are crawled again in a headless browser, only a few of their most relevant pages
+    "BROWSER_FALLBACK": True,
+    "BROWSER_FALLBACK_PAGES": 2, # Browser pages rendering at once
+    "BROWSER_FALLBACK_MAX_PAGES": 3, # Maximum number of pages to render per site, including the start page
+    "BROWSER_FALLBACK_TIMEOUT": 20, # Seconds to wait for a page to render
+
+    # Crawling of a site stops as soon as an email matching one of these keywords is found.
+    # These are the job-related emails send_emails.py would pick anyway, generic ones like info@ aren't enough.
+    "SATISFYING_EMAIL_KEYWORDS": priority_email_keywords[:priority_email_keywords.index('contact')],
 }
 
 
 ## Main
 
-# Collect start urls from companies input file
-input_file = sys.argv[1] or 'companies.json'
+def main():
+    parser = argparse.ArgumentParser(description='Scrape emails from websites of companies.')
+    parser.add_argument('input_file', nargs='?', default='companies.json',
+                        help='companies file, JSON or JSONL, to take websites from and to add found emails to, '
+                             'or leads database (.db) to crawl its companies that were not crawled yet')
+    parser.add_argument('--cached-only', action='store_true',
+                        help='extract emails from cached pages only, without any network access')
+    parser.add_argument('--no-cache', action='store_true',
+                        help="don't use cached pages and don't cache downloaded ones")
+    parser.add_argument('--merge-only', action='store_true',
+                        help="don't crawl, only merge emails found so far into the companies file, including ones found by shards")
+    parser.add_argument('--workers', type=int, default=1,
+                        help='crawl in this many processes, each of them crawling its shard of the sites')
+    parser.add_argument('--shard', type=parse_shard,
+                        help="crawl only k-th of N shards of the sites e.g. 2/8, found emails are merged later with --merge-only")
+    parser.add_argument('-s', '--set', type=parse_setting, action='append', default=[], metavar='NAME=VALUE',
+                        help='override a setting e.g. -s MAX_PAGES_PER_DOMAIN=20, can be given several times')
+    parser.add_argument('--stats-file', help='write crawl stats to this JSON file when crawling is finished')
+    args = parser.parse_args()
+
+    settings.update(args.set)
+
+    if args.no_cache:
+        settings['HTTPCACHE_ENABLED'] = False
+
+    if args.cached_only:
+        settings['HTTPCACHE_ENABLED'] = True
+        settings['HTTPCACHE_CACHED_ONLY'] = True
+        # Pages that aren't cached are skipped instead of being downloaded
+        settings['HTTPCACHE_IGNORE_MISSING'] = True
+
+    # Collect start urls from companies input file
+    input_file = args.input_file
+
+    if args.merge_only:
+        merge_found_emails(input_file, settings['EMAILS_JOURNAL'])
+        sys.exit(0)
+
+    if args.workers > 1:
+        sys.exit(run_workers(args, args.workers))
+
+    # Companies are streamed from the file as the spider needs them, so even huge lists start crawling right away
+    if is_lead_store(input_file):
+        # Emails go to the database as they are found, the companies file isn't needed
+        settings['LEAD_STORE'] = input_file
+        companies = LeadStore(input_file).companies_to_crawl()
+    else:
+        companies = (company for company in iter_companies(input_file) if company.get('url'))
+
+    if args.shard:
+        # Sites are split by domain so every shard has its own sites and their whole budget
+        shard, shards = args.shard
+        companies = (company for company in companies if shard_of(company['url'], shards) == shard - 1)
+        settings['EMAILS_JOURNAL'] = shard_path(settings['EMAILS_JOURNAL'], shard, shards)
+        settings['LINK_SCORES_SHARD_FILE'] = shard_path(settings['LINK_SCORES_FILE'], shard, shards)
+        for name in ('TELEMETRY_JSONL', 'TELEMETRY_CSV', 'TELEMETRY_PROMETHEUS_FILE'):
+            if settings[name]:
+                settings[name] = shard_path(settings[name], shard, shards)
 
-with open(input_file, 'r') as f:
-    data = json.load(f)
-    start_urls = [item['url'] for item in data if 'url' in item]
+    first_company = next(companies, None)
+    if first_company is None:
+        print("No URLs found in the input file")
+        sys.exit(0 if args.shard else 1)
+    companies = itertools.chain([first_company], companies)
 
-if not start_urls:
-    print("No URLs found in the input file")
-    sys.exit(1)
+    print(f"Starting to crawl URLs from {input_file}...")
 
-print(f"Starting to crawl {len(start_urls)} URLs...")
+    process = CrawlerProcess(settings)
+    process.crawl(EmailSpider, companies=companies)
+    crawler: Crawler = list(process.crawlers)[0]
+    # Shards don't write the companies file, other shards may be crawling at the same time
+    if not args.shard:
+        spider_closed = lambda spider: merge_found_emails(input_file, settings['EMAILS_JOURNAL'])
+        crawler.signals.connect(spider_closed, signal=signals.spider_closed)
+    if args.stats_file:
+        def write_stats(spider):
+            with open(args.stats_file, 'w') as f:
+                json.dump(crawler.stats.get_stats(), f, indent=2, default=str)
+        crawler.signals.connect(write_stats, signal=signals.spider_closed)
 
-process = CrawlerProcess(settings)
-process.crawl(EmailSpider, start_urls=start_urls)
-crawler: Crawler = list(process.crawlers)[0]
-spider_closed = lambda spider: update_companies_with_emails(input_file, spider)
-crawler.signals.connect(spider_closed, signal=signals.spider_closed)
+    process.start()  # the script will block here until the crawling is finished
 
-process.start()  # the script will block here until the crawling is finished
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -1,26 +1,34 @@
-import base64, json, os, sys, time
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
-import mimetypes
-from googleapiclient.discovery import build
+import argparse, hashlib, json, os, random, sys, threading, time
+from collections import Counter
+from datetime import datetime
+from functools import cache
+from queue import Queue
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from google.auth.credentials import TokenState
 from google.oauth2.credentials import Credentials
+from company_files import iter_companies
+from company_index import company_key
+from lead_store import LeadStore
+from rate_limit import QuotaPacer
+from fake_gmail import FakeGmailService
+from message_builder import MessageBuilder
+from email_priority import priority_email_keywords, most_relevant_email_or_default
 
 # Gmail API scopes, we need to send emails only
 SCOPES = ['https://www.googleapis.com/auth/gmail.send']
 
-def auth():
+def auth(token_path='token.json'):
     """Authenticate with Gmail API and return credentials"""
     creds = None
     
-    # Check if token.json exists with stored credentials
-    if os.path.exists('token.json'):
+    # Check if token file exists with stored credentials
+    if os.path.exists(token_path):
         creds = Credentials.from_authorized_user_info(
-            json.loads(open('token.json').read())
+            json.loads(open(token_path).read())
         )
     
     # If credentials don't exist or are invalid, get new ones
@@ -33,135 +41,91 @@ def auth():
             creds = flow.run_local_server(port=0)
         
         # Save credentials for next run
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
+        save_token(token_path, creds)
     
     return creds
 
-def create_message(sender, to, subject, body, attachments=None):
-    """Create email message with optional attachments
-    
-    Args:
-        sender (str): Email sender
-        to (str): Email recipient
-        subject (str): Email subject
-        body (str): Email body content
-        attachments (list): Optional list of attachment file paths
-        
-    Returns:
-        dict: Gmail API message object
+def save_token(token_path, creds):
+    with open(token_path, 'w') as token:
+        token.write(creds.to_json())
+
+@cache
+def gmail_discovery_document():
+    """Gmail API discovery document bundled with the client library, loaded once for all accounts"""
+    return get_static_doc('gmail', 'v1')
+
+class GmailAccount:
+    """Gmail account emails are sent from, authorized with its own token file.
+
+    A stand-in `service` e.g. `FakeGmailService` can be given to send nothing for real.
     """
-    # Create multipart message
-    message = MIMEMultipart()
-    message['to'] = to
-    message['from'] = sender
-    message['subject'] = subject
-    
-    # Add body to email
-    message.attach(MIMEText(body))
-    
-    # Process attachments if provided
-    if attachments:
-        for file_path in attachments:
-            if not os.path.isfile(file_path):
-                print(f"Warning: Attachment not found - {file_path}")
-                continue
-                
-            # Guess the content type based on the file extension
-            content_type, encoding = mimetypes.guess_type(file_path)
-            
-            if content_type is None or encoding is not None:
-                # If type cannot be guessed, use a generic type
-                content_type = 'application/octet-stream'
-                
-            main_type, sub_type = content_type.split('/', 1)
-            
-            with open(file_path, 'rb') as fp:
-                # Create attachment
-                attachment = MIMEBase(main_type, sub_type)
-                attachment.set_payload(fp.read())
-                
-                # Encode attachment in base64
-                encoders.encode_base64(attachment)
-                
-                # Add header with the filename
-                filename = os.path.basename(file_path)
-                attachment.add_header('Content-Disposition', 'attachment', filename=filename)
-                message.attach(attachment)
-    
-    # Encode message as URL-safe base64 string
-    raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
-    return {'raw': raw}
-
-def send_email(service, user_id, message):
-    """Send email using Gmail API"""
-    try:
-        sent_message = service.users().messages().send(
-            userId=user_id, body=message).execute()
-        return sent_message
-    except Exception as error:
-        print(f"An error occurred: {error}")
-        return None
-    
-def most_relevant_email_or_default(emails, keywords):
-    if not emails:
-        return None
 
-    def score(email):
-        prefix = email.split('@')[0].lower()
-        
-        # Check for exact matches
-        for i, keyword in enumerate(keywords):
-            if prefix == keyword:
-                return i  # Score is just the index for exact match
-        
-        # Check for partial matches
-        for i, keyword in enumerate(keywords):
-            if keyword in prefix:
-                return i + 0.5  # Add small penalty for partial match
-        
-        # No match
-        return len(keywords) * 2  # Large score for no match
+    def __init__(self, token_path, service=None):
+        self.token_path = token_path
+        self.stand_in = service
+        self.creds = None
+        self._service = None
+
+    def service(self):
+        if self.stand_in:
+            return self.stand_in
+        # Authenticate(or get token) with Gmail API if not already
+        if not self.creds:
+            self.creds = auth(self.token_path)
+            # The service keeps using the same credentials object, so it's built only once
+            self._service = build_from_document(gmail_discovery_document(), credentials=self.creds)
+        elif self.creds.token_state != TokenState.FRESH:
+            self.creds.refresh(Request())
+            save_token(self.token_path, self.creds)
+        return self._service
 
-    return min(emails, key=score)  # Select email with lowest score
+def account_for(recipient, accounts):
+    """Account to send to the recipient from, always the same one for the same accounts"""
+    digest = hashlib.blake2b(recipient.lower().encode(), digest_size=8).digest()
+    return accounts[int.from_bytes(digest, 'big') % len(accounts)]
 
+class DailyLimitExceeded(Exception):
+    """Gmail won't send more emails from the account today"""
+
+def error_reason(error):
+    return error.content.decode('utf-8', errors='ignore').lower() if error.content else ''
+
+def is_temporary_error(error):
+    """Gmail throttles with 429 or 403 rate limit errors and fails temporarily with 5xx ones"""
+    status = error.resp.status
+    return status == 429 or status >= 500 or (status == 403 and 'ratelimitexceeded' in error_reason(error))
+
+def send_email(service, user_id, message, max_retries=5, backoff=30):
+    """Send email using Gmail API, temporary errors are retried with exponential backoff.
+
+    Returns the sent message, or None with the error if it couldn't be sent.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            sent_message = service.users().messages().send(
+                userId=user_id, body=message).execute()
+            return sent_message, None
+        except HttpError as error:
+            if 'dailylimitexceeded' in error_reason(error) or 'quotaexceeded' in error_reason(error):
+                raise DailyLimitExceeded(str(error))
+            if not is_temporary_error(error) or attempt == max_retries:
+                print(f"An error occurred: {error}")
+                return None, str(error)
+        except (OSError, TimeoutError) as error:
+            # Network errors are temporary too
+            if attempt == max_retries:
+                print(f"An error occurred: {error}")
+                return None, str(error)
+
+        delay = backoff * 2 ** attempt * random.uniform(0.8, 1.2)
+        print(f"Gmail is busy, retrying in {delay:.0f}s...")
+        time.sleep(delay)
+    
 
 ## Settings
 
-# We are going to scrape job-related emails
-priority_email_keywords = [
-    "cv",
-    "career",
-    "job",
-    "resume",
-    "hr",
-    "recruiting",
-    "recruitment",
-    "hiring",
-    "hire",
-    "humanresource",
-    "apply",
-    "application",
-    "opportunities",
-    "talent",
-    "join",
-    "employment",
-    "staffing",
-    "work",
-    "vacancy",
-    "vacancies",
-    "people",
-    "personnel",
-    "team",
-
-    # More generic emails but still more relevant than some random addresses
-    "contact",
-    "info",
-    "hello",
-    "general",
-    "inquiry",
-    "office"
-]
+# Keywords to pick the most relevant email of a company are shared with scrape_emails.py,
+# configure them in email_priority.py
 
 # Email template that is used for sending emails to companies
 email_subject = "Sitecore Development for {company} Performance Boost"
@@ -187,49 +151,191 @@ email_body = (
 
 email_attachments = ['Resume-Maksim-Shamihulau.pdf']
 
+# Token files of Gmail accounts to send from, each of them is authorized on the first run.
+# Recipients are assigned to accounts by a stable hash of their address, so follow-ups come from the same sender.
+# Don't reorder accounts, only append new ones, otherwise recipients move to other accounts.
+gmail_accounts = ['token.json']
+
+# Gmail allows up to 500 emails per rolling 24 hours per account, keep a margin.
+# Emails are spread evenly over the day, sends of previous runs logged in the leads database count too.
+emails_per_day = 450
+emails_per_minute = 5
+
+# Leads database every sent email is logged to, emails already sent according to it are skipped.
+# Companies are read from it too if it's given as the input file.
+lead_store_path = 'leads.db'
+
+# Companies read from the leads database at a time, the database is not kept locked for reading while they are sent
+companies_page_size = 100
+
 
 ## Main
 
-# Load companies from input file
-input_file = sys.argv[1] or 'companies.json'
+# Special value indicating the authenticated user to avoid emails being flagged with warning 
+sender = "me"
 
-with open(input_file, 'r') as f:
-    companies = json.load(f)
+def make_message_builder():
+    """Templates and attachments are prepared once for all emails"""
+    return MessageBuilder(sender, email_subject, email_body, email_attachments)
 
-if not companies:
-    print(f"No companies found in the input file {input_file}")
-    sys.exit(1)
+def recipients(companies, store):
+    """Company and its most relevant email, for companies that weren't mailed yet"""
+    for company in companies:
+        emails = company.get('emails')
 
-# After Gmail authentication our credentials will be stored here
-creds = None
+        # Skip if no email found
+        if not emails: continue
 
-for company in companies:
-    emails = company.get('emails')
+        recipient = most_relevant_email_or_default(emails, priority_email_keywords)
 
-    # Skip if no email found
-    if not emails: continue
+        # Skip companies mailed by previous runs
+        if store.was_sent(recipient, company_key(company)):
+            continue
 
-    recipient = most_relevant_email_or_default(emails, priority_email_keywords)
-    
-    # Special value indicating the authenticated user to avoid emails being flagged with warning 
-    sender = "me"
-    to = recipient 
-    subject = email_subject.format(company=company['name'])
-    body = email_body.format(company=company['name'])
-
-    # Authenticate(or get token) with Gmail API if not already
-    if not creds or creds.token_state != TokenState.FRESH:
-        creds = auth()
-        service = build('gmail', 'v1', credentials=creds)
-
-    email = create_message(sender, to, subject, body, email_attachments)
-    result = send_email(service, 'me', email)
-
-    if result:
-        print(f"Email sent to {to} successfully.")
-    else:
-        print(f"An error occurred sending email to {to}.")
-
-    # Throttle sending since Gmail has limit of 500 emails/day 
-    # There are some mentions suggesting to send an email not often than every 3 min
-    time.sleep(3 * 60)
\ No newline at end of file
+        yield company, recipient
+
+def account_pacer(store, account):
+    # Sends of the last 24 hours count to the daily quota of the account
+    return QuotaPacer(emails_per_minute, emails_per_day, store.sent_times(time.time() - QuotaPacer.DAY, account))
+
+def send_worker(account, jobs, results, message_builder, store_path):
+    """Send (company, recipient) jobs from the account within its own quota until None job"""
+    # SQLite connection can't be shared between threads.
+    # Sends through a stand-in service aren't real, they are logged in memory only and never count as sent.
+    store = LeadStore(':memory:' if account.stand_in else store_path)
+    pacer = account_pacer(store, account.token_path)
+    daily_limit_exceeded = False
+
+    while True:
+        job = jobs.get()
+        if job is None: break
+        # Keep taking jobs so the main thread isn't blocked, they are sent on the next run
+        if daily_limit_exceeded: continue
+
+        company, to = job
+        # Another company may have the same email
+        if store.was_sent(to, company_key(company)): continue
+
+        try:
+            email = message_builder.build(to, company=company['name'])
+        except ValueError as error:
+            print(f"Email to {to!r} is skipped: {error}")
+            store.log_send(company_key(company), to, 'failed', error=str(error), account=account.token_path)
+            continue
+
+        # Wait for the quota, the whole daily quota is spread over the day
+        pacer.wait()
+
+        # Logged before sending, so the email is never sent twice even if the run is killed right after sending
+        send_id = store.log_send(company_key(company), to, 'sending', account=account.token_path)
+        try:
+            result, error = send_email(account.service(), 'me', email)
+        except DailyLimitExceeded as error:
+            store.update_send(send_id, 'failed', error=str(error))
+            print(f"Gmail daily sending limit of {account.token_path} is exceeded, run again later to continue.")
+            daily_limit_exceeded = True
+            continue
+
+        if result:
+            print(f"Email sent to {to} from {account.token_path} successfully.")
+            store.update_send(send_id, 'sent', result.get('id'))
+            results[account.token_path] += 1
+        else:
+            print(f"An error occurred sending email to {to} from {account.token_path}.")
+            store.update_send(send_id, 'failed', error=error)
+
+    store.close()
+
+def authorized_accounts(fake_gmail=False):
+    accounts = [GmailAccount(token_path, FakeGmailService(token_path) if fake_gmail else None) for token_path in gmail_accounts]
+
+    # Authorize all accounts before sending, authorization may need the user
+    for account in accounts:
+        account.service()
+    return accounts
+
+class Senders:
+    """Every account sends from its own thread with its own quota, so throughput grows with the number of accounts"""
+
+    def __init__(self, accounts, message_builder, store_path):
+        self.jobs = { account.token_path: Queue(maxsize=1000) for account in accounts }
+        self.sent_counts = Counter()
+        self.threads = [
+            threading.Thread(target=send_worker, args=(account, self.jobs[account.token_path], self.sent_counts, message_builder, store_path), daemon=True)
+            for account in accounts
+        ]
+        for thread in self.threads: thread.start()
+
+    def send(self, company, recipient):
+        """Queue the email to the sending thread of the recipient account, blocks while its queue is full"""
+        self.jobs[account_for(recipient, gmail_accounts)].put((company, recipient))
+
+    def pending(self):
+        return sum(queue.qsize() for queue in self.jobs.values())
+
+    def join(self):
+        """Send all queued emails and stop"""
+        for queue in self.jobs.values(): queue.put(None)
+        for thread in self.threads: thread.join()
+
+def main():
+    parser = argparse.ArgumentParser(description='Send emails to companies with Gmail API.')
+    parser.add_argument('input_file', nargs='?', default='companies.json',
+                        help='companies file, JSON or JSONL, or leads database (.db) to take companies and their emails from')
+    parser.add_argument('--dry-run', action='store_true',
+                        help="don't send anything, only print how many emails would be sent and when sending would finish")
+    parser.add_argument('--fake-gmail', action='store_true',
+                        help='send through a local stand-in for Gmail API instead, to check a run without sending anything')
+    parser.add_argument('--outbox', metavar='DIR',
+                        help="don't send anything, only render all emails that would be sent to .eml files in the directory")
+    args = parser.parse_args()
+
+    # Companies are read one by one from the input file, JSON or JSONL, or from the leads database
+    input_file = args.input_file
+
+    store_path = input_file if input_file.endswith('.db') else lead_store_path
+    lead_store = LeadStore(store_path)
+    companies = lead_store.iter_companies(page_size=companies_page_size) if input_file.endswith('.db') else iter_companies(input_file)
+
+    if args.dry_run:
+        counts = Counter(account_for(recipient, gmail_accounts) for _, recipient in recipients(companies, lead_store))
+        finish = max((account_pacer(lead_store, account).projected_finish(count) for account, count in counts.items()),
+                     default=time.time())
+        print(f"{sum(counts.values())} emails would be sent from {len(gmail_accounts)} accounts, "
+              f"sending would finish at {datetime.fromtimestamp(finish):%Y-%m-%d %H:%M}.")
+        sys.exit(0)
+
+    message_builder = make_message_builder()
+
+    if args.outbox:
+        os.makedirs(args.outbox, exist_ok=True)
+        # Files of previous runs stay listed in the manifest, numbering continues after them
+        numbers = [name.split('-', 1)[0] for name in os.listdir(args.outbox) if name.endswith('.eml')]
+        last_number = max((int(number) for number in numbers if number.isdigit()), default=0)
+        count = 0
+        with open(os.path.join(args.outbox, 'outbox.jsonl'), 'a') as manifest:
+            for company, recipient in recipients(companies, lead_store):
+                try:
+                    message = message_builder.build_bytes(recipient, company=company['name'])
+                except ValueError as error:
+                    print(f"Email to {recipient!r} is skipped: {error}")
+                    continue
+                count += 1
+                file_name = f"{last_number + count:06d}-{recipient}.eml"
+                with open(os.path.join(args.outbox, file_name), 'wb') as f:
+                    f.write(message)
+                manifest.write(json.dumps({ 'file': file_name, 'to': recipient, 'company_id': company_key(company) }) + '\n')
+        print(f"{count} emails rendered to {args.outbox}.")
+        sys.exit(0)
+
+    accounts = authorized_accounts(args.fake_gmail)
+    senders = Senders(accounts, message_builder, store_path)
+
+    for company, recipient in recipients(companies, lead_store):
+        senders.send(company, recipient)
+    senders.join()
+
+    print(f"{sum(senders.sent_counts.values())} emails sent from {len(accounts)} accounts.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import gzip, io, zlib
+from xml.etree.ElementTree import ParseError, XMLPullParser
+
+# Content types sitemaps are served with, plain text sitemaps list one url per line
+SITEMAP_CONTENT_TYPES = [
+    'application/xml',
+    'text/xml',
+    'application/x-gzip',
+    'application/gzip',
+    'application/octet-stream',
+    'text/plain',
+]
+
+CHUNK_SIZE = 64 * 1024
+
+def sitemap_urls_from_robots(body):
+    """Urls of sitemaps listed in robots.txt `Sitemap:` lines"""
+    urls = []
+    for line in body.decode('utf-8', errors='ignore').splitlines():
+        name, _, value = line.partition(':')
+        if name.strip().lower() == 'sitemap' and value.strip():
+            urls.append(value.strip())
+    return urls
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+def iter_sitemap(body, max_size=50 * 1024 * 1024):
+    """Stream (kind, url) pairs listed in a sitemap, kind is 'sitemap' for sitemap indexes and 'url' otherwise.
+
+    Gzip sitemaps are decompressed and parsed chunk by chunk and entries are discarded
+    as soon as they are read, so neither the decompressed document nor its tree is
+    ever kept in memory. Up to `max_size` decompressed bytes are read. Truncated or
+    malformed sitemaps yield the urls read before the error.
+    """
+    stream = gzip.GzipFile(fileobj=io.BytesIO(body)) if body[:2] == b'\x1f\x8b' else io.BytesIO(body)
+    try:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk.lstrip().startswith(b'<'):
+            yield from iter_text_sitemap(chunk, stream, max_size)
+            return
+
+        parser = XMLPullParser(events=('start', 'end'))
+        root = None
+        read = 0
+        while chunk and read < max_size:
+            read += len(chunk)
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                if root is None:
+                    root = element
+                    kind = 'sitemap' if local_name(root.tag) == 'sitemapindex' else 'url'
+                    continue
+                if event != 'end':
+                    continue
+                name = local_name(element.tag)
+                if name == 'loc' and element.text and element.text.strip():
+                    yield kind, element.text.strip()
+                elif name in ('url', 'sitemap'):
+                    # Drop entries already read
+                    root.clear()
+            chunk = stream.read(CHUNK_SIZE)
+    except (ParseError, EOFError, OSError, zlib.error):
+        return
+
+def iter_text_sitemap(chunk, stream, max_size):
+    rest = b''
+    read = 0
+    while chunk and read < max_size:
+        read += len(chunk)
+        lines = (rest + chunk).split(b'\n')
+        rest = lines.pop()
+        for line in lines:
+            url = line.strip().decode('utf-8', errors='ignore')
+            if url.startswith(('http://', 'https://')):
+                yield 'url', url
+        chunk = stream.read(CHUNK_SIZE)
+    url = rest.strip().decode('utf-8', errors='ignore')
+    if url.startswith(('http://', 'https://')):
+        yield 'url', url
@@ -0,0 +1,4 @@
+import os, sys
+
+# Modules live in the repository root, the same as for benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
@@ -0,0 +1,56 @@
+import json
+from collections import Counter
+import pytest
+
+crawl_telemetry = pytest.importorskip('crawl_telemetry')
+
+class FakeSignals:
+    def connect(self, receiver, signal):
+        pass
+
+class FakeCrawler:
+    signals = FakeSignals()
+
+class FakeSpider:
+    def __init__(self):
+        self.site_pending = Counter()
+        self.done_sites = set()
+
+class FakeRequest:
+    def __init__(self, site):
+        self.meta = { 'site': site, 'company_id': site, 'download_latency': 0.5 }
+
+class FakeResponse:
+    status = 200
+    body = b'<html></html>'
+
+def test_late_responses_of_finished_sites_are_not_reported_again(tmp_path):
+    telemetry = crawl_telemetry.CrawlTelemetry(FakeCrawler(), str(tmp_path / 'telemetry.jsonl'), str(tmp_path / 'telemetry.csv'), None, 30)
+    spider = FakeSpider()
+    telemetry.spider_opened(spider)
+
+    for site in ['crawled.com', 'done.com']:
+        spider.site_pending[site] += 2
+        telemetry.response_received(FakeResponse(), FakeRequest(site), spider)
+    del spider.site_pending['crawled.com']
+    telemetry.site_crawled('crawled.com', 'crawled.com', 'crawled', 1, 0)
+    spider.done_sites.add('done.com')
+    telemetry.site_crawled('done.com', 'done.com', 'done', 1, 1)
+
+    # A request of the done site was still in flight, and no site is reported twice
+    telemetry.response_received(FakeResponse(), FakeRequest('done.com'), spider)
+    telemetry.response_received(FakeResponse(), FakeRequest('crawled.com'), spider)
+    telemetry.spider_closed(spider)
+
+    records = [json.loads(line) for line in (tmp_path / 'telemetry.jsonl').read_text().splitlines()]
+    assert [(record['site'], record['status'], record['pages']) for record in records] == [('crawled.com', 'crawled', 1), ('done.com', 'done', 1)]
+    assert telemetry.sites == {}
+
+def test_percentile_is_nearest_rank():
+    values = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+    assert crawl_telemetry.percentile(values, 50) == 5
+    assert crawl_telemetry.percentile(values, 90) == 9
+    assert crawl_telemetry.percentile(values, 99) == 10
+    # Rank 2.5 is rounded up, not to the nearest even
+    assert crawl_telemetry.percentile([1, 2, 3, 4, 5], 50) == 3
+    assert crawl_telemetry.percentile([], 50) is None
@@ -0,0 +1,65 @@
+import pytest
+
+extract_companies = pytest.importorskip('extract_companies')
+
+class FakePage:
+    url = 'https://www.linkedin.com/sales/search/company?page=1'
+
+def test_search_result_companies_are_completed_from_api_details():
+    captured = {
+        'search': { 0: [{ 'linkedin_id': '1', 'name': 'Acme', 'industry': '', 'url': None },
+                        { 'linkedin_id': '2', 'name': 'Globex', 'industry': 'Software', 'url': 'https://globex.com' }] },
+        'companies': { '1': { 'linkedin_id': '1', 'name': 'Acme Inc', 'industry': 'Retail', 'url': 'https://acme.com' } },
+    }
+    cursor = {}
+    companies = list(extract_companies.capture_search_results_page(FakePage(), 0, cursor, captured=captured))
+
+    # Attributes the search result has are kept, empty ones are filled from the details
+    assert companies == [{ 'linkedin_id': '1', 'name': 'Acme', 'industry': 'Retail', 'url': 'https://acme.com' },
+                         { 'linkedin_id': '2', 'name': 'Globex', 'industry': 'Software', 'url': 'https://globex.com' }]
+    assert cursor == { 'page': 1, 'index': 2 }
+
+def test_merge_companies_fills_missing_attributes_from_the_fallback():
+    company = { 'linkedin_id': '1', 'name': 'Acme', 'url': '' }
+    fallback = { 'linkedin_id': '1', 'name': 'Acme Inc', 'industry': 'Retail', 'url': 'https://acme.com' }
+    assert extract_companies.merge_companies(company, fallback) == \
+        { 'linkedin_id': '1', 'name': 'Acme', 'industry': 'Retail', 'url': 'https://acme.com' }
+
+def test_merge_output_companies_updates_previous_ones_with_parsed_ones():
+    previous = [{ 'linkedin_id': '1', 'name': 'Old' }, { 'name': 'No id' }, { 'linkedin_id': '2', 'name': 'Kept' }]
+    parsed = [{ 'linkedin_id': '1', 'name': 'New' }, { 'linkedin_id': '3', 'name': 'Added' }]
+    assert extract_companies.merge_output_companies(previous, parsed) == [
+        { 'linkedin_id': '1', 'name': 'New' }, { 'name': 'No id' }, { 'linkedin_id': '2', 'name': 'Kept' },
+        { 'linkedin_id': '3', 'name': 'Added' }]
+
+class FakeSearchPage:
+    def __init__(self):
+        self.visited = []
+
+    def goto(self, url):
+        self.visited.append(url)
+
+def fake_parse_page(results_by_visit):
+    def parse_page(page, start_index, cursor, pace=None):
+        companies = results_by_visit[len(page.visited) - 1]
+        yield from companies
+        return len(companies) < 25
+    return parse_page
+
+def test_empty_search_page_is_parsed_again_before_ending_results(monkeypatch):
+    monkeypatch.setattr(extract_companies, 'empty_page_backoff', 0)
+    page = FakeSearchPage()
+    # Throttled at first, then the page shows its results
+    companies = [{ 'linkedin_id': str(i) } for i in range(25)]
+    parse_page = fake_parse_page([[], companies])
+
+    assert extract_companies.parse_search_page_again_if_empty(page, 'search?page=3', parse_page, 0, lambda: None) == (companies, False)
+    assert page.visited == ['search?page=3', 'search?page=3']
+
+def test_search_page_staying_empty_ends_results(monkeypatch):
+    monkeypatch.setattr(extract_companies, 'empty_page_backoff', 0)
+    page = FakeSearchPage()
+    parse_page = fake_parse_page([[], [], []])
+
+    assert extract_companies.parse_search_page_again_if_empty(page, 'search?page=3', parse_page, 0, lambda: None) == ([], True)
+    assert len(page.visited) == extract_companies.empty_page_retries + 1
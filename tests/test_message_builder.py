@@ -0,0 +1,16 @@
+import base64
+from email import message_from_bytes
+import pytest
+from message_builder import MessageBuilder
+
+def test_line_breaks_in_subject_dont_inject_headers():
+    builder = MessageBuilder('me', 'Hello {company}', 'Hi {company}')
+    for company in ['Acme\r\nBcc: someone@example.com', 'Zürich\nBcc: someone@example.com']:
+        message = message_from_bytes(base64.urlsafe_b64decode(builder.build('hr@acme.com', company=company)['raw']))
+        assert message['Bcc'] is None
+        assert message['To'] == 'hr@acme.com'
+
+def test_line_breaks_in_recipient_are_rejected():
+    builder = MessageBuilder('me', 'Hello {company}', 'Hi {company}')
+    with pytest.raises(ValueError):
+        builder.build('hr@acme.com\nBcc: someone@example.com', company='Acme')
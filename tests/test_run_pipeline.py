@@ -0,0 +1,146 @@
+import threading, time
+from collections import Counter
+from queue import Queue
+import pytest
+from company_index import company_key
+from lead_store import LeadStore
+
+run_pipeline = pytest.importorskip('run_pipeline')
+
+class FakeSignals:
+    def connect(self, receiver, signal):
+        pass
+
+class FakeEngine:
+    def __init__(self):
+        self.requests = []
+
+    def crawl(self, request):
+        self.requests.append(request)
+
+class FakeCrawler:
+    def __init__(self):
+        self.signals = FakeSignals()
+        self.engine = FakeEngine()
+
+class FakeRequest:
+    def __init__(self, url, site):
+        self.url = url
+        self.meta = { 'site': site }
+
+class FakeSpider:
+    def site_requests(self, company):
+        site = company['url'].removeprefix('https://')
+        # Start page and robots.txt, as with sitemap discovery
+        yield FakeRequest(company['url'], site)
+        yield FakeRequest(company['url'] + '/robots.txt', site)
+
+class FakeSenders:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, company, recipient):
+        self.sent.append(recipient)
+
+def company(i):
+    return { 'linkedin_id': str(i), 'name': f'Company {i}', 'url': f'https://company{i}.com' }
+
+def make_feeder(companies, max_sites=2, site_timeout=60, leftovers=None, send_queue_size=10):
+    crawl_queue = Queue()
+    for c in companies:
+        crawl_queue.put(c)
+    feeder = run_pipeline.CrawlFeeder(FakeCrawler(), crawl_queue, None, leftovers, Queue(maxsize=send_queue_size),
+                                      threading.Event(), max_sites, site_timeout, Counter())
+    feeder.spider = FakeSpider()
+    return feeder
+
+def started_sites(feeder):
+    return list(dict.fromkeys(request.meta['site'] for request in feeder.crawler.engine.requests))
+
+def test_feeder_starts_sites_as_others_finish():
+    feeder = make_feeder([company(i) for i in range(5)], max_sites=2)
+    feeder.feed()
+    assert started_sites(feeder) == ['company0.com', 'company1.com']
+    assert feeder.crawl_queue.qsize() == 3
+
+    feeder.feed()
+    assert feeder.crawl_queue.qsize() == 3
+
+    feeder.site_crawled('company0.com', '0', 'crawled', 3, 1)
+    feeder.feed()
+    assert started_sites(feeder) == ['company0.com', 'company1.com', 'company2.com']
+    assert feeder.sites_in_progress() == 2
+
+def test_feeder_starts_leftovers_first_and_every_domain_once():
+    leftovers = iter([company(0), company(1)])
+    feeder = make_feeder([{ **company(1), 'url': 'https://www.company1.com' }, company(2)], max_sites=5, leftovers=leftovers)
+    feeder.feed()
+    assert started_sites(feeder) == ['company0.com', 'company1.com', 'company2.com']
+    assert feeder.leftovers is None
+
+def test_sites_not_finished_in_time_free_their_slot():
+    feeder = make_feeder([company(i) for i in range(3)], max_sites=1, site_timeout=60)
+    feeder.feed()
+    assert started_sites(feeder) == ['company0.com']
+
+    # Its crawl is never finished e.g. a request of the site was dropped without a signal
+    feeder.sites_started['company0.com'] -= 120
+    feeder.feed()
+    assert started_sites(feeder) == ['company0.com', 'company1.com']
+    assert feeder.sites_in_progress() == 1
+
+def test_crawled_companies_overflow_to_the_backlog():
+    feeder = make_feeder([], send_queue_size=1)
+    feeder.site_crawled('company0.com', '0', 'crawled', 3, 1)
+    assert not feeder.send_backlog.is_set()
+
+    feeder.site_crawled('company1.com', '1', 'crawled', 3, 1)
+    feeder.site_crawled('company2.com', '2', 'crawled', 3, 0)
+    assert feeder.send_queue.get_nowait() == '0'
+    assert feeder.send_backlog.is_set()
+    assert feeder.progress['crawled'] == 3
+
+@pytest.fixture
+def store_path(tmp_path):
+    path = str(tmp_path / 'leads.db')
+    with LeadStore(path) as store:
+        companies = [company(i) for i in range(5)]
+        store.upsert_companies(companies)
+        for c in companies:
+            store.set_crawl_status(c['url'].removeprefix('https://'), company_key(c), 'crawled', 3, 1)
+        store.add_emails([{ 'company_id': company_key(c), 'site': c['url'].removeprefix('https://'),
+                            'email': f"hr@{c['url'].removeprefix('https://')}" } for c in companies])
+        store.log_send(company_key(companies[4]), 'hr@company4.com', 'sent')
+    return path
+
+def test_dispatcher_sends_queued_and_backlog_companies_once(store_path):
+    send_queue = Queue()
+    send_backlog = threading.Event()
+    send_backlog.set()
+    senders = FakeSenders()
+
+    # Queued companies are in the backlog too, their sends may not be logged yet when the backlog is read
+    for i in [0, 1, 1]:
+        send_queue.put(str(i))
+    send_queue.put(None)
+    run_pipeline.send_dispatcher(send_queue, send_backlog, senders, store_path, 2)
+
+    assert sorted(senders.sent) == [f'hr@company{i}.com' for i in range(4)]
+
+def test_dispatcher_reads_the_backlog_when_the_queue_overflowed(store_path):
+    send_queue = Queue()
+    send_backlog = threading.Event()
+    senders = FakeSenders()
+    dispatcher = threading.Thread(target=run_pipeline.send_dispatcher, args=(send_queue, send_backlog, senders, store_path, 2))
+    dispatcher.start()
+
+    send_queue.put('0')
+    deadline = time.monotonic() + 5
+    while not senders.sent and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert senders.sent == ['hr@company0.com']
+
+    send_backlog.set()
+    send_queue.put(None)
+    dispatcher.join(timeout=5)
+    assert sorted(senders.sent) == [f'hr@company{i}.com' for i in range(4)]
@@ -0,0 +1,131 @@
+import json, sqlite3, time
+import pytest
+from lead_store import LEGACY_SEND_ACCOUNT, LeadStore
+from message_builder import MessageBuilder
+from rate_limit import QuotaPacer
+
+@pytest.fixture
+def store(tmp_path):
+    with LeadStore(str(tmp_path / 'leads.db')) as store:
+        yield store
+
+def test_sent_times_are_counted_per_account(store):
+    store.log_send('1', 'hr@a.com', 'sent', account='a.json')
+    store.log_send('2', 'hr@b.com', 'sent', account='b.json')
+    store.log_send('3', 'jobs@b.com', 'sending', account='b.json')
+    store.log_send('4', 'cv@b.com', 'failed', account='b.json')
+
+    since = time.time() - QuotaPacer.DAY
+    assert len(store.sent_times(since, 'a.json')) == 1
+    assert len(store.sent_times(since, 'b.json')) == 2
+    assert len(store.sent_times(since)) == 3
+
+def test_quota_pacer_is_seeded_with_sends_of_its_account_only(store):
+    for i in range(3):
+        store.log_send(str(i), f'hr@{i}.com', 'sent', account='a.json')
+
+    since = time.time() - QuotaPacer.DAY
+    full = QuotaPacer(5, 3, store.sent_times(since, 'a.json'))
+    empty = QuotaPacer(5, 3, store.sent_times(since, 'b.json'))
+    assert full.day_window.try_acquire() > 0
+    assert empty.day_window.try_acquire() == 0
+
+def test_sends_logged_before_accounts_count_to_the_legacy_account(tmp_path):
+    path = str(tmp_path / 'old.db')
+    connection = sqlite3.connect(path)
+    connection.execute('''CREATE TABLE send_log (id INTEGER PRIMARY KEY AUTOINCREMENT, company_key TEXT, linkedin_id TEXT,
+                          domain TEXT, email TEXT NOT NULL, status TEXT NOT NULL, message_id TEXT, error TEXT, sent_at REAL NOT NULL)''')
+    connection.execute("INSERT INTO send_log (email, status, sent_at) VALUES ('hr@a.com', 'sent', ?)", (time.time(),))
+    connection.commit()
+    connection.close()
+
+    with LeadStore(path) as store:
+        since = time.time() - QuotaPacer.DAY
+        assert len(store.sent_times(since, LEGACY_SEND_ACCOUNT)) == 1
+        assert store.sent_times(since, 'other.json') == []
+
+def test_account_for_is_stable():
+    send_emails = pytest.importorskip('send_emails')
+    accounts = ['a.json', 'b.json', 'c.json']
+    recipients = [f'hr@company{i}.com' for i in range(300)]
+
+    assigned = [send_emails.account_for(recipient, accounts) for recipient in recipients]
+    assert assigned == [send_emails.account_for(recipient, list(accounts)) for recipient in recipients]
+    assert assigned == [send_emails.account_for(recipient.upper(), accounts) for recipient in recipients]
+    # Every account gets a share of recipients
+    assert set(assigned) == set(accounts)
+
+def test_fake_gmail_service_sends(monkeypatch):
+    send_emails = pytest.importorskip('send_emails')
+    from fake_gmail import FakeGmailService
+
+    service = FakeGmailService('a.json', latency=0)
+    message, error = send_emails.send_email(service, 'me', { 'raw': 'message' })
+    assert error is None
+    assert service.sent == [{ **message, 'raw': 'message' }]
+    assert message['account'] == 'a.json'
+
+    throttled = FakeGmailService('a.json', latency=0, throttle_rate=1)
+    message, error = send_emails.send_email(throttled, 'me', { 'raw': 'message' }, max_retries=0)
+    assert message is None and '429' in error
+    assert throttled.sent == []
+
+def test_fake_gmail_sends_are_not_logged_to_the_leads_database(tmp_path, monkeypatch):
+    send_emails = pytest.importorskip('send_emails')
+    from fake_gmail import FakeGmailService
+
+    accounts = ['a.json', 'b.json']
+    monkeypatch.setattr(send_emails, 'gmail_accounts', accounts)
+    # Quotas that don't make the test wait
+    monkeypatch.setattr(send_emails, 'emails_per_minute', 60_000)
+    monkeypatch.setattr(send_emails, 'emails_per_day', 1000 * QuotaPacer.DAY)
+
+    services = { token_path: FakeGmailService(token_path, latency=0) for token_path in accounts }
+    store_path = str(tmp_path / 'leads.db')
+    senders = send_emails.Senders([send_emails.GmailAccount(token_path, services[token_path]) for token_path in accounts],
+                                  MessageBuilder('me', 'Hello {company}', 'Hi {company}'), store_path)
+    companies = [{ 'linkedin_id': str(i), 'name': f'Company {i}' } for i in range(10)]
+    for company in companies:
+        senders.send(company, f"hr@company{company['linkedin_id']}.com")
+    senders.join()
+
+    assert sum(len(service.sent) for service in services.values()) == 10
+    assert sum(senders.sent_counts.values()) == 10
+    with LeadStore(store_path) as store:
+        assert store.sent_times(0) == []
+        assert not store.was_sent('hr@company0.com', '0')
+
+def test_companies_are_read_in_pages(store):
+    store.upsert_companies([{ 'linkedin_id': str(i), 'url': f'https://company{i}.com', 'emails': [f'hr@company{i}.com'] }
+                            for i in range(5)])
+    for i in range(5):
+        store.set_crawl_status(f'company{i}.com', str(i), 'crawled')
+
+    for page_size in [1, 2, 5, 10]:
+        companies = store.companies_to_send(page_size)
+        first = next(companies)
+        # No read transaction is left open between pages, writes of other connections can be checkpointed
+        assert not store.connection.in_transaction
+        assert [first, *companies] == list(store.companies_to_send())
+    assert [c['linkedin_id'] for c in store.companies_to_send(2)] == ['0', '1', '2', '3', '4']
+
+def test_outbox_runs_keep_files_of_previous_runs(tmp_path, monkeypatch):
+    send_emails = pytest.importorskip('send_emails')
+
+    input_path = tmp_path / 'companies.json'
+    input_path.write_text(json.dumps([{ 'linkedin_id': str(i), 'name': f'Company {i}', 'emails': [f'hr@company{i}.com'] }
+                                      for i in range(2)]))
+    outbox = tmp_path / 'outbox'
+    monkeypatch.setattr(send_emails, 'lead_store_path', str(tmp_path / 'leads.db'))
+    monkeypatch.setattr(send_emails, 'make_message_builder', lambda: MessageBuilder('me', 'Hello {company}', 'Hi {company}'))
+    monkeypatch.setattr('sys.argv', ['send_emails.py', str(input_path), '--outbox', str(outbox)])
+
+    for _ in range(2):
+        with pytest.raises(SystemExit):
+            send_emails.main()
+
+    files = sorted(path.name for path in outbox.glob('*.eml'))
+    assert files == ['000001-hr@company0.com.eml', '000002-hr@company1.com.eml',
+                     '000003-hr@company0.com.eml', '000004-hr@company1.com.eml']
+    manifest = [json.loads(line) for line in (outbox / 'outbox.jsonl').read_text().splitlines()]
+    assert [record['file'] for record in manifest] == files